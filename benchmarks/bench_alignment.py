@@ -0,0 +1,251 @@
+"""
+@brief: fmt3x / match parsing on large synthetic alignment files
+
+For every size, times and measures the peak traced memory of:
+ - the columnar parse (ScoreParser/MatchParser.parse_file), with the memory still held by the parser afterwards
+ - the columnar parse followed by materializing every note dataclass (what the lazy views avoid)
+ - for match files, a per-line parse allocating one MatchNote per line (the previous MatchParser)
+and the time of create_fmt3x_mapping on notes of the same score, and of converting every pitch name of the match
+file to MIDI (per name, vectorized, and on the label codes of the columnar table).
+IOI ratios of a synthetic performance of the same size are computed with MIDIAlignmentParser and with a per-note
+loop (the previous implementation), and both results are checked to be equal.
+MatchParser.to_midi is timed against the previous exporter building mido messages; both files must be identical.
+
+    python benchmarks/bench_alignment.py --sizes 10000 100000 --output bench_alignment.json
+"""
+import argparse
+import filecmp
+import os
+import random
+import tempfile
+import tracemalloc
+
+import mido
+
+from bench_util import measure, write_results, print_results, synthetic_score_midi
+
+from pico.pneno.interpolator import IOI_PLACEHOLDER
+from pico.pneno.pneno_seq import PnenoPitch, create_pneno_seq_from_midi, convert_onsets_to_ioi
+from pico.util.alignment_parser import ScoreParser, MatchParser, MatchNote, MIDIAlignmentParser, create_fmt3x_mapping
+from pico.util.midi_util import pitch_name_to_midi, pitch_names_to_midi, midi_to_pitch_name, seconds_to_ticks, \
+    convert_abs_to_delta_time
+
+PITCHES = [f'{name}{octave}' for octave in range(1, 8) for name in ('C', 'C#', 'D', 'Eb', 'E', 'F', 'F#', 'G',
+                                                                    'Ab', 'A', 'Bb', 'B')]
+
+
+def write_synthetic_files(n_notes, directory, seed=0):
+    """
+    Chords of 1 to 4 notes, one per 240 ticks. Every score note is matched, plus 5% of extra notes.
+    :return: (fmt3x path, match path)
+    """
+    rng = random.Random(seed)
+    score_lines, match_lines, score_ids = ['//Fmt3xVersion: 170225', '//TPQN: 480'], ['//Version: synthetic'], []
+    n, chord = 0, 0
+    while n < n_notes:
+        size = min(rng.randint(1, 4), n_notes - n)
+        ids = [f'P1-{chord // 8 + 1}-{n + k}' for k in range(size)]
+        pitches = rng.sample(PITCHES, size)
+        score_lines.append('\t'.join([str(chord * 240), str(chord // 8), '0', '1', '0', '0', 'chord', '240',
+                                      str(size)] + pitches + ['N'] * size + ids))
+        score_ids.extend(zip(ids, pitches, [chord * 240] * size))
+        n += size
+        chord += 1
+    t = 0.0
+    for i, (note_id, pitch, score_time) in enumerate(score_ids):
+        t += rng.uniform(0, 0.2)
+        match_lines.append('\t'.join(map(str, [i, f'{t:.6f}', f'{t + 0.3:.6f}', pitch, rng.randint(30, 100), 80, 0, 0,
+                                               score_time, note_id, 0, 0])))
+        if rng.random() < 0.05:
+            match_lines.append('\t'.join(map(str, [f'x{i}', f'{t:.6f}', f'{t + 0.1:.6f}', rng.choice(PITCHES), 40,
+                                                   80, 0, 0, -1, '*', 3, '-'])))
+    fmt3x_path = os.path.join(directory, f'{n_notes}_fmt3x.txt')
+    match_path = os.path.join(directory, f'{n_notes}_match.txt')
+    with open(fmt3x_path, 'w') as f:
+        f.write('\n'.join(score_lines) + '\n')
+    with open(match_path, 'w') as f:
+        f.write('\n'.join(match_lines) + '\n')
+    return fmt3x_path, match_path
+
+
+def per_line_parse_match(path):
+    notes = {}
+    with open(path) as f:
+        for line in f:
+            if line.startswith('//'):
+                continue
+            parts = line.strip().split('\t')
+            notes[parts[0]] = MatchNote(id=parts[0], onset_time=float(parts[1]), offset_time=float(parts[2]),
+                                        pitch=parts[3], onset_velocity=int(parts[4]), offset_velocity=int(parts[5]),
+                                        channel=int(parts[6]), match_status=parts[7], score_time=float(parts[8]),
+                                        score_note_id=parts[9], error_index=int(parts[10]), skip_index=parts[11])
+    return notes
+
+
+def parse(parser_cls, path, materialize=False):
+    parser = parser_cls()
+    parser.parse_file(path)
+    if materialize:
+        for _ in parser.notes.values():
+            pass
+    return parser
+
+
+def bench_mapping(fmt3x_path, repeat):
+    score_info = parse(ScoreParser, fmt3x_path)
+    notes = [PnenoPitch(pitch=pitch_name_to_midi(e.pitch), velocity=64, onset=int(e.score_time),
+                        offset=int(e.score_time + e.duration)) for e in score_info.notes.values()]
+    onsets = [e.onset for e in notes]
+
+    def run():
+        for e in notes:
+            e.id = None
+        score_info.__dict__.pop('pitch_index', None)  # Include building the index
+        create_fmt3x_mapping(score_info, notes, onsets)
+
+    return measure(run, repeat=repeat)
+
+
+def bench_pitch_names(match_path, repeat):
+    table = parse(MatchParser, match_path).table
+    names = [table.labels[e] for e in table.notes['pitch'].tolist()]
+    return [{'name': 'pitch names: per name', **measure(lambda: [pitch_name_to_midi(e) for e in names], repeat=repeat)},
+            {'name': 'pitch names: vectorized', **measure(lambda: pitch_names_to_midi(names), repeat=repeat)},
+            {'name': 'pitch names: columnar labels', **measure(table.midi_pitches, repeat=repeat)}]
+
+
+def synthetic_alignment(n_notes, directory, acc_per_key=8, seed=0):
+    """
+    MIDIAlignmentParser of a synthetic score and of a performance with onset noise, built without MIDI files
+    """
+    rng = random.Random(seed)
+    parser = MIDIAlignmentParser.__new__(MIDIAlignmentParser)
+    parser.pneno_seq = create_pneno_seq_from_midi(synthetic_score_midi(n_notes // (acc_per_key + 1),
+                                                                       acc_per_key=acc_per_key))
+    notes, onsets = parser.pneno_seq.flatten()
+    lines = []
+    for i, (e, onset) in enumerate(zip(notes, onsets)):
+        e.id = f'n{i}'
+        t = parser.pneno_seq.ticks_to_seconds(onset) * 1.1 + rng.gauss(0, 0.01)
+        lines.append('\t'.join(map(str, [i, f'{t:.6f}', f'{t + 0.2:.6f}', midi_to_pitch_name(e.pitch), 64, 64, 0, 0,
+                                         onset, e.id, 0, 0])))
+    match_path = os.path.join(directory, f'{n_notes}_ioi_match.txt')
+    with open(match_path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    parser.match_info = MatchParser()
+    parser.match_info.parse_file(match_path)
+    parser.score_info = ScoreParser()
+    parser.score_info.notes = dict.fromkeys(e.id for e in notes)  # Only the note count is used
+    return parser
+
+
+def per_note_ioi_ratio(parser: MIDIAlignmentParser):
+    """
+    Previous calculate_perf_ioi and calculate_performed_pno_ioi_ratio: one score_map lookup per note
+    """
+    pno_seq, score_map = parser.pneno_seq, parser.match_info.score_map
+    score_key_ioi_list = [pno_seq.ticks_to_seconds(e - IOI_PLACEHOLDER) for e in pno_seq.to_ioi_list()]
+    score_sgmt_ioi_list = [[pno_seq.ticks_to_seconds(i) for i in convert_onsets_to_ioi([p.onset for p in e.sgmt])]
+                           for e in pno_seq.seq]
+    perf_key_onsets, sgmt_ioi_list = [], []
+    for e in pno_seq.seq:
+        key_onset = score_map[e.key.id].onset_time
+        perf_key_onsets.append(key_onset)
+        sgmt_ioi_list.append(convert_onsets_to_ioi([max(score_map[note.id].onset_time - key_onset, 0)
+                                                    for note in e.sgmt]))
+    key_ioi_ratio = [e / score_key_ioi_list[i] if e != 0 else 1
+                     for i, e in enumerate(convert_onsets_to_ioi(perf_key_onsets))]
+    sgmt_ioi_ratio = [[p / score_sgmt_ioi_list[i][j] if score_sgmt_ioi_list[i][j] != 0 else 1
+                       for j, p in enumerate(sgmt)] for i, sgmt in enumerate(sgmt_ioi_list)]
+    return key_ioi_ratio, sgmt_ioi_ratio
+
+
+def bench_ioi_ratio(n_notes, directory, repeat):
+    parser = synthetic_alignment(n_notes, directory)
+    if parser.calculate_performed_pno_ioi_ratio() != per_note_ioi_ratio(parser):
+        raise AssertionError("IOI ratios differ from the per-note implementation")
+    return [{'name': 'IOI ratio: per note', **measure(lambda: per_note_ioi_ratio(parser), repeat=repeat)},
+            {'name': 'IOI ratio: lists', **measure(parser.calculate_performed_pno_ioi_ratio, repeat=repeat)},
+            {'name': 'IOI ratio: arrays', **measure(parser.performed_pno_ioi_ratio_arrays, repeat=repeat)}]
+
+
+def mido_match_to_midi(match_info: MatchParser, fpath):
+    """
+    Previous MatchParser.to_midi (matched notes): two mido messages per note, sorted, then saved by mido
+    """
+    midi = mido.MidiFile()
+    track = mido.MidiTrack()
+    midi.tracks.append(track)
+    midi_list = []
+    for nid in match_info.matched_notes:
+        note = match_info.notes[nid]
+        for kind, t in (('note_on', note.onset_time), ('note_off', note.offset_time)):
+            midi_list.append(mido.Message(type=kind, note=pitch_name_to_midi(note.pitch), velocity=note.onset_velocity,
+                                          channel=note.channel, time=seconds_to_ticks(t)))
+    midi_list.sort(key=lambda e: (e.time, e.note))
+    convert_abs_to_delta_time(midi_list)
+    track.extend(midi_list)
+    midi.save(fpath)
+
+
+def bench_export(match_path, directory, repeat):
+    match_info = parse(MatchParser, match_path)
+    paths = [os.path.join(directory, e) for e in ('mido.mid', 'direct.mid')]
+    results = [{'name': 'to_midi: mido messages', **measure(lambda: mido_match_to_midi(match_info, paths[0]),
+                                                             repeat=repeat)},
+               {'name': 'to_midi: direct', **measure(lambda: match_info.to_midi(paths[1]), repeat=repeat)}]
+    if not filecmp.cmp(*paths, shallow=False):
+        raise AssertionError("MatchParser.to_midi differs from the mido exporter")
+    return results
+
+
+def traced_memory(func):
+    """
+    :return: (bytes still allocated by the result, peak bytes while parsing)
+    """
+    tracemalloc.start()
+    result = func()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return retained, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Alignment file parsing benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000], help="Number of score notes")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', type=str, default='bench_alignment.json')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.sizes:
+            fmt3x_path, match_path = write_synthetic_files(n, tmp)
+            cases = [
+                ('fmt3x: columnar', lambda: parse(ScoreParser, fmt3x_path)),
+                ('fmt3x: columnar + all notes', lambda: parse(ScoreParser, fmt3x_path, materialize=True)),
+                ('match: columnar', lambda: parse(MatchParser, match_path)),
+                ('match: columnar + all notes', lambda: parse(MatchParser, match_path, materialize=True)),
+                ('match: per-line dataclasses', lambda: per_line_parse_match(match_path)),
+            ]
+            for name, func in cases:
+                timing = measure(func, repeat=args.repeat)
+                retained, peak = traced_memory(func)
+                results.append({'name': name, 'case': f'{n} notes', 'retained_mib': retained / 2 ** 20,
+                                'peak_mib': peak / 2 ** 20, **timing})
+            results.append({'name': 'create_fmt3x_mapping', 'case': f'{n} notes',
+                            **bench_mapping(fmt3x_path, args.repeat)})
+            results.extend({'case': f'{n} notes', **e} for e in bench_pitch_names(match_path, args.repeat))
+            results.extend({'case': f'{n} notes', **e} for e in bench_ioi_ratio(n, tmp, args.repeat))
+            results.extend({'case': f'{n} notes', **e} for e in bench_export(match_path, tmp, args.repeat))
+    print_results(results)
+    for e in results:
+        if 'peak_mib' in e:
+            print(f"{e['name']:<40} {e['case']:<28} retained {e['retained_mib']:8.1f}MiB  "
+                  f"peak {e['peak_mib']:8.1f}MiB")
+    write_results(args.output, 'alignment', results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""
+@brief: Benchmark suite for score loading, segment rendering, interpolation and scheduling
+
+Times, on the bundled example scores and on synthetic scores of increasing size:
+ - create_pneno_seq_from_midi_file
+ - PnenoSeq.flatten / PnenoSeq.to_midi_seq, and the PnenoArray equivalents
+ - PnenoSegment.to_midi_seq (every segment of the score)
+ - IFPSpeedInterpolator.interpolate / DMAVelocityInterpolator.interpolate (one call per key)
+ - IFPSpeedInterpolator.interpolate_batch (one call for the whole score)
+ - MidiScheduler: entering and dispatching events
+
+    python benchmarks/bench_core.py --output bench_core.json
+
+Compare two result files to track regressions between releases:
+
+    python benchmarks/bench_core.py --compare old.json new.json
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import tempfile
+
+from bench_util import measure, synthetic_score_midi, write_results, print_results, EXAMPLE_SCORES
+
+from pico.logger import logger
+from pico.pneno.interpolator import IFPSpeedInterpolator, DMAVelocityInterpolator, IOI_PLACEHOLDER
+from pico.pneno.midi_scheduler import MidiScheduler
+from pico.pneno.pneno_array import PnenoArray
+from pico.pneno.pneno_seq import create_pneno_seq_from_midi_file
+
+
+def bench_score(case, midi_path, repeat):
+    results = []
+
+    def add(name, timing, **extra):
+        results.append({'name': name, 'case': case, **timing, **extra})
+
+    add('create_pneno_seq_from_midi_file', measure(lambda: create_pneno_seq_from_midi_file(midi_path), repeat))
+    pno_seq = create_pneno_seq_from_midi_file(midi_path)
+    n_notes = len(pno_seq.flatten()[0])
+    add('PnenoSeq.flatten', measure(pno_seq.flatten, repeat), notes=n_notes)
+    add('PnenoSeq.to_midi_seq', measure(pno_seq.to_midi_seq, repeat), notes=n_notes)
+    add('PnenoArray.from_pneno_seq', measure(lambda: PnenoArray.from_pneno_seq(pno_seq), repeat), notes=n_notes)
+    array = PnenoArray.from_pneno_seq(pno_seq)
+    add('PnenoArray.to_ioi', measure(array.to_ioi, repeat), notes=n_notes)
+    add('PnenoArray.to_midi_events', measure(array.to_midi_events, repeat), notes=n_notes)
+
+    def render_segments():
+        for sgmt in pno_seq:
+            sgmt.to_midi_seq(use_absolute_time=True, include_key=False, start_from_zero=True)
+
+    add('PnenoSegment.to_midi_seq', measure(render_segments, repeat), segments=len(pno_seq.seq))
+    return results
+
+
+def bench_interpolators(n_keys, repeat):
+    rng = random.Random(0)
+    score_ioi = [IOI_PLACEHOLDER] + [rng.choice([120, 240, 480]) for _ in range(n_keys - 1)]
+    perf_ioi = [max(1, int(e * rng.uniform(0.8, 1.2))) for e in score_ioi]
+    velocities = [rng.randint(30, 110) for _ in range(n_keys)]
+    state = {}
+
+    def setup():
+        state['ifp'] = IFPSpeedInterpolator()
+        state['ifp'].load_score(score_ioi)
+        state['dma'] = DMAVelocityInterpolator()
+
+    def run_ifp():
+        for e in perf_ioi[:-1]:  # The last key has no following IOI
+            state['ifp'].interpolate(e)
+
+    def run_ifp_batch():
+        state['ifp'].interpolate_batch(perf_ioi[:-1])
+
+    def run_dma():
+        for e in velocities:
+            state['dma'].interpolate(e)
+
+    case = f'{n_keys} keys'
+    return [{'name': 'IFPSpeedInterpolator.interpolate', 'case': case, **measure(run_ifp, repeat, setup=setup)},
+            {'name': 'IFPSpeedInterpolator.interpolate_batch', 'case': case,
+             **measure(run_ifp_batch, repeat, setup=setup)},
+            {'name': 'DMAVelocityInterpolator.interpolate', 'case': case, **measure(run_dma, repeat, setup=setup)}]
+
+
+def bench_scheduler(n_events, repeat):
+    rng = random.Random(0)
+    deadlines = [rng.uniform(0, 60) for _ in range(n_events)]
+    state = {}
+
+    def noop():
+        pass
+
+    def setup_enter():
+        state['scheduler'] = MidiScheduler(clock=lambda: 0.0)
+
+    def enter():
+        scheduler = state['scheduler']
+        for e in deadlines:
+            scheduler.enter_at(e, noop)
+
+    def setup_dispatch():
+        setup_enter()
+        enter()
+
+    def dispatch():
+        state['scheduler'].run_pending(now=float('inf'))
+
+    case = f'{n_events} events'
+    return [{'name': 'MidiScheduler.enter_at', 'case': case, **measure(enter, repeat, setup=setup_enter)},
+            {'name': 'MidiScheduler.run_pending', 'case': case, **measure(dispatch, repeat, setup=setup_dispatch)}]
+
+
+def compare(old_path, new_path, threshold):
+    with open(old_path) as f:
+        old = {(e['name'], e['case']): e for e in json.load(f)['results']}
+    with open(new_path) as f:
+        new = {(e['name'], e['case']): e for e in json.load(f)['results']}
+    for key in sorted(old.keys() & new.keys()):
+        ratio = new[key]['best_s'] / old[key]['best_s']
+        flag = 'REGRESSION' if ratio > 1 + threshold else ''
+        print(f"{key[0]:<40} {key[1]:<28} x{ratio:6.2f} {flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PiCo core benchmark suite')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000],
+                        help="Number of melody notes of the synthetic scores")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', type=str, default='bench_core.json')
+    parser.add_argument('--compare', type=str, nargs=2, metavar=('OLD', 'NEW'),
+                        help="Compare two result files instead of running the benchmarks")
+    parser.add_argument('--threshold', type=float, default=0.1, help="Relative slowdown reported as a regression")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare, threshold=args.threshold)
+        return
+
+    logger.set_level(logging.WARNING)
+    results = []
+    for e in EXAMPLE_SCORES:
+        results.extend(bench_score(os.path.basename(e), e, args.repeat))
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.sizes:
+            path = os.path.join(tmp, f'synthetic_{n}.mid')
+            synthetic_score_midi(n).save(path)
+            results.extend(bench_score(f'synthetic {n} keys', path, args.repeat))
+    for n in args.sizes:
+        results.extend(bench_interpolators(n, args.repeat))
+        results.extend(bench_scheduler(n * 4, args.repeat))
+
+    print_results(results)
+    write_results(args.output, 'core', results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+@brief: Compare PnenoSystem input modes (polling / callback / blocking)
+
+Measures, for every input mode:
+ - CPU usage of the whole process while idling and while being tapped (% of one core)
+ - input-to-key-out latency: time between sending a note-on into PnenoSystem and receiving its key note-on
+
+Requires python-rtmidi with virtual port support (CoreMIDI on macOS, ALSA on Linux).
+
+    python benchmarks/bench_input_modes.py --midi_path example_scores/sutekidane.mid --output input_modes.json
+"""
+import argparse
+import json
+import logging
+import resource
+import statistics
+import time
+
+import mido
+
+from pico.logger import logger
+from pico.pneno.pneno_seq import create_pneno_seq_from_midi_file
+from pico.pneno.pneno_system import PnenoSystem, INPUT_MODES
+
+BENCH_IN = 'pico-bench-in'
+BENCH_OUT = 'pico-bench-out'
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def find_port(names, prefix):
+    for e in names:
+        if e.startswith(prefix):
+            return e
+    raise RuntimeError(f"Virtual port {prefix} not found in {names}")
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def bench_mode(mode, midi_path, n_taps, tap_intv, idle_secs):
+    received = []
+    key_chnl = 1
+
+    def on_output(msg):
+        if msg.type == 'note_on' and msg.velocity > 0 and msg.channel == key_chnl:
+            received.append(time.perf_counter())
+
+    with mido.open_output(BENCH_IN, virtual=True) as tapper, \
+            mido.open_input(BENCH_OUT, virtual=True, callback=on_output):
+        pno = PnenoSystem(input_port_name=find_port(mido.get_input_names(), BENCH_IN),
+                          output_port_name=find_port(mido.get_output_names(), BENCH_OUT),
+                          pneno_chnl=key_chnl, input_mode=mode)
+        pno.load_score(create_pneno_seq_from_midi_file(midi_path))
+        pno.start_realtime_capture()
+        time.sleep(0.2)
+
+        # Idle: nothing is played, only the input machinery runs
+        cpu_start, wall_start = cpu_seconds(), time.perf_counter()
+        time.sleep(idle_secs)
+        idle_cpu = (cpu_seconds() - cpu_start) / (time.perf_counter() - wall_start)
+
+        # Tapping: one note-on/note-off pair every tap_intv seconds
+        sent = []
+        cpu_start, wall_start = cpu_seconds(), time.perf_counter()
+        for _ in range(n_taps):
+            sent.append(time.perf_counter())
+            tapper.send(mido.Message('note_on', note=60, velocity=80))
+            time.sleep(tap_intv / 2)
+            tapper.send(mido.Message('note_off', note=60, velocity=0))
+            time.sleep(tap_intv / 2)
+        busy_cpu = (cpu_seconds() - cpu_start) / (time.perf_counter() - wall_start)
+        time.sleep(0.2)
+        pno.stop()
+
+    latency_ms = [(r - s) * 1000 for s, r in zip(sent, received)]
+    return {
+        'idle_cpu_percent': idle_cpu * 100,
+        'tapping_cpu_percent': busy_cpu * 100,
+        'n_sent': len(sent),
+        'n_received': len(received),
+        'latency_ms': {
+            'mean': statistics.fmean(latency_ms) if latency_ms else None,
+            'p50': percentile(latency_ms, 50),
+            'p95': percentile(latency_ms, 95),
+            'p99': percentile(latency_ms, 99),
+            'max': max(latency_ms) if latency_ms else None,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark PnenoSystem input modes')
+    parser.add_argument('--midi_path', type=str, default='example_scores/sutekidane.mid')
+    parser.add_argument('--modes', type=str, nargs='+', default=list(INPUT_MODES), choices=INPUT_MODES)
+    parser.add_argument('--taps', type=int, default=200)
+    parser.add_argument('--tap_intv', type=float, default=0.05, help="Seconds between two note-ons")
+    parser.add_argument('--idle', type=float, default=3.0, help="Seconds spent idling before tapping")
+    parser.add_argument('--output', type=str, default=None, help="Write results as JSON")
+    args = parser.parse_args()
+
+    logger.set_level(logging.WARNING)
+    results = {}
+    for mode in args.modes:
+        results[mode] = bench_mode(mode, args.midi_path, args.taps, args.tap_intv, args.idle)
+        lat = {k: v if v is not None else float('nan') for k, v in results[mode]['latency_ms'].items()}
+        print(f"{mode:>9}: idle cpu {results[mode]['idle_cpu_percent']:6.1f}% | "
+              f"tapping cpu {results[mode]['tapping_cpu_percent']:6.1f}% | "
+              f"latency p50 {lat['p50']:.3f}ms p95 {lat['p95']:.3f}ms p99 {lat['p99']:.3f}ms")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('Results saved to:', args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+@brief: Cost of logging on the keypress path
+
+Replays synthetic taps through a headless PnenoSystem (pico.pneno.simulator) with:
+ - no logging at all: every logger method replaced by a no-op (the floor)
+ - DEBUG disabled: the current LogWrapper, which checks the level before rendering any argument
+ - DEBUG disabled, eager: arguments rendered before the level check (the previous LogWrapper behaviour)
+ - DEBUG enabled, to a background (queue) handler writing to /dev/null
+and times a single disabled logger.debug() call with a mido.Message argument.
+
+    python benchmarks/bench_logging.py --output bench_logging.json
+"""
+import argparse
+import logging
+import os
+
+import mido
+from bench_util import measure, write_results, print_results, EXAMPLE_SCORES
+
+from pico.logger import logger, formatargs
+from pico.pneno.pneno_seq import create_pneno_seq_from_midi_file
+from pico.pneno.simulator import SessionSimulator, synthetic_taps
+
+LEVELS = ('debug', 'info', 'warn', 'error', 'crit')
+
+
+def set_mode(mode):
+    for name in LEVELS:
+        logger.__dict__.pop(name, None)  # Back to the LogWrapper methods
+    if mode == 'no logging':
+        for name in LEVELS:
+            setattr(logger, name, lambda *args: None)
+    elif mode == 'eager':
+        methods = {'debug': logger.logger.debug, 'info': logger.logger.info, 'warn': logger.logger.warning,
+                   'error': logger.logger.error, 'crit': logger.logger.critical}
+        for name, method in methods.items():
+            setattr(logger, name, lambda *args, method=method: method(formatargs(*args)))
+
+
+def bench_keypress_path(midi_path, repeat):
+    pno_seq = create_pneno_seq_from_midi_file(midi_path)
+    taps = synthetic_taps(pno_seq, seed=0)
+    state = {}
+
+    def setup():
+        state['sim'] = SessionSimulator(create_pneno_seq_from_midi_file(midi_path), trace_latency=False)
+
+    results = []
+    cases = [('no logging', logging.WARNING), ('DEBUG off', logging.WARNING), ('eager', logging.WARNING),
+             ('DEBUG on (background)', logging.DEBUG)]
+    for mode, level in cases:
+        set_mode('DEBUG off' if level == logging.DEBUG else mode)
+        logger.set_level(level)
+        timing = measure(lambda: state['sim'].run(taps), repeat=repeat, setup=setup)
+        timing['per_tap_us'] = timing['best_s'] / len(taps) * 1e6
+        results.append({'name': f'keypress path: {mode}', 'case': os.path.basename(midi_path), **timing})
+    set_mode(None)
+    logger.set_level(logging.WARNING)
+    return results
+
+
+def bench_disabled_call(repeat, number=100_000):
+    msg = mido.Message('note_on', note=60, velocity=80)
+    results = []
+    for mode in ('DEBUG off', 'eager'):
+        set_mode(mode)
+        timing = measure(lambda: logger.debug('Received input:', msg), repeat=repeat, number=number)
+        results.append({'name': f'logger.debug(msg): {mode}', 'case': 'mido.Message', **timing})
+    set_mode(None)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Logging overhead on the keypress path')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', type=str, default='bench_logging.json')
+    args = parser.parse_args()
+
+    logger.start_background(log_file=os.devnull)
+    for e in logger._listener.handlers:
+        if not isinstance(e, logging.FileHandler):
+            e.setLevel(logging.CRITICAL)  # Only the file sink sees DEBUG records: keep the console readable
+    logger.set_level(logging.WARNING)
+    results = bench_disabled_call(args.repeat)
+    for midi_path in EXAMPLE_SCORES:
+        results.extend(bench_keypress_path(midi_path, args.repeat))
+    logger.stop_background()
+
+    print_results(results)
+    for e in results:
+        if 'per_tap_us' in e:
+            print(f"{e['name']:<40} {e['case']:<28} {e['per_tap_us']:8.2f}us per input event")
+    write_results(args.output, 'logging', results)
+
+
+if __name__ == '__main__':
+    main()
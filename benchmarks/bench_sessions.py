@@ -0,0 +1,115 @@
+"""
+@brief: How many concurrent PnenoHost sessions one core serves within a lateness budget
+
+Every step runs N sessions for a few seconds of real time on one PnenoHost: in-memory ports, synthetic taps fed
+the way a port callback would, and accompaniment dispatched by the shared scheduler thread. N doubles until the
+p99 lateness of the accompaniment events (scheduler deadline to send) goes past the budget. The process is pinned to
+one CPU where the platform allows it.
+
+    python benchmarks/bench_sessions.py --budget_ms 5 --output bench_sessions.json
+"""
+import argparse
+import heapq
+import logging
+import os
+import resource
+import tempfile
+import threading
+import time
+
+from bench_util import synthetic_score_midi, write_results
+
+from pico.logger import logger
+from pico.pneno.interpolator import IFPSpeedInterpolator
+from pico.pneno.midi_scheduler import summarize_lateness
+from pico.pneno.pneno_host import PnenoHost
+from pico.pneno.pneno_seq import create_pneno_seq_from_midi_file
+from pico.pneno.simulator import VirtualInputPort, VirtualOutputPort, synthetic_taps
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def feed(host, taps):
+    """
+    Play the taps of every session in real time, on one thread
+    :param taps: list of (seconds since start, session name, mido.Message) sorted by time
+    """
+    start = time.perf_counter()
+    for t, name, msg in taps:
+        delay = start + t - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        host.feed(name, msg)
+
+
+def bench_step(n_sessions, score_path, duration, tempo_scale, jitter, spin_threshold=0.002):
+    host = PnenoHost(spin_threshold=spin_threshold, lateness_size=None)
+    taps = []
+    for i in range(n_sessions):
+        pno_seq = create_pneno_seq_from_midi_file(score_path)
+        host.add_session(i, VirtualInputPort(), VirtualOutputPort(), pno_seq, pneno_chnl=1, trace_latency=False,
+                         speed_interpolator=IFPSpeedInterpolator())
+        offset = duration * i / n_sessions / 8  # Sessions do not start in lockstep
+        taps.append([(t + offset, i, msg) for t, msg in
+                     synthetic_taps(pno_seq, tempo_scale=tempo_scale, jitter=jitter, seed=i) if t + offset < duration])
+    taps = list(heapq.merge(*taps, key=lambda e: e[0]))
+
+    host.start()
+    feeder = threading.Thread(target=feed, args=(host, taps))
+    cpu_start, wall_start = cpu_seconds(), time.perf_counter()
+    feeder.start()
+    feeder.join()
+    time.sleep(0.5)  # Let the last segments play
+    cpu = (cpu_seconds() - cpu_start) / (time.perf_counter() - wall_start)
+    lateness = list(host.scheduler.lateness)
+    host.stop()
+    return {'name': 'sessions', 'case': n_sessions, 'taps': len(taps), 'events': len(lateness),
+            'cpu_percent': cpu * 100, 'lateness_ms': summarize_lateness(lateness)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent PnenoHost sessions within a lateness budget')
+    parser.add_argument('--budget_ms', type=float, default=5.0, help="p99 lateness budget (milliseconds)")
+    parser.add_argument('--spin_threshold', type=float, default=0.002, help="See MidiScheduler")
+    parser.add_argument('--max_sessions', type=int, default=256)
+    parser.add_argument('--duration', type=float, default=5.0, help="Seconds of playing per step")
+    parser.add_argument('--keys', type=int, default=200, help="Keys of the synthetic score")
+    parser.add_argument('--acc_per_key', type=int, default=8, help="Accompaniment notes per key")
+    parser.add_argument('--tempo_scale', type=float, default=0.5, help="< 1 taps faster than the score")
+    parser.add_argument('--jitter', type=float, default=0.01, help="Tap timing noise (seconds)")
+    parser.add_argument('--no_pin', action='store_true', help="Do not pin the process to one CPU")
+    parser.add_argument('--output', type=str, default='bench_sessions.json')
+    args = parser.parse_args()
+
+    logger.set_level(logging.WARNING)
+    if not args.no_pin and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {min(os.sched_getaffinity(0))})
+
+    results, served = [], 0
+    with tempfile.TemporaryDirectory() as tmp:
+        score_path = os.path.join(tmp, 'synthetic.mid')
+        synthetic_score_midi(args.keys, acc_per_key=args.acc_per_key).save(score_path)
+        n = 1
+        while n <= args.max_sessions:
+            result = bench_step(n, score_path, args.duration, args.tempo_scale, args.jitter,
+                                args.spin_threshold)
+            results.append(result)
+            lateness = result['lateness_ms']
+            if not lateness['count']:
+                print(f"{n:>4} sessions: no accompaniment event dispatched, increase --duration or --keys")
+                break
+            print(f"{n:>4} sessions: {result['events']:>7} events, cpu {result['cpu_percent']:5.1f}% | "
+                  f"lateness p50 {lateness['p50']:.3f}ms p99 {lateness['p99']:.3f}ms max {lateness['max']:.3f}ms")
+            if lateness['p99'] > args.budget_ms:
+                break
+            served = n
+            n *= 2
+    print(f"Sessions served within a p99 lateness of {args.budget_ms}ms: {served}")
+    write_results(args.output, 'sessions', results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+@brief: Startup benchmark: import time of the entry points and time to the first playable note
+
+Each measurement runs in a fresh interpreter:
+ - `python -X importtime -c "import <module>"` for every entry point, with the heaviest imports reported
+ - a headless Mode 2 session (pico.pneno.simulator): imports, loading a score (from the score cache or MIDI),
+   creating PnenoSystem and handling the first key, until its accompaniment is sent
+
+    python benchmarks/bench_startup.py --output bench_startup.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from bench_util import write_results, EXAMPLE_SCORES
+
+ENTRY_POINTS = ['pico.pneno.pneno_system', 'pico.mono_pico.mono_pico', 'pico.pneno.simulator',
+                'pico.util.alignment_parser']
+
+FIRST_NOTE_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import mido
+from pico.pneno.score_cache import load_pneno_seq
+from pico.pneno.pneno_seq import create_pneno_seq_from_midi_file
+from pico.pneno.simulator import SessionSimulator
+from pico.pneno.interpolator import IFPSpeedInterpolator
+imported = time.perf_counter()
+midi_path, cache_dir = sys.argv[1], sys.argv[2]
+pno_seq = load_pneno_seq(midi_path, cache_dir) if cache_dir else create_pneno_seq_from_midi_file(midi_path)
+loaded = time.perf_counter()
+sim = SessionSimulator(pno_seq, speed_interpolator=IFPSpeedInterpolator())
+sim.system.start_headless()
+sim.system.handle_input(mido.Message('note_on', note=60, velocity=80))
+sim.advance_to(None)
+played = time.perf_counter()
+sim.system.stop()
+print(json.dumps({'import_s': imported - start, 'load_score_s': loaded - imported, 'first_note_s': played - start}))
+"""
+
+
+def import_time(module, repeat):
+    """
+    :return: (best total seconds, list of (cumulative seconds, module) of the heaviest run)
+    """
+    best, best_report = None, None
+    for _ in range(repeat):
+        stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True,
+                                text=True, check=True).stderr
+        report = []
+        for line in stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative_us, name = line.split('|')
+            report.append((int(cumulative_us) / 1e6, name.rstrip()))
+        total = report[-1][0]
+        if best is None or total < best:
+            best, best_report = total, report
+    return best, best_report
+
+
+def top_level_imports(report, n):
+    """
+    Heaviest direct imports of the measured module (the last entry of an importtime report, which lists every
+    module after its own imports, children being indented by two more spaces)
+    """
+    def indent(name):
+        return len(name) - len(name.lstrip())
+
+    root = indent(report[-1][1])
+    children = []
+    for t, name in reversed(report[:-1]):
+        if indent(name) <= root:  # Imported before the measured module (interpreter startup)
+            break
+        if indent(name) == root + 2:
+            children.append((t, name.strip()))
+    return sorted(children, reverse=True)[:n]
+
+
+def first_note(midi_path, cache_dir, repeat):
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', FIRST_NOTE_SCRIPT, midi_path, cache_dir or ''],
+                             capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(out.strip().splitlines()[-1]))
+    return min(runs, key=lambda e: e['first_note_s'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PiCo startup benchmark')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--top', type=int, default=8, help="Number of heaviest imports reported per entry point")
+    parser.add_argument('--output', type=str, default='bench_startup.json')
+    args = parser.parse_args()
+
+    results = []
+    for module in ENTRY_POINTS:
+        total, report = import_time(module, args.repeat)
+        heaviest = top_level_imports(report, args.top)
+        results.append({'name': 'import', 'case': module, 'best_s': total,
+                        'heaviest': [{'module': name, 'cumulative_s': t} for t, name in heaviest]})
+        print(f"import {module:<36} {total * 1000:9.1f}ms")
+        for t, name in heaviest:
+            print(f"    {name:<40} {t * 1000:9.1f}ms")
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for midi_path in EXAMPLE_SCORES:
+            case = os.path.basename(midi_path)
+            first_note(midi_path, cache_dir, 1)  # Fills the cache
+            for name, cache in (('first note (score cache)', cache_dir), ('first note (MIDI parsing)', None)):
+                timing = first_note(midi_path, cache, args.repeat)
+                results.append({'name': name, 'case': case, 'best_s': timing['first_note_s'], **timing})
+                print(f"{name:<28} {case:<20} {timing['first_note_s'] * 1000:9.1f}ms "
+                      f"(imports {timing['import_s'] * 1000:.1f}ms, score {timing['load_score_s'] * 1000:.1f}ms)")
+    write_results(args.output, 'startup', results)
+
+
+if __name__ == '__main__':
+    main()
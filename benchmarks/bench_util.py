@@ -0,0 +1,95 @@
+"""
+Shared helpers for the benchmark scripts: timing, synthetic scores and machine-readable results
+"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import mido
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+EXAMPLE_SCORES = [os.path.join(ROOT_DIR, 'example_scores', e) for e in ('schubert_gb.mid', 'sutekidane.mid')]
+
+
+def measure(func, repeat=5, number=1, setup=None):
+    """
+    Time func() `number` times per run, over `repeat` runs. setup() (if given) is called before each run, untimed.
+    :return: dict with the best/mean/stdev seconds per call
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number)
+    return {
+        'repeat': repeat,
+        'number': number,
+        'best_s': min(timings),
+        'mean_s': statistics.fmean(timings),
+        'stdev_s': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+    }
+
+
+def synthetic_score_midi(n_keys, acc_per_key=4, ticks_per_beat=480, tempo=500_000):
+    """
+    Two-track score: one melody note per beat, `acc_per_key` evenly spaced accompaniment notes per melody note
+    :return: mido.MidiFile
+    """
+    midi = mido.MidiFile(ticks_per_beat=ticks_per_beat)
+    acc_dur = ticks_per_beat // acc_per_key
+    tracks = [[(k * ticks_per_beat, ticks_per_beat, 72 + k % 7) for k in range(n_keys)],
+              [(k * ticks_per_beat + j * acc_dur, acc_dur, 48 + (k + j) % 12)
+               for k in range(n_keys) for j in range(acc_per_key)]]
+    for i, notes in enumerate(tracks):
+        track = mido.MidiTrack()
+        if i == 0:
+            track.append(mido.MetaMessage('set_tempo', tempo=tempo, time=0))
+        events = []
+        for onset, duration, pitch in notes:
+            events.append((onset, 1, pitch))
+            events.append((onset + duration, 0, pitch))  # note-offs first when simultaneous
+        events.sort()
+        curr = 0
+        for t, is_on, pitch in events:
+            track.append(mido.Message('note_on' if is_on else 'note_off', note=pitch, velocity=64 if is_on else 0,
+                                      time=t - curr))
+            curr = t
+        midi.tracks.append(track)
+    return midi
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT_DIR, capture_output=True,
+                                text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def write_results(path, suite, results):
+    """
+    Write benchmark results as JSON: {"suite", "environment", "results": [{"name", "case", ...timings}]}
+    """
+    data = {'suite': suite, 'environment': environment(), 'results': results}
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+    print('Results saved to:', path)
+
+
+def print_results(results):
+    for e in results:
+        print(f"{e['name']:<40} {e['case']:<28} best {e['best_s'] * 1000:10.3f}ms  mean {e['mean_s'] * 1000:10.3f}ms")
@@ -5,15 +5,10 @@ import time
 from pico.util.midi_util import choose_midi_input, array_choice, check_fluidsynth_library
 check_fluidsynth_library()
 
-
-import pico.mono_pico.music.music_seq
 from pico.logger import logger
 from pico.mono_pico.util.synthesizer import Fluidx
 from pico.pico import PiCo
-from pico.mono_pico.mono_pico import MonoPiCo
-from pico.pneno.interpolator import IFPSpeedInterpolator, parse_ifp_performance_ioi, DMAVelocityInterpolator
-from pico.pneno.pneno_seq import create_pneno_seq_from_midi_file
-from pico.pneno.pneno_system import PnenoSystem
+# Each mode's modules are imported once the mode is chosen, see create_pico_system() and create_score()
 
 modes = ['Play a sequence of notes', 'Play a complete score']
 
@@ -34,10 +29,17 @@ def create_pico_system(in_port, out_port, mode, **kwargs) -> PiCo or None:
     :return:
     """
     if mode == 1:
+        from pico.mono_pico.mono_pico import MonoPiCo
         return MonoPiCo(input_port_name=in_port, output_port_name=out_port)
     elif mode == 2:
+        from pico.pneno.interpolator import IFPSpeedInterpolator, KalmanSpeedInterpolator, \
+            parse_ifp_performance_ioi, DMAVelocityInterpolator
+        from pico.pneno.pneno_system import PnenoSystem
         # speed_interpolator = DMYSpeedInterpolator()
-        speed_interpolator = IFPSpeedInterpolator()
+        if kwargs.get('speed_interpolator') == 'kalman':
+            speed_interpolator = KalmanSpeedInterpolator()
+        else:
+            speed_interpolator = IFPSpeedInterpolator()
         if kwargs.get('ref_sess') is not None:
             score_ioi, tplt_ioi = parse_ifp_performance_ioi(kwargs.get('ref_sess'))
             speed_interpolator.load_template(score_ioi, tplt_ioi)
@@ -45,21 +47,31 @@ def create_pico_system(in_port, out_port, mode, **kwargs) -> PiCo or None:
             vel_interpolator = DMAVelocityInterpolator()
         else:
             vel_interpolator = None
+        if kwargs.get('event_loop'):
+            from pico.pneno.async_pneno_system import AsyncPnenoSystem
+            return AsyncPnenoSystem(input_port_name=in_port, output_port_name=out_port,
+                                    velocity_interpolator=vel_interpolator, speed_interpolator=speed_interpolator,
+                                    session_save_path=kwargs.get('session_save_path'),
+                                    overlap_policy=kwargs.get('overlap_policy') or 'keep')
         return PnenoSystem(input_port_name=in_port, output_port_name=out_port, velocity_interpolator=vel_interpolator,
-                           speed_interpolator=speed_interpolator, session_save_path=kwargs.get('session_save_path'))
+                           speed_interpolator=speed_interpolator, session_save_path=kwargs.get('session_save_path'),
+                           input_mode=kwargs.get('input_mode') or 'callback',
+                           overlap_policy=kwargs.get('overlap_policy') or 'keep')
     else:
         raise Exception(f"Unknown mode: {mode}")
 
 
-def create_score(mode, midi_path=None):
+def create_score(mode, midi_path=None, score_cache=True):
     if mode == 1:
-        scores = pico.mono_pico.music.music_seq.scores
+        from pico.mono_pico.music.music_seq import scores
         piece_names = scores.keys()
         choice = array_choice(0, len(piece_names))
         return scores[piece_names[choice]]
     elif mode == 2:
+        from pico.pneno.pneno_seq import create_pneno_seq_from_midi_file
+        from pico.pneno.score_cache import load_pneno_seq
         os.path.exists(midi_path)
-        return create_pneno_seq_from_midi_file(midi_path)
+        return load_pneno_seq(midi_path) if score_cache else create_pneno_seq_from_midi_file(midi_path)
 
 
 def start_interactive_session(sf_path, midi_path=None, **kwargs):
@@ -70,7 +82,7 @@ def start_interactive_session(sf_path, midi_path=None, **kwargs):
     in_port, out_port = choose_midi_input()
     mode = choose_pico_mode()
     pico_system = create_pico_system(in_port=in_port, out_port=out_port, mode=mode, **kwargs)
-    score = create_score(mode, midi_path)
+    score = create_score(mode, midi_path, score_cache=kwargs.get('score_cache', True))
     pico_system.load_score(score)
     pico_system.start_realtime_capture()
 
@@ -89,17 +101,36 @@ def main():
     parser.add_argument('--sess_save_path', type=str, required=False,
                         help='If provided, performance will be saved at the given path')
     parser.add_argument('--ref_sess', type=str, required=False,
-                        help="Path to a performance.pkl file as a reference for tempo prediction")
+                        help="Path to a perf_data.pnlog (or .pkl) file as a reference for tempo prediction")
     parser.add_argument('--interpolate_velocity', action='store_true', required=False,
                         help="Path to a performance.pkl file as a reference for tempo prediction")
+    parser.add_argument('--input_mode', type=str, required=False, default='callback',
+                        choices=['polling', 'callback', 'blocking'],
+                        help="How MIDI input is received in Mode 2 (callback by default)")
+    parser.add_argument('--speed_interpolator', type=str, required=False, default='ifp', choices=['ifp', 'kalman'],
+                        help="Tempo tracker of Mode 2: iFP heuristic (default) or Kalman filter")
+    parser.add_argument('--overlap_policy', type=str, required=False, default='keep',
+                        choices=['keep', 'drop', 'flush', 'compress'],
+                        help="What happens to the previous segment's accompaniment when you play the next key early")
+    parser.add_argument('--event_loop', action='store_true', required=False,
+                        help="Run Mode 2 on an asyncio event loop (AsyncPnenoSystem); --input_mode is ignored")
+    parser.add_argument('--log_file', type=str, required=False, help="Also append the log to this file")
+    parser.add_argument('--no_score_cache', action='store_true', required=False,
+                        help="Parse the MIDI file instead of loading its compiled score from the cache")
     args = parser.parse_args()
 
     logger.set_level(logging.INFO)
+    logger.start_background(log_file=args.log_file)  # Console/file I/O off the realtime threads
     start_interactive_session(sf_path=args.sf_path,
                               midi_path=args.midi_path,
                               session_save_path=args.sess_save_path,
                               ref_sess=args.ref_sess,
-                              interpolate_velocity=args.interpolate_velocity)
+                              interpolate_velocity=args.interpolate_velocity,
+                              input_mode=args.input_mode,
+                              speed_interpolator=args.speed_interpolator,
+                              overlap_policy=args.overlap_policy,
+                              event_loop=args.event_loop,
+                              score_cache=not args.no_score_cache)
 
 
 def debug_main():
@@ -1,4 +1,7 @@
+import atexit
 import logging
+import logging.handlers
+import queue
 
 
 class CustomFormatter(logging.Formatter):
@@ -38,6 +41,8 @@ def formatargs(*args):
 class LogWrapper:
     """
     For some reason formatter fails all the time
+
+    Arguments are only rendered (str()) when the level is enabled, so disabled calls cost a level check.
     """
     logger: logging.Logger
 
@@ -46,21 +51,68 @@ class LogWrapper:
 
     def __init__(self, logger):
         self.logger = logger
+        self._listener = None
+
+    def is_enabled(self, level):
+        return self.logger.isEnabledFor(level)
 
     def info(self, *args):
-        self.logger.info(formatargs(*args))
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info(formatargs(*args))
 
     def warn(self, *args):
-        self.logger.warning(formatargs(*args))
+        if self.logger.isEnabledFor(logging.WARNING):
+            self.logger.warning(formatargs(*args))
 
     def error(self, *args):
-        self.logger.error(formatargs(*args))
+        if self.logger.isEnabledFor(logging.ERROR):
+            self.logger.error(formatargs(*args))
 
     def crit(self, *args):
-        self.logger.critical(formatargs(*args))
+        if self.logger.isEnabledFor(logging.CRITICAL):
+            self.logger.critical(formatargs(*args))
 
     def debug(self, *args):
-        self.logger.debug(formatargs(*args))
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(formatargs(*args))
+
+    def start_background(self, log_file=None):
+        """
+        Move console (and file) output to a background thread: the calling thread only renders the message and
+        puts the record in a queue
+        :param log_file:    if provided, records are also appended to this file (without colors)
+        """
+        if self._listener is not None:
+            return
+        handlers = list(self.logger.handlers)
+        if log_file is not None:
+            file_handler = logging.FileHandler(log_file)
+            file_handler.setFormatter(logging.Formatter("%(asctime)s | %(levelname)s | %(message)s"))
+            handlers.append(file_handler)
+        for e in self.logger.handlers[:]:
+            self.logger.removeHandler(e)
+        log_queue = queue.SimpleQueue()
+        self.logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        self._listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        self._listener.start()
+        atexit.register(self.stop_background)
+
+    def stop_background(self):
+        """
+        Flush the queue and write from the calling thread again
+        """
+        if self._listener is None:
+            return
+        self._listener.stop()
+        for e in self.logger.handlers[:]:
+            self.logger.removeHandler(e)
+        for e in self._listener.handlers:
+            if isinstance(e, logging.FileHandler):
+                e.close()
+            else:
+                self.logger.addHandler(e)
+        self._listener = None
+        atexit.unregister(self.stop_background)
 
 
 logger = LogWrapper(_bmois_logger)
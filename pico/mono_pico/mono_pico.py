@@ -3,12 +3,13 @@ import threading
 
 import mido
 from collections import deque
-from threading import Thread, Timer
+from threading import Thread
 import time
 
 from pico.logger import logger
 import pico.mono_pico.music.music_seq as music
-from pico.pneno.pneno_seq import is_note_on
+from pico.util.midi_util import is_note_on
+from pico.util.ring_buffer import TimedRingBuffer
 from pico.pico import PiCo
 
 sheet = music.schubert_142_3
@@ -126,16 +127,22 @@ class MonoPiCo(PiCo):
     callback = None
     notebinder: 'NoteBinder'
 
-    def __init__(self, input_port_name, output_port_name, history_size=1500, clean_intv=5):
+    def __init__(self, input_port_name, output_port_name, history_size=1500, history_window=5, clean_intv=None):
+        """
+        :param history_size:    maximum number of recent inputs kept in self.history
+        :param history_window:  seconds of recent input kept in self.history
+        :param clean_intv:  deprecated alias of history_window
+        """
+        if clean_intv is not None:
+            logger.warn("clean_intv is deprecated, use history_window")
+            history_window = clean_intv
         self.input_port = mido.open_input(input_port_name)
         self.output_port = mido.open_output(output_port_name)
-        self.history = deque(maxlen=history_size)  # Adjust the size based on ticks and events per tick
+        self.history = TimedRingBuffer(capacity=history_size, window=history_window, clock=time.time)
         self.noteseq = NoteDeque()
         self.listening = True
         self.running_event = threading.Event()  # Event to control thread termination
         self.notebinder = NoteBinder()
-        self.clean_intv = clean_intv
-        self.cleaner = None
         self.capture_thread = None
 
     def __del__(self):
@@ -161,12 +168,6 @@ class MonoPiCo(PiCo):
                 logger.debug("Realtime capture stopped.")
             self.capture_thread = None
 
-        # Stop the cleaner timer
-        if self.cleaner and self.cleaner.is_alive():
-            self.cleaner.cancel()
-            logger.debug("Cleaner timer stopped.")
-            self.cleaner = None
-
         # Finally close the output port
         if self.output_port is not None:
             self.output_port.close()
@@ -214,7 +215,7 @@ class MonoPiCo(PiCo):
                         break
                     logger.debug('listening:', msg)
                     self.transform_and_play(self.play_next_midi, msg)
-                    self.history.append((time.time(), msg))
+                    self.history.append(msg)
                 time.sleep(0.001)
 
             except (EOFError, OSError) as e:
@@ -225,23 +226,11 @@ class MonoPiCo(PiCo):
                 logger.error(f"Unexpected error in listen loop: {e}")
                 break
 
-    def clean_history(self):
-        current_time = time.time()
-        count = 0
-        while self.history and current_time - self.history[0][0] > 5:
-            self.history.popleft()
-            count += 1
-        logger.debug("+Cleaned", count)
-        self.cleaner = Timer(self.clean_intv, self.clean_history)
-        self.cleaner.start()
-
     def start_realtime_capture(self):
         if self.listening:
             self.running_event.set()  # Set the event to start the thread
             self.capture_thread = Thread(target=self.listen)
             self.capture_thread.start()
-            self.cleaner = Timer(self.clean_intv, self.clean_history)
-            self.cleaner.start()
         else:
             logger.warn("MonoPneno is not listening to you.")
 
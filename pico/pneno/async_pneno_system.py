@@ -0,0 +1,215 @@
+"""
+asyncio implementation of PnenoSystem
+
+Input handling and accompaniment dispatch all run on one event loop: every scheduled event is a loop.call_at()
+timer, so the session starts no thread of its own.
+The only thread crossing left is the MIDI backend's input callback, handed to the loop with call_soon_threadsafe().
+
+Inside a coroutine, the system runs on the running loop:
+
+    pno = AsyncPnenoSystem(in_port, out_port)
+    pno.load_score(pno_seq)
+    pno.start_realtime_capture()
+    await pno.wait_stopped()
+
+Created outside of any loop, it runs its own loop on a background thread, and start_realtime_capture()/stop() behave
+as in PnenoSystem.
+
+Timers fire with the loop's resolution (about 1ms with epoll/kqueue), not with the sub-millisecond spin of
+MidiScheduler.
+"""
+import asyncio
+import functools
+import itertools
+import threading
+from collections import deque
+
+import mido
+
+from pico.logger import logger
+from pico.pneno.midi_scheduler import ScheduledEvent, summarize_lateness
+from pico.pneno.pneno_system import PnenoSystem
+
+
+class AsyncMidiScheduler:
+    """
+    MidiScheduler interface on an asyncio event loop. Not thread-safe: call it from the loop's thread only.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, lateness_size=10000):
+        """
+        :param loop:
+        :param lateness_size:   how many recent lateness samples to keep (None for unbounded)
+        """
+        self.loop = loop
+        self.clock = loop.time  # call_at() deadlines are expressed in loop time
+        self.lateness = deque(maxlen=lateness_size)
+        self._handles = {}  # pending ScheduledEvent -> asyncio.TimerHandle
+        self._counter = itertools.count()
+        self._running = False
+
+    def __len__(self):
+        return len(self._handles)
+
+    def is_running(self):
+        return self._running
+
+    def enter(self, delay, action, args=()):
+        return self.enter_at(self.clock() + delay, action, args)
+
+    def enter_at(self, deadline, action, args=()):
+        event = ScheduledEvent(deadline, next(self._counter), action, args, scheduler=self)
+        self._handles[event] = self.loop.call_at(deadline, self._dispatch, event)
+        return event
+
+    def next_deadline(self):
+        return min((e.deadline for e in self._handles), default=None)
+
+    def cancel(self, event: ScheduledEvent):
+        """
+        :return: whether the event was still pending
+        """
+        pending = event.pending()
+        event._cancel()
+        handle = self._handles.pop(event, None)
+        if handle is not None:
+            handle.cancel()
+        return pending
+
+    def reschedule(self, event: ScheduledEvent, deadline, args=None):
+        """
+        :return: the new ScheduledEvent handle, None if the event was already dispatched or cancelled
+        """
+        if not self.cancel(event):
+            return None
+        return self.enter_at(deadline, event.action, event.args if args is None else args)
+
+    def cancel_where(self, predicate):
+        cancelled = [e for e in self._handles if predicate(e)]
+        for e in cancelled:
+            self.cancel(e)
+        return len(cancelled)
+
+    def clear(self):
+        for e in list(self._handles):
+            self.cancel(e)
+
+    def start(self, threaded=True):
+        """
+        :param threaded: ignored, events are dispatched by the loop
+        """
+        self._running = True
+
+    def stop(self, timeout=None):
+        """
+        Events that are still scheduled are discarded
+        """
+        self._running = False
+        self.clear()
+
+    def _dispatch(self, event: ScheduledEvent):
+        self._handles.pop(event, None)
+        if event.cancelled:
+            return
+        event.dispatched = True
+        self.lateness.append(self.clock() - event.deadline)
+        try:
+            event.action(*event.args)
+        except Exception as e:
+            logger.error("Scheduled event failed:", event, e)
+
+    def lateness_summary(self):
+        return summarize_lateness(list(self.lateness))
+
+
+class AsyncPnenoSystem(PnenoSystem):
+    def __init__(self, input_port_name, output_port_name, loop: asyncio.AbstractEventLoop = None, **kwargs):
+        """
+        :param input_port_name:
+        :param output_port_name:
+        :param loop:    event loop to run on. Defaults to the running loop, or to a new loop on a background thread.
+        :param kwargs:  forwarded to PnenoSystem. Only the 'callback' input mode is supported; spin_threshold and
+            clock are ignored (the loop's clock is used).
+        """
+        if kwargs.get('input_mode', 'callback') != 'callback':
+            raise ValueError("AsyncPnenoSystem only supports the 'callback' input mode")
+        if loop is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = None
+        self._loop_thread = None
+        if loop is None:
+            loop = asyncio.new_event_loop()
+            self._loop_thread = threading.Thread(target=loop.run_forever, daemon=True)
+        self.loop = loop
+        self._stopped_future = loop.create_future()
+        super().__init__(input_port_name, output_port_name, scheduler=AsyncMidiScheduler(loop), **kwargs)
+        self._owns_scheduler = True  # Started and stopped with the session
+
+    def _in_loop(self):
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def _call_in_loop(self, func):
+        """
+        Run func() on the loop's thread and return its result
+        """
+        if self._in_loop():
+            return func()
+
+        async def call():
+            return func()
+
+        return asyncio.run_coroutine_threadsafe(call(), self.loop).result()
+
+    def start_realtime_capture(self):
+        if not self.listening:
+            logger.warn("PnenoSystem is not listening to you.")
+            return
+        if self._loop_thread is not None and not self._loop_thread.is_alive():
+            self._loop_thread.start()
+        self._call_in_loop(self._start)
+
+    def _start(self):
+        self.running_event = threading.Event()  # Checked by feed
+        self.running_event.set()
+        self.input_port.callback = self._on_port_message
+        self.midi_scheduler.start()
+        self.start_time = self.clock()
+        self.open_recorder()
+        logger.info("Pneno System started! Press any MIDI key to continue...")
+
+    def _on_port_message(self, msg: mido.Message):
+        """Input port callback, called on the MIDI backend's thread"""
+        try:
+            self.loop.call_soon_threadsafe(self.feed, msg, self.clock())  # Receipt time, before the loop hand-over
+        except RuntimeError:
+            pass  # Loop closed while stopping
+
+    def stop(self):
+        if self._stopped:
+            return
+        if self._loop_thread is not None and not self._loop_thread.is_alive():
+            PnenoSystem.stop(self)  # The loop never ran
+            self.loop.close()
+            return
+        self._call_in_loop(functools.partial(PnenoSystem.stop, self))
+        self.loop.call_soon_threadsafe(self._set_stopped)
+        if self._loop_thread is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            if threading.current_thread() is not self._loop_thread:
+                self._loop_thread.join(timeout=2.0)
+                self.loop.close()
+
+    def _set_stopped(self):
+        if not self._stopped_future.done():
+            self._stopped_future.set_result(None)
+
+    async def wait_stopped(self):
+        """
+        Wait until stop() is called (from a MIDI handler, another task or another thread)
+        """
+        await asyncio.shield(self._stopped_future)
@@ -0,0 +1,260 @@
+"""
+Hyper-parameter search for IFPSpeedInterpolator (or KalmanSpeedInterpolator) over recorded sessions
+
+Every session is replayed through the interpolator: after each key, the predicted speed of the next IOI is compared
+with the performed one. The error of a key is |log(predicted bpm ratio / performed bpm ratio)|, i.e. roughly the
+relative tempo error.
+
+Sessions are found recursively (perf_data*.pnlog / perf_data*.pkl). Performer and piece are read from the path:
+<sessions_dir>/<performer>/<piece>/perf_data*. With --template, each session uses another session of the same piece
+as its performance template.
+
+    python -m pico.pneno.ifp_search sessions/ --random 200 --workers 8
+    python -m pico.pneno.ifp_search sessions/ --interpolator kalman
+    python -m pico.pneno.ifp_search sessions/ --compare     # default parameters of every interpolator
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import random
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+
+from pico.logger import logger
+from pico.pneno.interpolator import IFPSpeedInterpolator, KalmanSpeedInterpolator, parse_ifp_performance_ioi
+
+DEFAULT_PARAMS = {'wh': .8, 'wp': .3, 'wt': .6, 'window_size': 5}
+DEFAULT_GRID = {'wh': [0.4, 0.6, 0.8, 1.0, 1.2], 'wp': [0.0, 0.15, 0.3, 0.5], 'wt': [0.0, 0.3, 0.6, 0.9],
+                'window_size': [2, 3, 5, 8]}
+RANDOM_RANGES = {'wh': (0.05, 1.5), 'wp': (0.0, 1.0), 'wt': (0.0, 1.5), 'window_size': (1, 10)}
+
+KALMAN_DEFAULT_PARAMS = {'onset_noise': .08, 'tempo_noise': .04, 'phase_noise': .02, 'gate': 3.0}
+KALMAN_GRID = {'onset_noise': [0.03, 0.05, 0.08, 0.12], 'tempo_noise': [0.01, 0.02, 0.04, 0.08],
+               'phase_noise': [0.0, 0.02, 0.05], 'gate': [2.0, 3.0, 5.0]}
+KALMAN_RANGES = {'onset_noise': (0.01, 0.2), 'tempo_noise': (0.0, 0.15), 'phase_noise': (0.0, 0.1), 'gate': (1.5, 6.0)}
+
+# name: (SpeedInterpolator class, default parameters, default grid, random search ranges)
+INTERPOLATORS = {
+    'ifp': (IFPSpeedInterpolator, DEFAULT_PARAMS, DEFAULT_GRID, RANDOM_RANGES),
+    'kalman': (KalmanSpeedInterpolator, KALMAN_DEFAULT_PARAMS, KALMAN_GRID, KALMAN_RANGES),
+}
+
+
+class Session(NamedTuple):
+    path: str
+    performer: str
+    piece: str
+    score_ioi: list
+    perf_ioi: list  # as received by the interpolator: the first element is IOI_PLACEHOLDER
+    template_ioi: list or None
+
+
+def find_sessions(root):
+    return sorted(os.path.join(d, e) for d, _, files in os.walk(root) for e in files
+                  if e.startswith('perf_data') and e.endswith(('.pnlog', '.pkl')))
+
+
+def session_labels(path, root):
+    """
+    :return: (performer, piece) from <root>/<performer>/<piece>/perf_data*, '-' when the path is shallower
+    """
+    parts = [e for e in os.path.relpath(os.path.dirname(path), root).split(os.sep) if e not in ('', '.')]
+    return (parts[-2] if len(parts) >= 2 else '-'), (parts[-1] if parts else '-')
+
+
+def _parse_session(path):
+    try:
+        return path, *parse_ifp_performance_ioi(path), None
+    except Exception as e:
+        return path, None, None, repr(e)
+
+
+def load_sessions(root, workers=None, use_template=False):
+    """
+    :param root:
+    :param workers:
+    :param use_template:    template each session with the next session (in path order) of the same piece
+    :return: list of Session
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        parsed = list(executor.map(_parse_session, find_sessions(root)))
+    sessions = []
+    for path, score_ioi, perf_ioi, error in parsed:
+        if error is not None:
+            logger.warn("Skipping", path, ":", error)
+        elif len(score_ioi) < 3:
+            logger.warn("Skipping", path, ": too few keys")
+        else:
+            sessions.append(Session(path, *session_labels(path, root), score_ioi, perf_ioi, None))
+    if use_template:
+        same_piece = defaultdict(list)
+        for i, e in enumerate(sessions):
+            same_piece[(e.piece, tuple(e.score_ioi))].append(i)
+        for indices in same_piece.values():
+            if len(indices) > 1:
+                for j, i in enumerate(indices):
+                    template = sessions[indices[(j + 1) % len(indices)]].perf_ioi
+                    sessions[i] = sessions[i]._replace(template_ioi=template)
+    return sessions
+
+
+def prediction_errors(session: Session, params: dict, interpolator='ifp'):
+    """
+    :param session:
+    :param params:  keyword arguments of the interpolator
+    :param interpolator:    key of INTERPOLATORS
+    :return: np.ndarray, |log(predicted / performed bpm ratio)| of every IOI following a key
+    """
+    speed_interpolator = INTERPOLATORS[interpolator][0](**params)
+    if session.template_ioi is not None:
+        speed_interpolator.load_template(session.score_ioi, session.template_ioi)
+    else:
+        speed_interpolator.load_score(session.score_ioi)
+    perf_ioi = np.asarray(session.perf_ioi, dtype=float)
+    # Speed scale predicted for the next IOI, i.e. 1 / predicted bpm ratio
+    if isinstance(speed_interpolator, IFPSpeedInterpolator):
+        speed_ratios = speed_interpolator.interpolate_batch(perf_ioi[:-1])
+    else:
+        speed_ratios = np.array([speed_interpolator.interpolate(e) for e in perf_ioi[:-1].tolist()])
+    performed_bpm = np.asarray(session.score_ioi[1:], dtype=float) / perf_ioi[1:]
+    return np.abs(np.log(speed_ratios) + np.log(performed_bpm))
+
+
+_sessions = []
+
+
+def _init_worker(sessions):
+    global _sessions
+    _sessions = sessions
+
+
+def _evaluate(task):
+    interpolator, params = task
+    totals = []
+    for e in _sessions:
+        errors = prediction_errors(e, params, interpolator)
+        totals.append((float(errors.sum()), len(errors)))
+    return interpolator, params, totals
+
+
+def summarize(sessions, totals, key):
+    """
+    :param key: Session field to group by ('piece', 'performer')
+    :return: {group: mean error per key}
+    """
+    groups = defaultdict(lambda: [0.0, 0])
+    for session, (error_sum, count) in zip(sessions, totals):
+        groups[getattr(session, key)][0] += error_sum
+        groups[getattr(session, key)][1] += count
+    return {k: v[0] / v[1] for k, v in sorted(groups.items())}
+
+
+def search(sessions, param_sets, workers=None, interpolator='ifp'):
+    """
+    :param sessions:
+    :param param_sets:  list of parameter dicts, or of (interpolator, parameter dict) to evaluate several interpolators
+    :param workers:
+    :param interpolator:    key of INTERPOLATORS, for parameter dicts
+    :return: list of {'interpolator', 'params', 'error', 'totals'} sorted by error (mean per key over every session)
+    """
+    tasks = [e if isinstance(e, tuple) else (interpolator, e) for e in param_sets]
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(sessions,)) as executor:
+        for name, params, totals in executor.map(_evaluate, tasks, chunksize=max(1, len(tasks) // 64)):
+            error = sum(e[0] for e in totals) / max(1, sum(e[1] for e in totals))
+            results.append({'interpolator': name, 'params': params, 'error': error, 'totals': totals})
+    results.sort(key=lambda e: e['error'])
+    return results
+
+
+def grid_params(grid=None):
+    grid = DEFAULT_GRID if grid is None else grid
+    param_sets = [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+    return [e for e in param_sets if e.get('wh', 1) + e.get('wt', 0) > 0]  # wh + wt normalizes the prediction
+
+
+def random_params(n, seed=None, ranges=None):
+    rng = random.Random(seed)
+    ranges = RANDOM_RANGES if ranges is None else ranges
+    return [{k: rng.randint(*v) if k == 'window_size' else rng.uniform(*v) for k, v in ranges.items()}
+            for _ in range(n)]
+
+
+def report(sessions, results, default_params=None):
+    default_params = DEFAULT_PARAMS if default_params is None else default_params
+    default = next((e for e in results if e['params'] == default_params), None)
+    best = results[0]
+    print(f"{len(sessions)} sessions, {sum(len(e.score_ioi) for e in sessions)} keys, "
+          f"{len(results)} parameter sets")
+    print('Best:   ', best['interpolator'], best['params'], f"error {best['error']:.4f}")
+    if default is not None:
+        print('Default:', default['params'], f"error {default['error']:.4f}")
+    for key in ('performer', 'piece'):
+        best_groups = summarize(sessions, best['totals'], key)
+        default_groups = summarize(sessions, default['totals'], key) if default is not None else {}
+        print(f"\nError per {key} (best{' / default' if default is not None else ''})")
+        for group, error in best_groups.items():
+            suffix = f" / {default_groups[group]:.4f}" if group in default_groups else ''
+            print(f"    {group:<32} {error:.4f}{suffix}")
+
+
+def report_comparison(sessions, results):
+    """Side by side errors of several interpolators (one result per interpolator)"""
+    names = [e['interpolator'] for e in results]
+    print(f"{len(sessions)} sessions, {sum(len(e.score_ioi) for e in sessions)} keys")
+    print(f"{'':<36}" + ''.join(f"{e:>10}" for e in names))
+    print(f"{'all':<36}" + ''.join(f"{e['error']:>10.4f}" for e in results))
+    for key in ('performer', 'piece'):
+        groups = [summarize(sessions, e['totals'], key) for e in results]
+        for group in groups[0]:
+            print(f"{key + ' ' + group:<36}" + ''.join(f"{e[group]:>10.4f}" for e in groups))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Search IFPSpeedInterpolator weights over recorded sessions')
+    parser.add_argument('sessions_dir', type=str, help="Searched recursively for perf_data*.pnlog/.pkl")
+    parser.add_argument('--interpolator', type=str, default='ifp', choices=list(INTERPOLATORS),
+                        help="Interpolator whose parameters are searched")
+    parser.add_argument('--compare', action='store_true',
+                        help="Compare the default parameters of every interpolator instead of searching")
+    parser.add_argument('--random', type=int, default=0, help="Number of random parameter sets (grid by default)")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--template', action='store_true',
+                        help="Use another session of the same piece as the performance template")
+    parser.add_argument('--workers', type=int, default=None, help="Number of processes (CPU count by default)")
+    parser.add_argument('--output', type=str, required=False, help="Save every result as JSON")
+    args = parser.parse_args()
+
+    logger.set_level(logging.WARNING)
+    sessions = load_sessions(args.sessions_dir, workers=args.workers, use_template=args.template)
+    if not sessions:
+        print('No session found in', args.sessions_dir)
+        return
+    if args.compare:
+        results = search(sessions, [(k, dict(v[1])) for k, v in INTERPOLATORS.items()], workers=args.workers)
+        report_comparison(sessions, sorted(results, key=lambda e: list(INTERPOLATORS).index(e['interpolator'])))
+        return
+
+    _, default_params, grid, ranges = INTERPOLATORS[args.interpolator]
+    param_sets = random_params(args.random, seed=args.seed, ranges=ranges) if args.random else grid_params(grid)
+    if default_params not in param_sets:
+        param_sets.append(dict(default_params))
+    results = search(sessions, param_sets, workers=args.workers, interpolator=args.interpolator)
+    report(sessions, results, default_params)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'sessions': [e.path for e in sessions],
+                       'results': [{'interpolator': e['interpolator'], 'params': e['params'], 'error': e['error'],
+                                    'per_piece': summarize(sessions, e['totals'], 'piece'),
+                                    'per_performer': summarize(sessions, e['totals'], 'performer')}
+                                   for e in results]}, f, indent=2)
+        print('Results saved to:', args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,8 +3,8 @@ import os.path
 from pico.logger import logger
 
 from abc import abstractmethod
-from scipy import stats
-import pickle
+
+import numpy as np
 
 from pico.util.midi_util import seconds_to_ticks
 
@@ -60,20 +60,37 @@ class IFPSpeedInterpolator(SpeedInterpolator):
         self.wt = wt
         self.w_size = window_size
         self.score_ioi_list = []  # the first element is the ioi between note[0] and note[1]
-        self.user_bpm_history = []  # as ratio
-        self.pred_bpm_history = []  # as ratio (store predicted bpm for future reference)
-        self.tplt_bpm_history = []  # borrowing the term "performance template" from the iFP paper
+        # Histories are preallocated from the score, entries [:cursor] are valid
+        self._user_bpm = np.empty(0)  # as ratio
+        self._pred_bpm = np.empty(0)  # as ratio (store predicted bpm for future reference)
+        self._tplt_bpm = None  # borrowing the term "performance template" from the iFP paper
+        # Rolling state, so that interpolate() does not re-read the history
+        self._bpm__1 = 1.0
+        self._bpm__2 = 1.0
+        self._window_sum = 0.0
+        self.cursor = 0
         if score_ioi is not None:
             assert 0 not in score_ioi and score_ioi[0] == IOI_PLACEHOLDER
-            self.score_ioi_list = score_ioi
+            self.load_score(score_ioi)
         if template_ioi is not None:
             self.load_template(score_ioi, template_ioi) and template_ioi[0] == IOI_PLACEHOLDER
-        self.cursor = 0
 
     def __repr__(self):
         return (f"IFPSpeedInterpolator(wh={self.wh}, wp={self.wp}, wt={self.wt}, "
                 f"window_size={self.w_size}, ..)")
 
+    @property
+    def user_bpm_history(self):
+        return self._user_bpm[:self.cursor].tolist()
+
+    @property
+    def pred_bpm_history(self):
+        return self._pred_bpm[:self.cursor].tolist()
+
+    @property
+    def tplt_bpm_history(self):
+        return self._tplt_bpm.tolist() if self._tplt_bpm is not None else []
+
     def interpolate(self, curr_ioi):
         """
         Ideal case: interpolate based on the following IOI
@@ -97,38 +114,80 @@ class IFPSpeedInterpolator(SpeedInterpolator):
         if not self.score_ioi_list:
             logger.warn("IOI list is empty! cannot interpolate properly.")
             return 1.0
-        if self.cursor == len(self.score_ioi_list) - 1:
+        cursor = self.cursor
+        if cursor == len(self.score_ioi_list) - 1:
             # TODO @Bmois: Because there are no subsequent notes to compute IOI, use the last performed BPM to predict
-            return self.user_bpm_history[-1]
-        if self.cursor >= len(self.score_ioi_list):
+            return self._bpm__1
+        if cursor >= len(self.score_ioi_list):
             logger.warn("IOI cursor exceeds list len! This is a bug.")
             return 1.0
-        curr_bpm = self.score_ioi_list[self.cursor] / curr_ioi  # bpm should be inversely proportionate to IOI
-        if self.cursor == 0 and self.tplt_bpm_history:
-            curr_bpm = self.tplt_bpm_history[0]
+        curr_bpm = self.score_ioi_list[cursor] / curr_ioi  # bpm should be inversely proportionate to IOI
+        if cursor == 0 and self._tplt_bpm is not None:
+            curr_bpm = float(self._tplt_bpm[0])
 
-        bpm__1 = self.user_bpm_history[-1] if len(self.user_bpm_history) >= 1 else 1.0
-        bpm__2 = self.user_bpm_history[-2] if len(self.user_bpm_history) >= 2 else 1.0
-        tplt_bpm = self.tplt_bpm_history[self.cursor + 1] if self.tplt_bpm_history else 1.0
-        sum_size = min(len(self.user_bpm_history), self.w_size) if self.user_bpm_history else 1
-        bpm_sum = sum(self.user_bpm_history[-sum_size:]) if self.user_bpm_history else 1
-        avg_bpm = bpm_sum / sum_size
+        tplt_bpm = float(self._tplt_bpm[cursor + 1]) if self._tplt_bpm is not None else 1.0
+        avg_bpm = self._window_sum / min(cursor, self.w_size) if cursor else 1.0
 
         pred_bpm_ratio = ((self.wt * tplt_bpm + self.wh * avg_bpm)
-                          * 1 / (self.wt + self.wh) * (bpm__1 / bpm__2) ** self.wp)
-        self.user_bpm_history.append(curr_bpm)
-        self.pred_bpm_history.append(pred_bpm_ratio)
-        self.cursor += 1
+                          * 1 / (self.wt + self.wh) * (self._bpm__1 / self._bpm__2) ** self.wp)
+        self._user_bpm[cursor] = curr_bpm
+        self._pred_bpm[cursor] = pred_bpm_ratio
+        self._window_sum += curr_bpm
+        if cursor >= self.w_size:
+            self._window_sum -= float(self._user_bpm[cursor - self.w_size])
+        self._bpm__2, self._bpm__1 = self._bpm__1, curr_bpm
+        self.cursor = cursor + 1
         logger.debug("current bpm:", curr_bpm)
-        # logger.debug("bpm history:", self.user_bpm_history)
         # logger.debug("predicted bpm:", pred_bpm_ratio)
         return 1 / pred_bpm_ratio  # Ratio to be multiplied with onsets
 
+    def interpolate_batch(self, ioi_array):
+        """
+        Same as calling interpolate() on every element of ioi_array, without the per-call overhead
+        :param ioi_array: performed IOIs, starting at the current cursor
+        :return: np.ndarray of the ratios interpolate() would have returned
+        """
+        ioi_array = np.asarray(ioi_array, dtype=float)
+        if not self.score_ioi_list:
+            logger.warn("IOI list is empty! cannot interpolate properly.")
+            return np.ones(len(ioi_array))
+        start = self.cursor
+        end = min(start + len(ioi_array), len(self.score_ioi_list) - 1)  # The last key has no following IOI
+        steps = np.arange(start, end)
+        user = self._user_bpm
+        user[start:end] = np.asarray(self.score_ioi_list[start:end], dtype=float) / ioi_array[:end - start]
+        if start == 0 and end > 0 and self._tplt_bpm is not None:
+            user[0] = self._tplt_bpm[0]
+
+        # Each step only reads the bpms before it: user[k - 1], user[k - 2] and the window user[k - w_size:k]
+        prefix = np.concatenate(([0.0], np.cumsum(user[:end])))
+        window = np.minimum(steps, self.w_size)
+        avg_bpm = np.where(steps > 0, (prefix[steps] - prefix[steps - window]) / np.maximum(window, 1), 1.0)
+        bpm__1 = np.where(steps >= 1, user[np.maximum(steps - 1, 0)], 1.0)
+        bpm__2 = np.where(steps >= 2, user[np.maximum(steps - 2, 0)], 1.0)
+        tplt_bpm = self._tplt_bpm[steps + 1] if self._tplt_bpm is not None else 1.0
+        pred = (self.wt * tplt_bpm + self.wh * avg_bpm) * 1 / (self.wt + self.wh) * (bpm__1 / bpm__2) ** self.wp
+        self._pred_bpm[start:end] = pred
+
+        self.cursor = end
+        if end > 0:
+            self._bpm__1 = float(user[end - 1])
+            self._bpm__2 = float(user[end - 2]) if end >= 2 else 1.0
+            self._window_sum = float(user[max(0, end - self.w_size):end].sum())
+        ratios = np.empty(len(ioi_array))
+        ratios[:end - start] = 1 / pred
+        ratios[end - start:] = self._bpm__1  # See interpolate(): the last key repeats the last performed bpm
+        return ratios
+
     def load_score(self, score_ioi_list: list[float]):
         assert 0 not in score_ioi_list and score_ioi_list[0] == IOI_PLACEHOLDER
-        if self.tplt_bpm_history:
-            assert len(self.tplt_bpm_history) == len(score_ioi_list)
+        if self._tplt_bpm is not None:
+            assert len(self._tplt_bpm) == len(score_ioi_list)
         self.score_ioi_list = score_ioi_list
+        for name in ('_user_bpm', '_pred_bpm'):
+            history = np.empty(len(score_ioi_list))
+            history[:self.cursor] = getattr(self, name)[:self.cursor]
+            setattr(self, name, history)
 
     def load_template(self, score_ioi_list, template_ioi):
         if template_ioi is None or score_ioi_list is None:
@@ -136,10 +195,8 @@ class IFPSpeedInterpolator(SpeedInterpolator):
             return
         self.load_score(score_ioi_list)
         assert 0 not in template_ioi and template_ioi[0] == IOI_PLACEHOLDER
-        tplt_bpm_history = []
-        for i, e in enumerate(template_ioi):
-            tplt_bpm_history.append(self.score_ioi_list[i] / e)  # Bpm is inversely proportionate to IOI
-        self.tplt_bpm_history = tplt_bpm_history
+        # Bpm is inversely proportionate to IOI
+        self._tplt_bpm = np.asarray(self.score_ioi_list, dtype=float) / np.asarray(template_ioi, dtype=float)
 
     def is_end(self):
         return self.cursor == len(self.score_ioi_list)
@@ -147,14 +204,15 @@ class IFPSpeedInterpolator(SpeedInterpolator):
 
 def parse_ifp_performance_ioi(perf_file):
     """
-    :param perf_file:  perf_data.pkl
+    :param perf_file:  perf_data.pnlog (or legacy perf_data.pkl)
     :return:
     """
+    from pico.pneno.session_log import load_performance_data  # Imported here to avoid a circular import
+
     if perf_file is None:
         return None, None
     assert os.path.exists(perf_file)
-    with open(perf_file, 'rb') as f:
-        data = pickle.load(f)
+    data = load_performance_data(perf_file)
 
     # deque of (time, msg, sgmt)
     ticks_per_beat = data['ticks_per_beat']
@@ -180,6 +238,127 @@ def parse_ifp_performance_ioi(perf_file):
     return score_ioi_list, tplt_ioi_list
 
 
+class KalmanSpeedInterpolator(SpeedInterpolator):
+    """
+    Tempo and phase tracker: a 2-state Kalman filter over (onset of the current key, speed), the speed being
+    performed ticks per score tick. A single mistimed tap mostly moves the phase, while a lasting tempo change moves
+    the speed. Innovations beyond `gate` standard deviations are down-weighted.
+
+    With a template (load_template), its tempo changes are applied to the predicted speed, so that ritardandi
+    are anticipated instead of followed.
+
+    Times are measured in median score IOIs, so the noise parameters do not depend on ticks_per_beat.
+    """
+
+    def __init__(self, onset_noise=.08, tempo_noise=.04, phase_noise=.02, gate=3.0, init_speed_var=.1,
+                 speed_range=(.25, 4.0)):
+        """
+        :param onset_noise: std of a tap's timing (in median score IOIs)
+        :param tempo_noise: std of the speed drift per median score IOI
+        :param phase_noise: std of the phase drift per key (in median score IOIs)
+        :param gate:    innovations beyond `gate` std are treated as outliers
+        :param init_speed_var:  variance of the initial speed
+        :param speed_range: bounds of the tracked speed
+        """
+        self.onset_noise = onset_noise
+        self.tempo_noise = tempo_noise
+        self.phase_noise = phase_noise
+        self.gate = gate
+        self.init_speed_var = init_speed_var
+        self.speed_range = speed_range
+        self.score_ioi_list = []
+        self.tplt_speed = None  # performed / score IOI of the template
+        self._unit = 1.0
+        self.cursor = 0
+        self._reset_state()
+
+    def __repr__(self):
+        return (f"KalmanSpeedInterpolator(onset_noise={self.onset_noise}, tempo_noise={self.tempo_noise}, "
+                f"phase_noise={self.phase_noise}, gate={self.gate}, ..)")
+
+    def _reset_state(self):
+        self._perf_onset = 0.0  # observed onset of the current key
+        self._onset = 0.0  # filtered onset of the current key
+        self._speed = 1.0
+        self._p00, self._p01, self._p11 = self.onset_noise ** 2, 0.0, self.init_speed_var
+
+    def load_score(self, score_ioi_list: list[float]):
+        assert 0 not in score_ioi_list and score_ioi_list[0] == IOI_PLACEHOLDER
+        if self.tplt_speed is not None:
+            assert len(self.tplt_speed) == len(score_ioi_list)
+        self.score_ioi_list = score_ioi_list
+        ordered = sorted(score_ioi_list[1:])
+        self._unit = float(ordered[len(ordered) // 2]) if ordered else 1.0
+
+    def load_template(self, score_ioi_list, template_ioi):
+        if template_ioi is None or score_ioi_list is None:
+            logger.warn("Require both score ioi and template ioi to load template")
+            return
+        self.tplt_speed = None
+        self.load_score(score_ioi_list)
+        assert 0 not in template_ioi and template_ioi[0] == IOI_PLACEHOLDER
+        assert len(template_ioi) == len(score_ioi_list)
+        self.tplt_speed = [IOI_PLACEHOLDER] + [template_ioi[i] / score_ioi_list[i]
+                                               for i in range(1, len(score_ioi_list))]
+
+    def _tempo_change(self, index):
+        """Speed ratio between the template IOIs index and index - 1 (1 without template)"""
+        if self.tplt_speed is None or index < 2 or index >= len(self.tplt_speed):
+            return 1.0
+        return self.tplt_speed[index] / self.tplt_speed[index - 1]
+
+    def _predicted_speed(self):
+        """Speed expected for the IOI following the current key"""
+        return self._speed * self._tempo_change(self.cursor)
+
+    def interpolate(self, curr_ioi):
+        """
+        :param curr_ioi:    performed IOI (ticks) between the previous and the current key
+        :return: speed scale of the current key's segment
+        """
+        if not self.score_ioi_list:
+            logger.warn("IOI list is empty! cannot interpolate properly.")
+            return 1.0
+        cursor = self.cursor
+        if cursor >= len(self.score_ioi_list):
+            return self._speed
+        if cursor == 0:
+            self._reset_state()
+            if self.tplt_speed is not None and len(self.tplt_speed) > 1:
+                self._speed = self.tplt_speed[1]
+            self.cursor = 1
+            return self._predicted_speed()
+
+        # Predict the onset of the current key: x = F x, P = F P F' + Q with F = [[1, g * d], [0, g]]
+        g = self._tempo_change(cursor)
+        d = self.score_ioi_list[cursor] / self._unit
+        a = g * d
+        speed = self._speed * g
+        onset = self._onset + speed * d
+        p00 = self._p00 + 2 * a * self._p01 + a * a * self._p11 + self.phase_noise ** 2
+        p01 = g * self._p01 + a * g * self._p11
+        p11 = g * g * self._p11 + self.tempo_noise ** 2 * d
+
+        # Update with the observed onset (H = [1, 0])
+        self._perf_onset += curr_ioi / self._unit
+        innovation = self._perf_onset - onset
+        r = self.onset_noise ** 2
+        s = p00 + r
+        if innovation * innovation > self.gate * self.gate * s:
+            r *= innovation * innovation / (self.gate * self.gate * s)  # Outlier: widen the measurement noise
+            s = p00 + r
+        k0, k1 = p00 / s, p01 / s
+        self._onset = onset + k0 * innovation
+        self._speed = min(max(speed + k1 * innovation, self.speed_range[0]), self.speed_range[1])
+        self._p00, self._p01, self._p11 = (1 - k0) * p00, (1 - k0) * p01, p11 - k1 * p01
+        self.cursor = cursor + 1
+        logger.debug("speed:", self._speed, "phase error:", self._perf_onset - self._onset)
+        return self._predicted_speed()
+
+    def is_end(self):
+        return self.cursor == len(self.score_ioi_list)
+
+
 class VelocityInterpolator:
     @abstractmethod
     def interpolate(self, curr_vel):
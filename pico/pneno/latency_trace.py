@@ -0,0 +1,102 @@
+"""
+Per-keypress latency tracing
+
+A KeypressTrace timestamps (monotonic clock) every stage between a key press and the sound:
+    input -> lookup -> key_sent -> interpolated -> scheduled, plus each accompaniment event actually sent
+"""
+import time
+from collections import deque
+
+# Stages in the order they happen on the keypress path
+TRACE_STAGES = ('input', 'lookup', 'key_sent', 'interpolated', 'scheduled')
+
+
+def percentile(ordered, q):
+    """
+    :param ordered: sorted list of values
+    :param q: percentile in [0, 100]
+    """
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+class KeypressTrace:
+    __slots__ = TRACE_STAGES + ('acc_sent',)
+
+    def __init__(self, input_time):
+        self.input = input_time
+        self.lookup = None
+        self.key_sent = None
+        self.interpolated = None
+        self.scheduled = None
+        self.acc_sent = []  # list of (deadline, actual send time) of accompaniment events
+
+    def __repr__(self):
+        return f"KeypressTrace({self.to_dict()})"
+
+    def to_dict(self):
+        data = {e: getattr(self, e) for e in TRACE_STAGES}
+        data['acc_sent'] = list(self.acc_sent)
+        return data
+
+    def elapsed(self, stage):
+        """
+        :return: seconds between input receipt and the given stage, None if the stage was not reached
+        """
+        t = getattr(self, stage)
+        return None if t is None else t - self.input
+
+
+class LatencyTracer:
+    def __init__(self, clock=time.perf_counter, enabled=True, trace_size=100_000):
+        """
+        :param clock:   monotonic clock in seconds, shared with the scheduler
+        :param enabled: if False, begin() returns None and nothing is recorded
+        :param trace_size:  how many keypress traces are kept for the summary
+        """
+        self.clock = clock
+        self.enabled = enabled
+        self.traces = deque(maxlen=trace_size)
+
+    def begin(self, t=None):
+        """
+        :param t:   time the input was received (defaults to now)
+        """
+        if not self.enabled:
+            return None
+        trace = KeypressTrace(self.clock() if t is None else t)
+        self.traces.append(trace)
+        return trace
+
+    def mark(self, trace: KeypressTrace or None, stage):
+        if trace is not None:
+            setattr(trace, stage, self.clock())
+
+    def mark_acc_sent(self, trace: KeypressTrace or None, deadline):
+        if trace is not None:
+            trace.acc_sent.append((deadline, self.clock()))
+
+    def summary(self):
+        """
+        :return: {stage: {count, p50, p95, p99}} in milliseconds.
+            Keypress stages are measured from input receipt, 'acc_sent' is the lateness against the scheduled deadline
+        """
+        samples = {e: [] for e in TRACE_STAGES[1:]}
+        samples['acc_sent'] = []
+        for trace in list(self.traces):
+            for stage in TRACE_STAGES[1:]:
+                elapsed = trace.elapsed(stage)
+                if elapsed is not None:
+                    samples[stage].append(elapsed)
+            samples['acc_sent'].extend(sent - deadline for deadline, sent in trace.acc_sent)
+
+        summary = {}
+        for stage, values in samples.items():
+            if not values:
+                summary[stage] = {'count': 0}
+                continue
+            values.sort()
+            summary[stage] = {'count': len(values),
+                              'p50': percentile(values, 50) * 1000,
+                              'p95': percentile(values, 95) * 1000,
+                              'p99': percentile(values, 99) * 1000}
+        return summary
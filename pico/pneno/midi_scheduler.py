@@ -0,0 +1,268 @@
+"""
+High-precision event scheduler for accompaniment playback
+
+Each PnenoSystem owns one MidiScheduler (or shares the one of a PnenoHost): a timestamp-ordered heap drained by a
+dedicated thread.
+The thread sleeps until shortly before the next deadline, then spins until the deadline is reached,
+so events are dispatched with sub-millisecond lateness instead of the 10ms polling of sched.scheduler.
+"""
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+
+from pico.logger import logger
+from pico.pneno.latency_trace import percentile
+
+
+class ScheduledEvent:
+    """
+    Handle of a scheduled event. Call cancel() to prevent it from being dispatched.
+    """
+    __slots__ = ('deadline', 'seq', 'action', 'args', 'cancelled', 'dispatched', 'scheduler')
+
+    def __init__(self, deadline, seq, action, args, scheduler=None):
+        self.deadline = deadline
+        self.seq = seq  # Tie-breaker: events with the same deadline keep their insertion order
+        self.action = action
+        self.args = args
+        self.cancelled = False
+        self.dispatched = False
+        self.scheduler = scheduler  # Cancellations go through it, so that they are ordered with dispatch
+
+    def __lt__(self, other):
+        return (self.deadline, self.seq) < (other.deadline, other.seq)
+
+    def __repr__(self):
+        return (f"ScheduledEvent(deadline={self.deadline}, action={self.action}, "
+                f"cancelled={self.cancelled}, dispatched={self.dispatched})")
+
+    def cancel(self):
+        """
+        :return: whether the event was still pending (see MidiScheduler.cancel)
+        """
+        if self.scheduler is not None:
+            return self.scheduler.cancel(self)
+        pending = self.pending()
+        self._cancel()
+        return pending
+
+    def _cancel(self):
+        """Mark the event cancelled. Schedulers call it with their lock held."""
+        self.cancelled = True
+
+    def pending(self):
+        return not self.cancelled and not self.dispatched
+
+
+def summarize_lateness(lateness):
+    """
+    :param lateness: list of lateness in seconds
+    :return: dict of lateness statistics in milliseconds
+    """
+    if not lateness:
+        return {'count': 0}
+    ordered = sorted(lateness)
+    return {
+        'count': len(ordered),
+        'mean': sum(ordered) / len(ordered) * 1000,
+        'p50': percentile(ordered, 50) * 1000,
+        'p95': percentile(ordered, 95) * 1000,
+        'p99': percentile(ordered, 99) * 1000,
+        'max': ordered[-1] * 1000,
+    }
+
+
+class MidiScheduler:
+    def __init__(self, clock=time.perf_counter, spin_threshold=0.002, lateness_size=10000):
+        """
+        :param clock:   monotonic clock in seconds. Deadlines are expressed in this clock.
+        :param spin_threshold:  seconds before a deadline at which the thread stops sleeping and starts spinning
+        :param lateness_size:   how many recent lateness samples to keep (None for unbounded)
+        """
+        self.clock = clock
+        self.spin_threshold = spin_threshold
+        self.lateness = deque(maxlen=lateness_size)  # seconds between deadline and actual dispatch
+        self._queue = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def __len__(self):
+        return len(self._queue)
+
+    def is_running(self):
+        return self._running
+
+    def enter(self, delay, action, args=()):
+        """
+        Schedule action(*args) to be called after `delay` seconds
+        :return: ScheduledEvent handle
+        """
+        return self.enter_at(self.clock() + delay, action, args)
+
+    def enter_at(self, deadline, action, args=()):
+        """
+        Schedule action(*args) to be called at `deadline` (in self.clock time)
+        :return: ScheduledEvent handle
+        """
+        event = ScheduledEvent(deadline, next(self._counter), action, args, scheduler=self)
+        with self._cond:
+            self._push(event)
+        return event
+
+    def _push(self, event: ScheduledEvent):
+        """Must be called with self._cond held"""
+        heapq.heappush(self._queue, event)
+        if self._queue[0] is event:
+            self._cond.notify()  # New earliest deadline: wake the dispatcher up
+
+    def next_deadline(self):
+        """
+        :return: deadline of the earliest pending event, None if nothing is scheduled
+        """
+        with self._cond:
+            while self._queue and self._queue[0].cancelled:
+                heapq.heappop(self._queue)
+            return self._queue[0].deadline if self._queue else None
+
+    def cancel(self, event: ScheduledEvent):
+        """
+        Cancelled events are lazily removed when they reach the top of the heap
+        :return: whether the event was still pending (i.e. it is guaranteed not to be dispatched)
+        """
+        with self._cond:
+            pending = event.pending()
+            event._cancel()
+        return pending
+
+    def reschedule(self, event: ScheduledEvent, deadline, args=None):
+        """
+        Move a pending event to a new deadline
+        :param event:
+        :param deadline:
+        :param args:    new arguments of the action (unchanged if None)
+        :return: the new ScheduledEvent handle, None if the event was already dispatched or cancelled
+        """
+        with self._cond:
+            if not event.pending():
+                return None
+            event._cancel()
+            moved = ScheduledEvent(deadline, next(self._counter), event.action, event.args if args is None else args,
+                                   scheduler=self)
+            self._push(moved)
+        return moved
+
+    def cancel_where(self, predicate):
+        """
+        Cancel every pending event for which predicate(event) is true
+        :return: number of cancelled events
+        """
+        count = 0
+        with self._cond:
+            for e in self._queue:
+                if e.pending() and predicate(e):
+                    e._cancel()
+                    count += 1
+        return count
+
+    def clear(self):
+        with self._cond:
+            for e in self._queue:
+                e._cancel()
+            self._queue = []
+
+    def start(self, threaded=True):
+        """
+        :param threaded: if False, no dispatcher thread is started and events are only dispatched by run_pending()
+        """
+        if self._running:
+            logger.warn("MIDI scheduler already started")
+            return
+        self._running = True
+        if threaded:
+            self._thread = threading.Thread(target=self.run, daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=1.0):
+        """
+        Stop the dispatcher thread. Events that are still queued are discarded.
+        """
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            if self._thread.is_alive():
+                logger.warn("MIDI scheduler thread didn't stop gracefully within timeout")
+            self._thread = None
+        self.clear()
+
+    def _pop_due(self, now):
+        """
+        Pop the next event if it is due. Must be called with self._cond held.
+        :return: (event or None, seconds until the next deadline or None if the queue is empty)
+        """
+        while self._queue and self._queue[0].cancelled:
+            heapq.heappop(self._queue)
+        if not self._queue:
+            return None, None
+        remaining = self._queue[0].deadline - now
+        if remaining > 0:
+            return None, remaining
+        event = heapq.heappop(self._queue)
+        event.dispatched = True  # Under the lock, so that cancel()/reschedule() know it is too late
+        return event, 0
+
+    def _dispatch(self, event: ScheduledEvent):
+        self.lateness.append(self.clock() - event.deadline)
+        try:
+            event.action(*event.args)
+        except Exception as e:
+            logger.error("Scheduled event failed:", event, e)
+
+    def run(self):
+        """
+        Dispatcher loop: sleep until close to the next deadline, then spin until it is due.
+        """
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+                event, remaining = self._pop_due(self.clock())
+                if event is None:
+                    if remaining is None:
+                        self._cond.wait()
+                        continue
+                    if remaining > self.spin_threshold:
+                        self._cond.wait(remaining - self.spin_threshold)
+                        continue
+            if event is None:
+                # Close to the deadline: spin without holding the lock so that enter() is never blocked
+                deadline = self.clock() + remaining
+                while self.clock() < deadline:
+                    pass
+                continue
+            self._dispatch(event)
+
+    def run_pending(self, now=None):
+        """
+        Synchronously dispatch every event that is due at `now` (defaults to the current clock time)
+        :return: number of dispatched events
+        """
+        count = 0
+        while True:
+            with self._cond:
+                event, _ = self._pop_due(self.clock() if now is None else now)
+            if event is None:
+                return count
+            self._dispatch(event)
+            count += 1
+
+    def lateness_summary(self):
+        """
+        :return: dict of dispatch lateness statistics (milliseconds)
+        """
+        return summarize_lateness(list(self.lateness))
@@ -0,0 +1,204 @@
+"""
+Columnar (NumPy) representation of a PnenoSeq
+
+All notes of a score live in one structured array, grouped by segment: the key first, then the accompaniment sorted
+by (onset, pitch), exactly as in PnenoSeq. `sgmt_offsets[i]:sgmt_offsets[i + 1]` are the rows of segment i.
+Times are absolute ticks.
+
+PnenoArray provides vectorized equivalents of PnenoSeq.flatten/to_ioi_list/to_onset_list/to_midi_seq.
+ArrayPnenoSeq keeps the PnenoSeq object API on top of it: segments are materialized lazily when accessed.
+"""
+import mido
+import numpy as np
+
+from pico.pneno.interpolator import IOI_PLACEHOLDER
+from pico.pneno.pneno_seq import PnenoSeq, PnenoSegment, PnenoPitch
+
+NOTE_DTYPE = np.dtype([('onset', '<i8'), ('offset', '<i8'), ('pitch', 'u1'), ('velocity', 'u1'), ('chnl', 'u1'),
+                       ('sgmt', '<i4')])
+
+# Event arrays produced by PnenoArray.to_midi_events()
+EVENT_DTYPE = np.dtype([('time', '<i8'), ('is_note_on', '?'), ('note', 'u1'), ('velocity', 'u1'), ('chnl', 'u1')])
+
+
+class PnenoArray:
+    def __init__(self, notes: np.ndarray, sgmt_offsets: np.ndarray, ticks_per_beat=120, tempo=500_000):
+        """
+        :param notes:   NOTE_DTYPE array grouped by segment, key first
+        :param sgmt_offsets:    int array of length n_segments + 1
+        :param ticks_per_beat:
+        :param tempo:
+        """
+        assert notes.dtype == NOTE_DTYPE
+        self.notes = notes
+        self.sgmt_offsets = np.asarray(sgmt_offsets, dtype=np.int64)
+        self.ticks_per_beat = ticks_per_beat
+        self.tempo = tempo
+
+    def __len__(self):
+        return len(self.sgmt_offsets) - 1
+
+    def __repr__(self):
+        return (f"PnenoArray(segments={len(self)}, notes={len(self.notes)}, "
+                f"ticks_per_beat={self.ticks_per_beat}, tempo={self.tempo})")
+
+    @classmethod
+    def from_pneno_seq(cls, pno_seq: PnenoSeq):
+        sizes = np.fromiter((len(e.sgmt) + 1 for e in pno_seq.seq), dtype=np.int64, count=len(pno_seq.seq))
+        notes = np.zeros(int(sizes.sum()), dtype=NOTE_DTYPE)
+        rows = [(p.onset + e.onset, p.offset + e.onset, p.pitch, p.velocity, p.chnl, i)
+                for i, e in enumerate(pno_seq.seq) for p in [e.key] + e.sgmt]
+        if rows:
+            notes[:] = rows
+        offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        return cls(notes, offsets, ticks_per_beat=pno_seq.ticks_per_beat, tempo=pno_seq.tempo)
+
+    @property
+    def key_index(self):
+        return self.sgmt_offsets[:-1]
+
+    @property
+    def keys(self):
+        return self.notes[self.key_index]
+
+    def is_key(self):
+        """
+        :return: boolean mask of the key rows
+        """
+        mask = np.zeros(len(self.notes), dtype=bool)
+        mask[self.key_index] = True
+        return mask
+
+    def segment(self, index):
+        """
+        :return: the rows of one segment (key first)
+        """
+        return self.notes[self.sgmt_offsets[index]:self.sgmt_offsets[index + 1]]
+
+    def to_onsets(self):
+        """Absolute onset of every segment (its key)"""
+        return self.keys['onset']
+
+    def to_onset_list(self):
+        return self.to_onsets().tolist()
+
+    def to_pitch_list(self):
+        return self.keys['pitch'].tolist()
+
+    def to_ioi(self):
+        """
+        Vectorized PnenoSeq.to_ioi_list: key IOIs, the first one being IOI_PLACEHOLDER
+        """
+        onsets = self.to_onsets()
+        if not len(onsets):
+            return onsets.copy()
+        return np.diff(onsets, prepend=onsets[0] - IOI_PLACEHOLDER)
+
+    def to_ioi_list(self):
+        return self.to_ioi().tolist()
+
+    def flatten(self):
+        """
+        :return: (notes, onsets). Same order as PnenoSeq.flatten: segment by segment, key first
+        """
+        return self.notes, self.notes['onset']
+
+    def to_midi_events(self, use_absolute_time=False):
+        """
+        Vectorized PnenoSeq.to_midi_seq: keys on channel 0, accompaniment on channel 1
+        :return: EVENT_DTYPE array, in the same order as PnenoSeq.to_midi_seq
+        """
+        n = len(self.notes)
+        events = np.zeros(2 * n, dtype=EVENT_DTYPE)
+        events['time'][0::2] = self.notes['onset']
+        events['time'][1::2] = self.notes['offset']
+        events['is_note_on'][0::2] = True
+        events['note'][0::2] = self.notes['pitch']
+        events['note'][1::2] = self.notes['pitch']
+        events['velocity'][0::2] = self.notes['velocity']  # note-off events have velocity 0
+        chnl = np.where(self.is_key(), 0, 1).astype(np.uint8)
+        events['chnl'][0::2] = chnl
+        events['chnl'][1::2] = chnl
+
+        # Each segment is sorted by time (stable), segments are concatenated
+        sgmt = np.repeat(self.notes['sgmt'], 2)
+        events = events[np.lexsort((np.arange(2 * n), events['time'], sgmt))]
+        if not use_absolute_time:
+            events = events[np.argsort(events['time'], kind='stable')]
+            events['time'] = np.diff(events['time'], prepend=0)
+        return events
+
+    def to_midi_seq(self, use_absolute_time=False):
+        """
+        :return: list of mido.Message, equal to PnenoSeq.to_midi_seq
+        """
+        return [mido.Message(type='note_on' if e['is_note_on'] else 'note_off', note=int(e['note']),
+                             velocity=int(e['velocity']), channel=int(e['chnl']), time=int(e['time']))
+                for e in self.to_midi_events(use_absolute_time=use_absolute_time)]
+
+    def to_pneno_segment(self, index):
+        rows = self.segment(index)
+        pitches = [PnenoPitch(pitch=int(e['pitch']), velocity=int(e['velocity']), onset=int(e['onset']),
+                              offset=int(e['offset']), chnl=int(e['chnl'])) for e in rows]
+        return PnenoSegment(key=pitches[0], segment=pitches[1:])
+
+    def to_pneno_seq(self):
+        """
+        :return: ArrayPnenoSeq, a PnenoSeq view on this array
+        """
+        return ArrayPnenoSeq(self)
+
+
+class _LazySegments:
+    """Read-only list of PnenoSegments materialized on first access"""
+
+    def __init__(self, array: PnenoArray):
+        self.array = array
+        self._cache = [None] * len(array)
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if self._cache[index] is None:
+            self._cache[index] = self.array.to_pneno_segment(index)
+        return self._cache[index]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class ArrayPnenoSeq(PnenoSeq):
+    """
+    PnenoSeq backed by a PnenoArray. Segment objects are created on demand; bulk conversions are vectorized.
+    The sequence is read-only (no append/extend).
+    """
+
+    def __init__(self, array: PnenoArray):
+        super().__init__(ticks_per_beat=array.ticks_per_beat, tempo=array.tempo)
+        self.array = array
+        self.seq = _LazySegments(array)
+
+    def append(self, pneno_sgmt: PnenoSegment):
+        raise TypeError("ArrayPnenoSeq is read-only")
+
+    def extend(self, pneno_seq: list[PnenoSegment]):
+        raise TypeError("ArrayPnenoSeq is read-only")
+
+    def to_onset_list(self):
+        return self.array.to_onset_list()
+
+    def to_pitch_list(self):
+        return self.array.to_pitch_list()
+
+    def to_ioi_list(self):
+        return self.array.to_ioi_list()
+
+    def to_midi_seq(self, use_absolute_time=False):
+        return self.array.to_midi_seq(use_absolute_time=use_absolute_time)
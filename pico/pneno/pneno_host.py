@@ -0,0 +1,104 @@
+"""
+Several independent PnenoSystem sessions in one process
+
+Every session has its own score, interpolators and ports, but all of them share a single MidiScheduler: one
+dispatch thread serves the accompaniment of every session. With the default 'callback' input mode, sessions do not
+start any thread of their own.
+
+    host = PnenoHost()
+    host.add_session('station-1', 'Piano 1 In', 'Piano 1 Out', create_pneno_seq_from_midi_file('a.mid'))
+    host.add_session('station-2', 'Piano 2 In', 'Piano 2 Out', create_pneno_seq_from_midi_file('b.mid'),
+                     speed_interpolator=IFPSpeedInterpolator())
+    host.start()
+    ...
+    host.stop()
+"""
+import time
+
+from pico.logger import logger
+from pico.pneno.midi_scheduler import MidiScheduler
+from pico.pneno.pneno_seq import PnenoSeq
+from pico.pneno.pneno_system import PnenoSystem
+
+
+class PnenoHost:
+    def __init__(self, clock=time.perf_counter, spin_threshold=0.002, lateness_size=10000):
+        """
+        :param clock:   monotonic clock in seconds shared by every session
+        :param spin_threshold:  see MidiScheduler
+        :param lateness_size:   see MidiScheduler
+        """
+        self.scheduler = MidiScheduler(clock=clock, spin_threshold=spin_threshold, lateness_size=lateness_size)
+        self.sessions = {}
+        self._threaded = None  # None while stopped
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __contains__(self, name):
+        return name in self.sessions
+
+    def __getitem__(self, name) -> PnenoSystem:
+        return self.sessions[name]
+
+    def is_running(self):
+        return self._threaded is not None
+
+    def add_session(self, name, input_port_name, output_port_name, pno_seq: PnenoSeq, **kwargs) -> PnenoSystem:
+        """
+        Create a session on the shared scheduler. It is started right away if the host is running.
+        :param name:
+        :param input_port_name:     port name or opened mido input port
+        :param output_port_name:    port name or opened mido output port
+        :param pno_seq:
+        :param kwargs:  forwarded to PnenoSystem (interpolators, pneno_chnl, input_mode, session_save_path ...)
+        :return: the PnenoSystem of the session
+        """
+        if name in self.sessions:
+            raise ValueError(f"Session {name} already exists")
+        system = PnenoSystem(input_port_name, output_port_name, scheduler=self.scheduler, **kwargs)
+        system.load_score(pno_seq)
+        self.sessions[name] = system
+        if self.is_running():
+            self._start_session(system)
+        return system
+
+    def feed(self, name, msg):
+        """
+        Inject an input message into a session, as its input port would (see PnenoSystem.feed)
+        """
+        self.sessions[name].feed(msg)
+
+    def remove_session(self, name):
+        """
+        Stop a session and cancel its scheduled accompaniment. The other sessions are not affected.
+        """
+        self.sessions.pop(name).stop()
+
+    def _start_session(self, system: PnenoSystem):
+        if self._threaded:
+            system.start_realtime_capture()
+        else:
+            system.start_headless()
+
+    def start(self, threaded=True):
+        """
+        :param threaded: if False, sessions are started headless and the caller drains the shared scheduler with
+            self.scheduler.run_pending() (see pico.pneno.simulator)
+        """
+        if self.is_running():
+            logger.warn("PnenoHost already started")
+            return
+        self.scheduler.start(threaded=threaded)
+        self._threaded = threaded
+        for system in self.sessions.values():
+            self._start_session(system)
+        logger.info(f"Pneno host started with {len(self.sessions)} sessions")
+
+    def stop(self):
+        for system in self.sessions.values():
+            system.stop()
+        if self.scheduler.is_running():
+            self.scheduler.stop(timeout=1.0)
+            logger.info("Accompaniment lateness of all sessions (ms):", self.scheduler.lateness_summary())
+        self._threaded = None
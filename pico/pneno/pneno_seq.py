@@ -3,7 +3,9 @@ Play Next Note Seq
 """
 import copy
 import mido
+import numpy as np
 import time
+from typing import NamedTuple
 
 from pico.logger import logger
 from pico.pneno.interpolator import IOI_PLACEHOLDER
@@ -30,7 +32,47 @@ class PnenoPitch:
                              velocity=0, time=self.offset)]
 
 
+NOTE_ON_STATUS = 0x90
+NOTE_OFF_STATUS = 0x80
+
+
+class PlaybackEvent(NamedTuple):
+    """One row of a compiled playback table. The status byte carries no channel (channel bits are 0)"""
+    time: float  # seconds after the key onset
+    status: int
+    note: int
+    velocity: int
+
+
+class ExpressedSegment(NamedTuple):
+    """
+    Accompaniment of a PnenoSegment as it was played: its playback table and the expressive parameters applied to it
+    """
+    table: tuple[PlaybackEvent, ...]
+    speed_scale: float
+    velocity: int or None
+
+    def events(self):
+        """
+        :return: generator of (seconds after key onset, status, note, velocity) with expressive params applied
+        """
+        for e in self.table:
+            yield e.time * self.speed_scale, e.status, e.note, self.velocity if self.velocity else e.velocity
+
+    def to_midi_seq(self, seconds_per_tick, channel=0):
+        """
+        :param seconds_per_tick:
+        :param channel:
+        :return: list of mido.Message in (unrounded) ticks after the key onset, as sent by PnenoSystem
+        """
+        return [mido.Message(type='note_on' if status == NOTE_ON_STATUS else 'note_off', note=note,
+                             velocity=velocity, channel=channel, time=t / seconds_per_tick)
+                for t, status, note, velocity in self.events()]
+
+
 def convert_onsets_to_ioi(onsets: list[float]):
+    if not onsets:
+        return []  # Segment without accompaniment
     curr_onset = onsets[0]
     ioi_list = []
     for e in onsets:
@@ -67,6 +109,19 @@ class PnenoSegment:
         self.key.onset -= self.onset  # ...
         self.sgmt = shift_segment_time(key_onset=self.onset, segment=segment)
         self.sgmt.sort(key=lambda e: (e.onset, e.pitch))
+        self.playback_table = None  # compiled by self.compile_playback()
+
+    @classmethod
+    def from_shifted(cls, key: PnenoPitch, segment: list[PnenoPitch], onset):
+        """
+        Build a segment from notes already relative to `onset` and sorted by (onset, pitch), without re-shifting
+        """
+        sgmt = cls.__new__(cls)
+        sgmt.onset = onset
+        sgmt.key = key
+        sgmt.sgmt = segment
+        sgmt.playback_table = None
+        return sgmt
 
     def copy(self):
         copied_key = copy.deepcopy(self.key)
@@ -107,6 +162,22 @@ class PnenoSegment:
                 events[i].time += self.onset
         return events
 
+    def compile_playback(self, ticks_to_seconds):
+        """
+        Compile the accompaniment (key excluded) into an immutable table of PlaybackEvent, sorted by time.
+        Same event order as self.to_midi_seq(use_absolute_time=True, start_from_zero=True, include_key=False)
+        :param ticks_to_seconds: function converting ticks into seconds
+        :return: the compiled table, also stored in self.playback_table
+        """
+        rows = []
+        for e in self.sgmt:
+            rows.append(PlaybackEvent(e.onset, NOTE_ON_STATUS, e.pitch, e.velocity))
+            rows.append(PlaybackEvent(e.offset, NOTE_OFF_STATUS, e.pitch, 0))
+        rows.sort(key=lambda row: row.time)  # Stable: keeps the order of to_midi_seq for simultaneous events
+        self.playback_table = tuple(PlaybackEvent(ticks_to_seconds(e.time), e.status, e.note, e.velocity)
+                                    for e in rows)
+        return self.playback_table
+
     def flatten(self, absolute_time=True):
         """
         :return: (list of reference to PnenoPitch, list of their onsets - in delta or absolute)
@@ -191,6 +262,13 @@ class PnenoSeq:
             onsets.extend(ost)
         return notes, onsets
 
+    def compile_playback(self):
+        """
+        Compile the playback table of every segment (see PnenoSegment.compile_playback)
+        """
+        for e in self.seq:
+            e.compile_playback(self.ticks_to_seconds)
+
     def ticks_to_seconds(self, ticks):
         return ticks_to_seconds(ticks=ticks, tempo=self.tempo, ticks_per_beat=self.ticks_per_beat)
 
@@ -282,7 +360,7 @@ def parse_midi_track_tempo(track):
     return tempo
 
 
-def create_pneno_seq_from_midi(midi: mido.MidiFile):
+def create_pneno_seq_from_midi(midi: mido.MidiFile, by_onset=False):
     if len(midi.tracks) not in [2, 3]:
         raise ValueError("Currently MIDI file must have at least two tracks (melody and accompaniment)")
     track_notes, tempo_changes = extract_pneno_pitches_from_midi(midi)
@@ -299,53 +377,93 @@ def create_pneno_seq_from_midi(midi: mido.MidiFile):
         logger.warn("More than one tempo changes found!")
 
     return create_pneno_seq(melody_track, acc_track, midi.ticks_per_beat,
-                            tempo_changes[0].tempo if tempo_changes else 500000)  # Default 500000
+                            tempo_changes[0].tempo if tempo_changes else 500000,  # Default 500000
+                            by_onset=by_onset)
 
 
-def create_pneno_seq_from_midi_file(midi_path: str) -> PnenoSeq:
+def create_pneno_seq_from_midi_file(midi_path: str, by_onset=False) -> PnenoSeq:
     """
     :param midi_path:
         - one track for the main melody
         - one track for the aligned notes
+    :param by_onset: see create_pneno_seq
     :return:
     """
     midi = mido.MidiFile(midi_path)
-    return create_pneno_seq_from_midi(midi)
+    return create_pneno_seq_from_midi(midi, by_onset=by_onset)
 
 
-def create_pneno_seq(melody_track, acc_track, ticks_per_beat, bpm):
+# Bump whenever create_pneno_seq segments a score differently: compiled scores (pico.pneno.score_cache) are keyed on it
+SEGMENTATION_VERSION = 2
+
+
+def segment_accompaniment(melody_onsets, acc_onsets):
+    """
+    Binary search of accompaniment onsets against (sorted) melody onsets
+    :return: index of the segment of each accompaniment note, -1 for notes before the first melody note
+    """
+    return np.searchsorted(melody_onsets, acc_onsets, side='right') - 1
+
+
+def lagging_segments(melody_onsets, acc_onsets):
+    """
+    Segments of the accompaniment notes as assigned by the original segmentation loop: a note moves at most one
+    segment past the previous note, and the loop stops after the second note of the last segment.
+    :param melody_onsets:   sorted
+    :param acc_onsets:  sorted
+    :return: (segment of every note, number of notes kept)
+    """
+    n_melody = len(melody_onsets)
+    segments = segment_accompaniment(melody_onsets, acc_onsets)
+    j = np.arange(len(segments))
+    # s[j] = min(t[j], s[j - 1] + 1) with s[-1] = 0, t being the segment found by binary search
+    segments = np.minimum(np.minimum.accumulate(segments - j) + j, j + 1)
+    if not len(segments) and not n_melody:
+        return segments, 0
+    previous = np.concatenate([[0], segments[:-1]])[:len(segments)]
+    last = np.flatnonzero(previous == n_melody - 1)
+    if not len(last):
+        raise AssertionError("Accompaniment notes do not reach the last segment")
+    return segments[:last[0] + 1], last[0] + 1
+
+
+def create_pneno_seq(melody_track, acc_track, ticks_per_beat, bpm, by_onset=False):
+    """
+    :param melody_track: list of PnenoPitch, one segment per note
+    :param acc_track:    list of PnenoPitch
+    :param ticks_per_beat:
+    :param bpm: tempo (microseconds per beat)
+    :param by_onset: segment every accompaniment note by the last melody onset at or before it
+                     (segment_accompaniment). By default, the segments of the original loop are kept (lagging_segments):
+                     they lag behind when a melody onset has no accompaniment note, and the last segment is truncated.
+    :return:
+    """
     melody_track.sort(key=lambda e: e.onset)
     acc_track.sort(key=lambda e: e.onset)
-    melody_onsets = []
-
-    for note in melody_track:
-        melody_onsets.append(note.onset)
-
-    acc_sequences = []  # List of lists to store sequences
-    current_acc_sequence = []
-    onset_index = 1
-
-    for i, note in enumerate(acc_track):
-        # Append note to the current sequence if it's before the next melody onset
-        if onset_index == len(melody_onsets):
-            current_acc_sequence.append(note)
-            acc_sequences.append(current_acc_sequence)
-            break
-        elif onset_index < len(melody_onsets) and note.onset < melody_onsets[onset_index]:
-            current_acc_sequence.append(note)
-        else:
-            # Append the current sequence and start a new one when we reach the next onset
-            acc_sequences.append(current_acc_sequence)
-            current_acc_sequence = [note]
-            onset_index += 1
-            # Prevent out-of-bounds indexing for melody_onsets
-            if onset_index > len(melody_onsets):
-                break
-
-    assert len(melody_track) == len(acc_sequences)
+    melody_onsets = [e.onset for e in melody_track]
+    acc_onsets = np.array([e.onset for e in acc_track], dtype=np.int64)
+    if len(acc_onsets) and (not melody_onsets or acc_onsets[0] < melody_onsets[0]):
+        raise ValueError("Accompaniment notes found before the first melody note")
+    if by_onset:
+        sgmt_index, kept = segment_accompaniment(np.array(melody_onsets), acc_onsets), len(acc_onsets)
+    else:
+        sgmt_index, kept = lagging_segments(np.array(melody_onsets), acc_onsets)
+
+    # Notes are grouped by segment, each segment being sorted by (onset, pitch) as PnenoSegment does
+    order = np.lexsort((np.array([e.pitch for e in acc_track[:kept]]), acc_onsets[:kept], sgmt_index))
+    bounds = np.searchsorted(sgmt_index[order], np.arange(len(melody_track) + 1)).tolist()
+    acc_sorted = [acc_track[i] for i in order.tolist()]
+    for i, key in enumerate(melody_track):
+        key_onset = melody_onsets[i]
+        for e in acc_sorted[bounds[i]:bounds[i + 1]]:
+            e.onset -= key_onset
+            e.offset -= key_onset
+        key.onset -= key_onset
+        key.offset -= key_onset
+
     seq = PnenoSeq(ticks_per_beat=ticks_per_beat, tempo=bpm)
-    for i in range(len(melody_track)):
-        seq.append(PnenoSegment(key=melody_track[i], segment=acc_sequences[i]))
+    seq.extend([PnenoSegment.from_shifted(key=key, segment=acc_sorted[bounds[i]:bounds[i + 1]], onset=melody_onsets[i])
+                for i, key in enumerate(melody_track)])
     return seq
 
 
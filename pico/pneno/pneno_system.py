@@ -1,22 +1,35 @@
 import logging
 import os.path
+import queue
 import threading
 
 import mido
-import pickle
 from collections import deque
-from threading import Thread, Timer
 import time
-import sched
 
 from pico.logger import logger
 from pico.pneno.interpolator import DMYSpeedInterpolator, DMAVelocityInterpolator, IFPSpeedInterpolator, \
     SpeedInterpolator, VelocityInterpolator
-from pico.pneno.pneno_seq import PnenoSegment, PnenoSeq, is_note_on, is_note_off, create_pneno_seq_from_midi_file
-from pico.util.midi_util import choose_midi_input
+from pico.pneno.latency_trace import LatencyTracer, KeypressTrace
+from pico.pneno.midi_scheduler import MidiScheduler
+from pico.pneno.session_log import SessionRecorder
+from pico.pneno.pneno_seq import PnenoSegment, PnenoSeq, ExpressedSegment, is_note_on, is_note_off, \
+    create_pneno_seq_from_midi_file, NOTE_ON_STATUS
+from pico.util.midi_util import choose_midi_input, raw_output_sender
+from pico.util.ring_buffer import TimedRingBuffer
 from pico.pico import PiCo
 
-scheduler = sched.scheduler(time.time, time.sleep)
+# How PnenoSystem receives MIDI input:
+# - polling:  spin on input_port.iter_pending() (legacy, burns a core)
+# - callback: the port's callback dispatches straight into get_sgmt/play_sgmt
+# - blocking: the port's callback feeds a queue drained by a dedicated thread doing a blocking get()
+INPUT_MODES = ('polling', 'callback', 'blocking')
+# What happens to the previous segment's accompaniment still scheduled when the next key arrives:
+# - keep:     play it as scheduled (it may overlap the new segment)
+# - drop:     cancel its unplayed notes
+# - flush:    play its unplayed notes now, keeping their durations
+# - compress: squeeze what remains into overlap_window seconds
+OVERLAP_POLICIES = ('keep', 'drop', 'flush', 'compress')
 
 
 class PnoSegBinder:
@@ -78,23 +91,48 @@ class PnenoSystem(PiCo):
     pno_seq: PnenoSeq
     seg_binder: PnoSegBinder
 
-    def __init__(self, input_port_name, output_port_name, pno_seq=None, history_size=1500, clean_intv=5,
+    def __init__(self, input_port_name, output_port_name, pno_seq=None, history_size=1500, history_window=5,
                  session_save_path=None, pneno_chnl=1,
-                 speed_interpolator: SpeedInterpolator = None, velocity_interpolator: VelocityInterpolator = None):
+                 speed_interpolator: SpeedInterpolator = None, velocity_interpolator: VelocityInterpolator = None,
+                 input_mode='callback', spin_threshold=0.002, trace_latency=True, clock=time.perf_counter,
+                 overlap_policy='keep', overlap_window=0.05, scheduler: MidiScheduler = None, clean_intv=None):
         """
 
-        :param input_port_name:
-        :param output_port_name:
+        :param input_port_name:     name of the MIDI input port, or an already opened mido input port
+        :param output_port_name:    name of the MIDI output port, or an already opened mido output port
         :param pno_seq:     predetermined orderedsequence of PnenoSegments. No async support.
-        :param history_size:
-        :param clean_intv:
-        :param session_save_path:      if provided (save folder), full performance will be saved as a pkl file
+        :param history_size:    maximum number of recent inputs kept in self.history
+        :param history_window:  seconds of recent input kept in self.history
+        :param session_save_path:      if provided (save folder), full performance is streamed into a .pnlog file
         :param pneno_chnl:     the MIDI channel to which the key MIDI will be sent
         :param speed_interpolator:
         :param velocity_interpolator:
+        :param input_mode:  one of INPUT_MODES. 'callback' and 'blocking' avoid the busy polling loop
+        :param spin_threshold:  seconds before an accompaniment deadline at which the scheduler starts spinning
+        :param trace_latency:   timestamp every stage of the keypress path (see LatencyTracer)
+        :param clock:   monotonic clock in seconds used for history, IOI and scheduling (injectable for simulation)
+        :param overlap_policy:  one of OVERLAP_POLICIES, applied to the previous segment when a key arrives early
+        :param overlap_window:  seconds within which the 'compress' policy plays the rest of the previous segment
+        :param scheduler:   MidiScheduler shared with other sessions (see PnenoHost). Its owner starts and stops it.
+            spin_threshold and clock are ignored.
+        :param clean_intv:  deprecated alias of history_window
         """
-        self.input_port = mido.open_input(input_port_name)
-        self.output_port = mido.open_output(output_port_name)
+        if clean_intv is not None:
+            logger.warn("clean_intv is deprecated, use history_window")
+            history_window = clean_intv
+        if input_mode not in INPUT_MODES:
+            raise ValueError(f"Unknown input mode: {input_mode}. Expected one of {INPUT_MODES}")
+        if overlap_policy not in OVERLAP_POLICIES:
+            raise ValueError(f"Unknown overlap policy: {overlap_policy}. Expected one of {OVERLAP_POLICIES}")
+        self.overlap_policy = overlap_policy
+        self.overlap_window = overlap_window
+        self.input_mode = input_mode
+        self.input_port = input_port_name if isinstance(input_port_name, mido.ports.BaseInput) \
+            else mido.open_input(input_port_name)
+        self.output_port = output_port_name if isinstance(output_port_name, mido.ports.BaseOutput) \
+            else mido.open_output(output_port_name)
+        self._send_raw = raw_output_sender(self.output_port)
+        self.clock = clock if scheduler is None else scheduler.clock
         self.key_chnl = pneno_chnl
 
         self.speed_interpolator = speed_interpolator if speed_interpolator else DMYSpeedInterpolator()
@@ -106,41 +144,71 @@ class PnenoSystem(PiCo):
             self.pno_seq = pno_seq
         self.seg_binder = PnoSegBinder()
         self.session_save_path = session_save_path
-        self.history = deque(maxlen=history_size if not self.session_save_path else None)
-        self.clean_intv = clean_intv
+        # Recent input only: full sessions are streamed by self.recorder
+        self.history = TimedRingBuffer(capacity=history_size, window=history_window, clock=self.clock)
+        self.recorder = None
 
         self.listening = True
         self.running_event = None
-        self.midi_scheduler = None
+        self._owns_scheduler = scheduler is None
+        self.midi_scheduler = MidiScheduler(clock=clock, spin_threshold=spin_threshold) if scheduler is None \
+            else scheduler
+        self._in_flight = []  # (note-on, note-off) ScheduledEvent pairs of the last scheduled segment
+        self.tracer = LatencyTracer(clock=self.midi_scheduler.clock, enabled=trace_latency)
         self.capture_thread = None
-        self.cleaner = None
-        self.start_time = time.time()
+        self.start_time = self.clock()
+        self._input_queue = queue.SimpleQueue() if input_mode == 'blocking' else None
 
         self._stopped = False
-        self._prev_time = 0
+        self._prev_time = None
 
     def load_score(self, score):
-        assert type(score) == PnenoSeq
+        assert isinstance(score, PnenoSeq)
         self.pno_seq = score
+        self.pno_seq.compile_playback()  # Keeps MIDI allocation and sorting out of the keypress path
         self.speed_interpolator.load_score(self.pno_seq.to_ioi_list())
 
     def start_realtime_capture(self):
         if self.listening:
             self.running_event = threading.Event()  # Event to control thread termination
-            self.capture_thread = threading.Thread(target=self.listen)
-            self.midi_scheduler = threading.Thread(target=self.run_midi_scheduler)
-            self.cleaner = Timer(self.clean_intv, self.clean_history) if not self.session_save_path else None
+            self.capture_thread = threading.Thread(target=self.listen) if self.input_mode != 'callback' else None
 
             self.running_event.set()  # Set the event to start the thread
-            self.capture_thread.start()
-            self.midi_scheduler.start()
-            self.cleaner.start() if not self.session_save_path else None
-            self.start_time = time.time()
+            if self.input_mode == 'polling':
+                self.capture_thread.start()
+            else:
+                # Both event-driven modes are fed by the port's callback (runs on the MIDI backend's thread)
+                self.input_port.callback = self.feed if self.input_mode == 'callback' else self._enqueue_input
+                if self.capture_thread is not None:
+                    self.capture_thread.start()
+            if self._owns_scheduler:
+                self.midi_scheduler.start()
+            self.start_time = self.clock()
+            self.open_recorder()
             logger.info("Pneno System started! Press any MIDI key to continue...")
         else:
             logger.warn("PnenoSystem is not listening to you.")
 
+    def start_headless(self):
+        """
+        Start without any thread: input is pushed through handle_input() and the scheduler is drained by the caller
+        with run_pending() (see pico.pneno.simulator)
+        """
+        self.running_event = threading.Event()
+        self.running_event.set()
+        if self._owns_scheduler:
+            self.midi_scheduler.start(threaded=False)
+        self.start_time = self.clock()
+        self.open_recorder()
+
     def listen(self):
+        if self.input_mode == 'blocking':
+            self._listen_blocking()
+        elif self.input_mode == 'polling':
+            self._listen_polling()
+        # In callback mode the input port drives self.feed, so there is nothing to loop over
+
+    def _listen_polling(self):
         while self.running_event.is_set():
             if not self.listening or self.input_port is None:
                 break
@@ -148,14 +216,7 @@ class PnenoSystem(PiCo):
                 for msg in self.input_port.iter_pending():
                     if not self.running_event.is_set():
                         break
-                    logger.debug('Received input:', msg)
-                    if is_note_on(msg) or is_note_off(msg):
-                        sgmt = self.get_sgmt(msg)
-                        synthesized_midi = self.play_sgmt(sgmt, msg)
-                        self.history.append((time.time(), msg, sgmt, synthesized_midi))
-                    else:
-                        self.output_port.send(msg)
-                        self.history.append((time.time(), msg, None, None))
+                    self.handle_input(msg)
 
                 time.sleep(0.00001)  # Tiny sleep to prevent blocking
 
@@ -167,12 +228,60 @@ class PnenoSystem(PiCo):
             #     logger.error(f"Unexpected error in listen loop: {e}")
             # break
 
+    def _enqueue_input(self, msg: mido.Message):
+        # Timestamped on receipt, so that traces include the time spent in the queue
+        self._input_queue.put((self.clock(), msg))
+
+    def _listen_blocking(self):
+        while self.running_event.is_set():
+            item = self._input_queue.get()  # Blocks until a message (or the stop sentinel) arrives
+            if item is None or not self.running_event.is_set():
+                break
+            self.feed(item[1], t=item[0])
+
+    def feed(self, msg: mido.Message, t=None):
+        """
+        Handle one input message the way the input port callback does: ignored unless capture is running
+        :param msg:
+        :param t:   time the message was received (defaults to now)
+        """
+        if not self.running_event.is_set() or not self.listening:
+            return
+        try:
+            self.handle_input(msg, t=t)
+        except (EOFError, OSError) as e:
+            logger.debug(f"Port error during listen: {e}")
+
+    def handle_input(self, msg: mido.Message, t=None):
+        """
+        Dispatch one input MIDI message: note events are mapped to PnenoSegments, others are passed through
+        :param msg:
+        :param t:   time the message was received (defaults to now). Only keypresses are traced.
+        """
+        if is_note_on(msg) or is_note_off(msg):
+            trace = self.tracer.begin(t) if is_note_on(msg) else None
+            logger.debug('Received input:', msg)
+            sgmt = self.get_sgmt(msg)
+            self.tracer.mark(trace, 'lookup')
+            synthesized_midi = self.play_sgmt(sgmt, msg, trace=trace)
+            record = (msg, sgmt, synthesized_midi, trace)
+        else:
+            logger.debug('Received input:', msg)
+            self.output_port.send(msg)
+            record = (msg, None, None, None)
+        t = self.clock()
+        self.history.append(record, t=t)
+        if self.recorder is not None:
+            self.recorder.record(t, *record[:3])
+
     def stop(self):
         if self._stopped:
             return
         logger.info("Stopping Pneno...")
         self.listening = False
         self.running_event.clear()  # Signal the thread to stop
+        if self._input_queue is not None:
+            self._input_queue.put(None)  # Wake up the blocking receive
 
         # Close the input port first to interrupt any blocking receive
         if self.input_port is not None:
@@ -180,13 +289,17 @@ class PnenoSystem(PiCo):
             logger.debug("MIDI input port closed.")
             self.input_port = None
 
-        if self.midi_scheduler and self.midi_scheduler.is_alive():
-            self.midi_scheduler.join(timeout=1.0)
-            if self.midi_scheduler.is_alive():
-                logger.warn("MIDI scheduler thread didn't stop gracefully within timeout")
-            else:
-                logger.debug("MIDI scheduler stopped.")
-            self.midi_scheduler = None
+        if not self._owns_scheduler:
+            # The shared scheduler keeps running for the other sessions: only drop what this session scheduled
+            owned = (self, self.output_port)
+            self.midi_scheduler.cancel_where(lambda e: getattr(e.action, '__self__', None) in owned)
+        elif self.midi_scheduler.is_running():
+            self.midi_scheduler.stop(timeout=1.0)
+            logger.debug("MIDI scheduler stopped.")
+            logger.info("Accompaniment lateness (ms):", self.midi_scheduler.lateness_summary())
+        if self.tracer.enabled:
+            for stage, stats in self.tracer.summary().items():
+                logger.info(f"Keypress latency [{stage}] (ms):", stats)
 
         # Now wait for the capture thread to finish
         if self.capture_thread and self.capture_thread.is_alive():
@@ -197,12 +310,6 @@ class PnenoSystem(PiCo):
                 logger.debug("Realtime capture stopped.")
             self.capture_thread = None
 
-        # Stop the cleaner timer
-        if self.cleaner and self.cleaner.is_alive():
-            self.cleaner.cancel()
-            logger.debug("Cleaner timer stopped.")
-            self.cleaner = None
-
         #  Close the output port
         if self.output_port is not None:
             self.output_port.close()
@@ -211,37 +318,64 @@ class PnenoSystem(PiCo):
 
         # If a path is provided, write the performance data
         self.save_performance_data()
-        self._prev_time = 0
+        self._prev_time = None
         self._stopped = True
 
-    def run_midi_scheduler(self):
-        while self.listening:
-            if scheduler.queue:
-                scheduler.run(blocking=False)
-            time.sleep(0.01)
+    def schedule_playback(self, expressed: ExpressedSegment, channel=0, trace: KeypressTrace = None):
+        if not self.midi_scheduler.is_running():
+            logger.warn("MIDI scheduler not started!")
+            return
+        now = self.midi_scheduler.clock()
+        pairs, sounding = [], {}
+        for t, status, note, velocity in expressed.events():
+            event = self.midi_scheduler.enter_at(now + t, self._send_bytes,
+                                                 (status | channel, note, velocity, trace, now + t))
+            if status == NOTE_ON_STATUS:
+                sounding.setdefault(note, deque()).append(len(pairs))
+                pairs.append([event, None])
+            elif sounding.get(note):
+                pairs[sounding[note].popleft()][1] = event  # Pair with the earliest unterminated note-on
+            else:
+                pairs.append([None, event])
+        self._in_flight = pairs
 
-    def express_midi_seq(self, midi_seq: list[mido.Message], speed_scale_factor=1.0, default_velocity=None):
+    def resolve_overlap(self):
         """
-        :param midi_seq:
-        :param speed_scale_factor:
-        :param default_velocity:
-        :return: list of midi seq (in absolute time) with updated expressive params
-            - midi seq in absolute time
+        Apply self.overlap_policy to what remains of the previous segment. A note-on is only moved or cancelled
+        together with its note-off, and note-offs of notes already sounding are never dropped.
         """
-        expressive_seq = midi_seq.copy()
-        for e in expressive_seq:
-            e.time *= speed_scale_factor
-            e.velocity = default_velocity if default_velocity else e.velocity
-            # logger.debug(f"Velocity: {e.velocity}")
-        return expressive_seq
-
-    def schedule_midi_seq(self, midi_seq, channel=0):
-        if not self.midi_scheduler.is_alive():
-            logger.warn("MIDI scheduler not started!")
+        pairs, self._in_flight = self._in_flight, []
+        if self.overlap_policy == 'keep' or not pairs:
             return
-        for e in midi_seq:
-            e.channel = channel
-            scheduler.enter(self.pno_seq.ticks_to_seconds(e.time), 1, self.output_port.send, (e,))
+        scheduler = self.midi_scheduler
+        now = scheduler.clock()
+
+        def move(event, deadline):
+            return scheduler.reschedule(event, deadline, event.args[:4] + (deadline,))
+
+        if self.overlap_policy == 'drop':
+            for on, off in pairs:
+                if on is not None and scheduler.cancel(on) and off is not None:
+                    scheduler.cancel(off)
+        elif self.overlap_policy == 'flush':
+            for on, off in pairs:
+                if on is not None and on.deadline > now and move(on, now) is not None and off is not None:
+                    move(off, now + max(0.0, off.deadline - on.deadline))  # Keep the note duration
+        elif self.overlap_policy == 'compress':
+            pending = [e for pair in pairs for e in pair if e is not None and e.pending() and e.deadline > now]
+            if pending:
+                last = max(e.deadline for e in pending)
+                ratio = min(1.0, self.overlap_window / (last - now))
+                # Monotonic mapping: every note-off stays after its note-on
+                for e in sorted(pending):
+                    move(e, now + (e.deadline - now) * ratio)
+
+    def _send_bytes(self, status, note, velocity, trace=None, deadline=None):
+        if self._send_raw is not None:
+            self._send_raw(status, note, velocity)
+        else:  # Ports of other backends (and virtual ports) only take mido.Message
+            self.output_port.send(mido.Message.from_bytes((status, note, velocity)))
+        self.tracer.mark_acc_sent(trace, deadline)
 
     def get_sgmt(self, m: mido.Message):
         sgmt = None
@@ -256,7 +390,7 @@ class PnenoSystem(PiCo):
             self.seg_binder.add_midi_binding(m, sgmt)
         return sgmt
 
-    def play_sgmt(self, sgmt: PnenoSegment, midi: mido.Message):
+    def play_sgmt(self, sgmt: PnenoSegment, midi: mido.Message, trace: KeypressTrace = None):
         if is_note_off(midi):
             seg = self.seg_binder.pop_by_midi(midi)
             if seg is None:
@@ -289,17 +423,23 @@ class PnenoSystem(PiCo):
                                     velocity=midi.velocity, time=0)
             logger.debug("Sending:", midi)
             self.output_port.send(key_midi)
+            self.tracer.mark(trace, 'key_sent')
 
-            curr_ioi = self.pno_seq.seconds_to_ticks(time.time() - self._prev_time) if self._prev_time != 0 else 1
+            now = self.clock()
+            curr_ioi = self.pno_seq.seconds_to_ticks(now - self._prev_time) if self._prev_time is not None else 1
             logger.debug('Current ioi:', curr_ioi, 'midi time:', midi.time, 'prev time:', self._prev_time)
-            midi_seq = self.express_midi_seq(
-                sgmt.to_midi_seq(use_absolute_time=True, include_key=False, start_from_zero=True),
-                speed_scale_factor=self.speed_interpolator.interpolate(curr_ioi),
-                default_velocity=self.velocity_interpolator.interpolate(
-                    midi.velocity) if self.velocity_interpolator else None)
-            self._prev_time = time.time()
-            self.schedule_midi_seq(midi_seq)
-            return midi_seq
+            if sgmt.playback_table is None:
+                sgmt.compile_playback(self.pno_seq.ticks_to_seconds)
+            expressed = ExpressedSegment(
+                table=sgmt.playback_table,
+                speed_scale=self.speed_interpolator.interpolate(curr_ioi),
+                velocity=self.velocity_interpolator.interpolate(midi.velocity) if self.velocity_interpolator else None)
+            self.tracer.mark(trace, 'interpolated')
+            self._prev_time = now
+            self.resolve_overlap()
+            self.schedule_playback(expressed, trace=trace)
+            self.tracer.mark(trace, 'scheduled')
+            return expressed
         else:
             logger.warn("Unknown type of midi:", midi)
             return None
@@ -308,52 +448,51 @@ class PnenoSystem(PiCo):
         logger.info('Appended note list: ', pitch_arr)
         self.noteseq.append_list(pitch_arr)
 
-    def clean_history(self):
-        current_time = time.time()
-        count = 0
-        while self.history and current_time - self.history[0][0] > 5:
-            self.history.popleft()
-            count += 1
-        logger.debug("+Cleaned", count, 'history')
-        self.cleaner = Timer(self.clean_intv, self.clean_history)  # Restart timer
-        self.cleaner.start()
+    def open_recorder(self):
+        """
+        If a session save path is provided, start streaming the performance into perf_data.pnlog
+        """
+        if not self.session_save_path or self.recorder is not None:
+            return
+        save_path = f'{self.session_save_path}/perf_data.pnlog'
+        fname_add = 0
+        if os.path.exists(save_path):
+            logger.warn("Existing performance data exist")
+            while os.path.exists(f'{self.session_save_path}/perf_data_{fname_add}.pnlog'):
+                fname_add += 1
+            save_path = f'{self.session_save_path}/perf_data_{fname_add}.pnlog'
+        meta = {
+            "ticks_per_beat": self.pno_seq.ticks_per_beat,
+            "tempo": self.pno_seq.tempo,
+            "pred_velocity": repr(self.velocity_interpolator),
+            "pred_speed": repr(self.speed_interpolator),
+            'key_chnl': self.key_chnl,
+            'start_time': self.start_time
+        }
+        self.recorder = SessionRecorder(save_path, self.pno_seq, meta)
 
     def save_performance_data(self):
         """
-        :return: performance data in the form of dict-
+        Close the session log. Use pico.pneno.session_log.load_performance_data to read it back as a dict-
         {
             attrs: values
-            performance: ${self.history}
-                            which is a list of tuples:
+            performance: list of tuples:
                                 (
-                                time.time(),
+                                self.clock() timestamp,
                                 performed msg (input MIDI event),
                                 corresponding PnenoSegment,
                                 synthesized MIDI  # with interpolated time and velocity information
-                                                  # in seconds after the onset of its key
+                                                  # in ticks after the onset of its key
                                 )
+            latency: per-stage p50/p95/p99 summary (ms) of the keypress path
         }
+        The in-memory self.history (last seconds only) holds (timestamp, (msg, PnenoSegment, synthesized MIDI,
+        KeypressTrace)) for each input.
         """
-        if self.session_save_path:
-            save_path = f'{self.session_save_path}/perf_data.pkl'
-            fname_add = 0
-            data = {
-                "ticks_per_beat": self.pno_seq.ticks_per_beat,
-                "tempo": self.pno_seq.tempo,
-                "pred_velocity": repr(self.velocity_interpolator),
-                "pred_speed": repr(self.speed_interpolator),
-                "performance": self.history,
-                'key_chnl': self.key_chnl,
-                'start_time': self.start_time
-            }
-            if os.path.exists(f'{self.session_save_path}/perf_data.pkl'):
-                logger.warn("Existing performance data exist")
-                while os.path.exists(f'{self.session_save_path}/perf_data_{fname_add}.pkl'):
-                    fname_add += 1
-                save_path = f'{self.session_save_path}/perf_data_{fname_add}.pkl'
-            with open(save_path, 'wb') as f:
-                pickle.dump(data, f)
-                print('Performance history saved to:', save_path)
+        if self.recorder is not None:
+            self.recorder.close({"latency": self.tracer.summary()})
+            print('Performance history saved to:', self.recorder.path)
+            self.recorder = None
 
 
 def start_interactive_session(midi_path):
@@ -0,0 +1,139 @@
+"""
+Compiled score cache
+
+A segmented score is stored as a PnenoArray: `<hash>.npy` holds the NOTE_DTYPE rows (memory-mapped when loaded)
+and `<hash>.json` holds ticks_per_beat, tempo and the number of segments. `<hash>` is the SHA-256 of the MIDI file
+content, the cache format and the segmentation version (SEGMENTATION_VERSION), so renamed or moved files still hit
+the cache, while edited files and scores compiled by an older segmentation are recompiled.
+
+Precompile a directory of scores:
+
+    python -m pico.pneno.score_cache example_scores --workers 4
+"""
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from pico.logger import logger
+from pico.pneno.pneno_array import PnenoArray, ArrayPnenoSeq, NOTE_DTYPE
+from pico.pneno.pneno_seq import create_pneno_seq_from_midi_file, SEGMENTATION_VERSION
+
+FORMAT_VERSION = 1
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'pico', 'scores')
+
+
+def midi_file_hash(midi_path):
+    h = hashlib.sha256(f'pneno-score-v{FORMAT_VERSION}-segmentation-v{SEGMENTATION_VERSION}'.encode())
+    with open(midi_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def cache_path(midi_path, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    :return: path of the compiled score, without extension
+    """
+    return os.path.join(cache_dir, midi_file_hash(midi_path))
+
+
+def save_compiled_score(array: PnenoArray, path):
+    """
+    Write `path`.npy and `path`.json. The json file is written last: a score is complete once it exists.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    meta = {'version': FORMAT_VERSION, 'ticks_per_beat': array.ticks_per_beat, 'tempo': array.tempo,
+            'segments': len(array)}
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        np.save(f, array.notes)
+    os.replace(tmp, path + '.npy')
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, path + '.json')
+
+
+def load_compiled_score(path, mmap=True):
+    """
+    :param path:    compiled score path, without extension
+    :param mmap:    memory-map the notes instead of reading them
+    :return: PnenoArray
+    """
+    with open(path + '.json') as f:
+        meta = json.load(f)
+    if meta.get('version') != FORMAT_VERSION:
+        raise ValueError(f"Unsupported compiled score version: {meta.get('version')}")
+    notes = np.load(path + '.npy', mmap_mode='r' if mmap else None)
+    if notes.dtype != NOTE_DTYPE:
+        raise ValueError(f"Unexpected compiled score layout: {notes.dtype}")
+    sgmt_offsets = np.searchsorted(notes['sgmt'], np.arange(meta['segments'] + 1))  # Rows are grouped by segment
+    return PnenoArray(notes, sgmt_offsets, ticks_per_beat=meta['ticks_per_beat'], tempo=meta['tempo'])
+
+
+def compile_score(midi_path, cache_dir=DEFAULT_CACHE_DIR, force=False):
+    """
+    :return: compiled score path (without extension)
+    """
+    path = cache_path(midi_path, cache_dir)
+    if force or not os.path.exists(path + '.json'):
+        save_compiled_score(PnenoArray.from_pneno_seq(create_pneno_seq_from_midi_file(midi_path)), path)
+    return path
+
+
+def load_pneno_seq(midi_path, cache_dir=DEFAULT_CACHE_DIR) -> ArrayPnenoSeq:
+    """
+    Drop-in for create_pneno_seq_from_midi_file: compile the score on the first call, memory-map it afterwards
+    """
+    path = cache_path(midi_path, cache_dir)
+    if os.path.exists(path + '.json'):
+        try:
+            return load_compiled_score(path).to_pneno_seq()
+        except (OSError, ValueError) as e:
+            logger.warn("Recompiling", midi_path, "- cached score could not be loaded:", e)
+    array = PnenoArray.from_pneno_seq(create_pneno_seq_from_midi_file(midi_path))
+    try:
+        save_compiled_score(array, path)
+    except OSError as e:
+        logger.warn("Could not cache the compiled score:", e)
+    return array.to_pneno_seq()
+
+
+def _compile_worker(args):
+    midi_path, cache_dir, force = args
+    try:
+        return midi_path, compile_score(midi_path, cache_dir, force=force), None
+    except Exception as e:
+        return midi_path, None, repr(e)
+
+
+def precompile_directory(score_dir, cache_dir=DEFAULT_CACHE_DIR, workers=None, force=False):
+    """
+    Compile every MIDI file under score_dir, in parallel
+    :return: list of (midi path, compiled path or None, error or None)
+    """
+    midi_paths = sorted(os.path.join(root, e) for root, _, files in os.walk(score_dir) for e in files
+                        if e.lower().endswith(('.mid', '.midi')))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_compile_worker, [(e, cache_dir, force) for e in midi_paths]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Precompile MIDI scores into the Pneno score cache')
+    parser.add_argument('score_dir', type=str, help="Directory searched recursively for .mid files")
+    parser.add_argument('--cache_dir', type=str, default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--workers', type=int, default=None, help="Number of processes (CPU count by default)")
+    parser.add_argument('--force', action='store_true', help="Recompile scores already in the cache")
+    args = parser.parse_args()
+
+    results = precompile_directory(args.score_dir, args.cache_dir, workers=args.workers, force=args.force)
+    for midi_path, path, error in results:
+        print(midi_path, '->', path if error is None else f'FAILED: {error}')
+    print(f"{sum(e[2] is None for e in results)}/{len(results)} scores compiled into {args.cache_dir}")
+
+
+if __name__ == '__main__':
+    main()
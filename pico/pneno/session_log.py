@@ -0,0 +1,270 @@
+"""
+Streaming session log (perf_data.pnlog)
+
+An append-only, chunked binary log written by a background thread, so that memory stays bounded during long
+rehearsals and a crash only loses the last unflushed chunk.
+
+File layout: MAGIC, then chunks of [4-byte tag][uint32 little-endian payload size][payload]
+    META    JSON session attributes (ticks_per_beat, tempo, interpolators, key_chnl, start_time)
+    SCOR    NOTE_DTYPE rows: every note of the score, with the index of its segment
+    INPT    INPUT_DTYPE rows: performed input events
+    SYNT    SYNTH_DTYPE rows: synthesized accompaniment events, linked to their input event
+    SUMM    JSON written when the session is closed (e.g. latency summary)
+
+load_performance_data() reads both this format and the legacy perf_data.pkl into the legacy dict layout.
+"""
+import argparse
+import json
+import os
+import pickle
+import queue
+import struct
+import threading
+import time
+
+import mido
+import numpy as np
+
+from pico.logger import logger
+from pico.pneno.pneno_seq import PnenoSeq, PnenoSegment, PnenoPitch, ExpressedSegment
+
+MAGIC = b'PNLOG\x01\n'
+_CHUNK_HEADER = struct.Struct('<4sI')
+
+NOTE_DTYPE = np.dtype([('sgmt', '<i4'), ('is_key', 'u1'), ('pitch', 'u1'), ('velocity', 'u1'), ('chnl', 'u1'),
+                       ('onset', '<f8'), ('offset', '<f8'), ('sgmt_onset', '<f8')])
+INPUT_DTYPE = np.dtype([('time', '<f8'), ('nbytes', 'u1'), ('status', 'u1'), ('data1', 'u1'), ('data2', 'u1'),
+                        ('sgmt', '<i4'), ('speed_scale', '<f8'), ('velocity', '<i2')])
+SYNTH_DTYPE = np.dtype([('input', '<i8'), ('time', '<f8'), ('status', 'u1'), ('note', 'u1'), ('velocity', 'u1')])
+
+
+def encode_chunk(tag: bytes, payload: bytes):
+    return _CHUNK_HEADER.pack(tag, len(payload)) + payload
+
+
+def iter_chunks(path):
+    """
+    :return: generator of (tag, payload). A truncated trailing chunk (crashed session) is ignored.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a Pneno session log")
+        while True:
+            header = f.read(_CHUNK_HEADER.size)
+            if len(header) < _CHUNK_HEADER.size:
+                return
+            tag, size = _CHUNK_HEADER.unpack(header)
+            payload = f.read(size)
+            if len(payload) < size:
+                logger.warn("Truncated chunk found at the end of", path)
+                return
+            yield tag, payload
+
+
+def encode_score(segments: list[PnenoSegment]):
+    rows = []
+    for i, sgmt in enumerate(segments):
+        for is_key, p in [(1, sgmt.key)] + [(0, e) for e in sgmt.sgmt]:
+            rows.append((i, is_key, p.pitch, p.velocity, p.chnl, p.onset, p.offset, sgmt.onset))
+    return np.array(rows, dtype=NOTE_DTYPE)
+
+
+def decode_score(notes: np.ndarray):
+    """
+    :return: list of PnenoSegment
+    """
+    segments = []
+    n_segments = int(notes['sgmt'].max()) + 1 if len(notes) else 0
+    bounds = np.searchsorted(notes['sgmt'], np.arange(n_segments + 1))  # Rows are grouped by segment
+    for i in range(n_segments):
+        rows = notes[bounds[i]:bounds[i + 1]]
+        sgmt_onset = rows['sgmt_onset'][0].item()
+        key, sgmt = None, []
+        for e in rows:
+            p = PnenoPitch(pitch=int(e['pitch']), velocity=int(e['velocity']), onset=e['onset'].item() + sgmt_onset,
+                           offset=e['offset'].item() + sgmt_onset, chnl=int(e['chnl']))
+            if e['is_key']:
+                key = p
+            else:
+                sgmt.append(p)
+        segments.append(PnenoSegment(key=key, segment=sgmt, onset=sgmt_onset))
+    return segments
+
+
+class SessionRecorder:
+    """
+    Append-only session writer. record() only enqueues; encoding and file I/O happen on a background thread.
+    """
+
+    def __init__(self, path, pno_seq: PnenoSeq, meta: dict, chunk_size=256, flush_intv=1.0):
+        """
+        :param path:    .pnlog file to create
+        :param pno_seq: the performed score (its segments are written once, records refer to them by index)
+        :param meta:    JSON-serializable session attributes
+        :param chunk_size:  number of input records per chunk
+        :param flush_intv:  maximum seconds before pending records are written
+        """
+        self.path = path
+        self.chunk_size = chunk_size
+        self.flush_intv = flush_intv
+        self.seconds_per_tick = pno_seq.ticks_to_seconds(1)
+        self._sgmt_index = {id(e): i for i, e in enumerate(pno_seq.seq)}
+        self._queue = queue.SimpleQueue()
+        self._n_inputs = 0
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+        self._write(b'META', json.dumps(meta).encode())
+        self._write(b'SCOR', encode_score(pno_seq.seq).tobytes())
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _write(self, tag, payload):
+        self._file.write(encode_chunk(tag, payload))
+        self._file.flush()
+
+    def record(self, t, msg: mido.Message, sgmt: PnenoSegment or None, synth):
+        self._queue.put((t, msg, sgmt, synth))
+
+    def close(self, summary: dict = None):
+        self._queue.put(None)
+        self._thread.join()
+        if summary is not None:
+            self._write(b'SUMM', json.dumps(summary).encode())
+        self._file.close()
+
+    def _run(self):
+        pending = []
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_intv)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                self._flush(pending)
+                return
+            if item:
+                pending.append(item)
+            if len(pending) >= self.chunk_size or (pending and time.monotonic() - last_flush >= self.flush_intv):
+                self._flush(pending)
+                pending = []
+                last_flush = time.monotonic()
+
+    def _flush(self, records):
+        skipped = [e for e in records if len(e[1].bytes()) > 3]
+        if skipped:
+            # INPUT_DTYPE rows hold up to 3 bytes: longer messages (system exclusive) are not recorded
+            logger.debug(f"{len(skipped)} system exclusive messages not recorded:", [e[1] for e in skipped])
+            records = [e for e in records if len(e[1].bytes()) <= 3]
+        if not records:
+            return
+        inputs = np.zeros(len(records), dtype=INPUT_DTYPE)
+        synths = []
+        for i, (t, msg, sgmt, synth) in enumerate(records):
+            data = msg.bytes()
+            status, data1, data2 = (list(data) + [0, 0, 0])[:3]
+            sgmt_index = self._sgmt_index.get(id(sgmt), -1) if sgmt is not None else -1
+            speed_scale, velocity = np.nan, -1
+            if isinstance(synth, ExpressedSegment):
+                speed_scale = synth.speed_scale
+                velocity = synth.velocity if synth.velocity else -1
+                synths.extend((self._n_inputs + i, sec / self.seconds_per_tick, ev_status, note, vel)
+                              for sec, ev_status, note, vel in synth.events())
+            elif synth:
+                synths.extend((self._n_inputs + i, m.time, m.bytes()[0] & 0xF0, m.note, m.velocity) for m in synth)
+            inputs[i] = (t, len(data), status, data1, data2, sgmt_index, speed_scale, velocity)
+        self._n_inputs += len(records)
+        self._write(b'INPT', inputs.tobytes())
+        self._write(b'SYNT', np.array(synths, dtype=SYNTH_DTYPE).tobytes())
+
+
+def read_session_log(path):
+    """
+    :return: dict with 'meta', 'summary' (dicts), 'score', 'inputs', 'synth' (structured arrays)
+    """
+    meta, summary = {}, {}
+    score = np.zeros(0, dtype=NOTE_DTYPE)
+    inputs, synths = [], []
+    for tag, payload in iter_chunks(path):
+        if tag == b'META':
+            meta = json.loads(payload)
+        elif tag == b'SUMM':
+            summary = json.loads(payload)
+        elif tag == b'SCOR':
+            score = np.frombuffer(payload, dtype=NOTE_DTYPE)
+        elif tag == b'INPT':
+            inputs.append(np.frombuffer(payload, dtype=INPUT_DTYPE))
+        elif tag == b'SYNT':
+            synths.append(np.frombuffer(payload, dtype=SYNTH_DTYPE))
+    return {
+        'meta': meta,
+        'summary': summary,
+        'score': score,
+        'inputs': np.concatenate(inputs) if inputs else np.zeros(0, dtype=INPUT_DTYPE),
+        'synth': np.concatenate(synths) if synths else np.zeros(0, dtype=SYNTH_DTYPE),
+    }
+
+
+def load_performance_data(perf_file):
+    """
+    Load a session, either a .pnlog session log or a legacy perf_data.pkl
+    :return: dict in the legacy perf_data.pkl layout (see PnenoSystem.save_performance_data)
+    """
+    if not perf_file.endswith('.pnlog'):
+        with open(perf_file, 'rb') as f:
+            return pickle.load(f)
+
+    log = read_session_log(perf_file)
+    segments = decode_score(log['score'])
+    synth = log['synth']
+    bounds = np.searchsorted(synth['input'], np.arange(len(log['inputs']) + 1))
+    performance = []
+    for i, e in enumerate(log['inputs']):
+        if e['nbytes'] == 0:
+            continue  # Unrecorded system exclusive message (logs written before they were skipped)
+        msg = mido.Message.from_bytes(bytes([e['status'], e['data1'], e['data2']][:e['nbytes']]))
+        sgmt = segments[e['sgmt']] if e['sgmt'] >= 0 else None
+        rows = synth[bounds[i]:bounds[i + 1]]
+        synthesized = [mido.Message(type='note_on' if r['status'] == 0x90 else 'note_off', note=int(r['note']),
+                                    velocity=int(r['velocity']), channel=0, time=r['time'].item()) for r in rows] \
+            if sgmt is not None else None
+        performance.append((e['time'].item(), msg, sgmt, synthesized))
+    data = dict(log['meta'])
+    data.update(log['summary'])
+    data['performance'] = performance
+    return data
+
+
+def convert_perf_pickle(pkl_path, out_path=None):
+    """
+    Convert a legacy perf_data.pkl into a session log
+    :return: path of the written .pnlog file
+    """
+    with open(pkl_path, 'rb') as f:
+        data = pickle.load(f)
+    out_path = out_path if out_path else os.path.splitext(pkl_path)[0] + '.pnlog'
+
+    # Segments are only known through the performance: keep them in order of appearance
+    segments = []
+    for e in data['performance']:
+        if e[2] is not None and all(e[2] is not s for s in segments):
+            segments.append(e[2])
+    pno_seq = PnenoSeq(segments, ticks_per_beat=data['ticks_per_beat'], tempo=data['tempo'])
+    meta = {k: v for k, v in data.items() if k not in ('performance', 'latency')}
+    recorder = SessionRecorder(out_path, pno_seq, meta)
+    for e in data['performance']:
+        recorder.record(e[0], e[1], e[2], e[3])
+    recorder.close({'latency': data['latency']} if 'latency' in data else None)
+    return out_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert legacy perf_data.pkl files into session logs')
+    parser.add_argument('pkl_files', type=str, nargs='+')
+    args = parser.parse_args()
+    for e in args.pkl_files:
+        print(e, '->', convert_perf_pickle(e))
+
+
+if __name__ == '__main__':
+    main()
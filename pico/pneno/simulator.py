@@ -0,0 +1,189 @@
+"""
+Headless PnenoSystem sessions
+
+Feeds a tap stream (recorded session or synthetic) through the same get_sgmt/play_sgmt/scheduler logic as a
+live session, but against in-memory ports and a virtual clock, as fast as the CPU allows.
+The result is the exact output event stream with timestamps.
+
+    python -m pico.pneno.simulator --midi_path example_scores/sutekidane.mid --tempo_scale 1.1 --output sim.mid
+"""
+import argparse
+import logging
+import random
+import time
+
+import mido
+
+from pico.logger import logger
+from pico.pneno.interpolator import IFPSpeedInterpolator, KalmanSpeedInterpolator, DMAVelocityInterpolator
+from pico.pneno.pneno_seq import PnenoSeq, create_pneno_seq_from_midi_file
+from pico.pneno.pneno_system import PnenoSystem, OVERLAP_POLICIES
+from pico.pneno.session_log import load_performance_data
+from pico.util.midi_util import seconds_to_ticks, convert_abs_to_delta_time, midi_list_to_midi
+
+
+class VirtualClock:
+    """Settable clock, called like time.perf_counter()"""
+
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def set(self, t):
+        assert t >= self.now, "A virtual clock cannot go backwards"
+        self.now = t
+
+    def advance(self, seconds):
+        self.set(self.now + seconds)
+
+
+class VirtualInputPort(mido.ports.BaseInput):
+    """In-memory input port: messages pushed with feed() are returned by receive()/iter_pending()"""
+
+    def __init__(self, name='virtual-in', **kwargs):
+        super().__init__(name, **kwargs)
+
+    def feed(self, msg: mido.Message):
+        self._messages.append(msg)
+
+
+class VirtualOutputPort(mido.ports.BaseOutput):
+    """In-memory output port recording every sent message as (clock time, message)"""
+
+    def __init__(self, clock=time.perf_counter, name='virtual-out', **kwargs):
+        self.clock = clock
+        self.sent = []
+        super().__init__(name, **kwargs)
+
+    def _send(self, msg):
+        self.sent.append((self.clock(), msg))
+
+
+class SessionSimulator:
+    def __init__(self, pno_seq: PnenoSeq, **kwargs):
+        """
+        :param pno_seq:
+        :param kwargs:  forwarded to PnenoSystem (interpolators, pneno_chnl, session_save_path ...)
+        """
+        self.clock = VirtualClock()
+        self.input_port = VirtualInputPort()
+        self.output_port = VirtualOutputPort(clock=self.clock)
+        self.system = PnenoSystem(input_port_name=self.input_port, output_port_name=self.output_port,
+                                  clock=self.clock, **kwargs)
+        self.system.load_score(pno_seq)
+
+    def advance_to(self, t=None):
+        """
+        Move the virtual clock to `t`, dispatching every scheduled event on the way exactly at its deadline.
+        :param t: target time. If None, run until the scheduler is empty.
+        """
+        scheduler = self.system.midi_scheduler
+        while True:
+            deadline = scheduler.next_deadline()
+            if deadline is None or (t is not None and deadline > t):
+                break
+            self.clock.set(max(deadline, self.clock()))
+            scheduler.run_pending()
+        if t is not None:
+            self.clock.set(max(t, self.clock()))
+
+    def run(self, taps):
+        """
+        :param taps: iterable of (seconds since session start, input mido.Message), sorted by time
+        :return: list of (seconds since session start, output mido.Message)
+        """
+        self.system.start_headless()
+        start = self.clock()
+        for t, msg in taps:
+            self.advance_to(start + t)
+            self.system.handle_input(msg)
+        self.advance_to(None)
+        self.system.stop()
+        return [(t - start, msg) for t, msg in self.output_port.sent]
+
+
+def taps_from_performance(perf_file):
+    """
+    :param perf_file:   perf_data.pnlog (or legacy perf_data.pkl)
+    :return: list of (seconds since session start, input mido.Message)
+    """
+    data = load_performance_data(perf_file)
+    start_time = data['start_time']
+    return [(e[0] - start_time, e[1]) for e in data['performance']]
+
+
+def synthetic_taps(pno_seq: PnenoSeq, tempo_scale=1.0, jitter=0.0, velocity=80, legato=0.9, pitch=60, seed=None):
+    """
+    Tap every key of the score
+    :param pno_seq:
+    :param tempo_scale: > 1 plays slower than the score
+    :param jitter:  standard deviation (seconds) of the onset timing noise
+    :param velocity:
+    :param legato:  note-off happens after this fraction of the IOI
+    :param pitch:   the pitch being tapped (any pitch does)
+    :param seed:
+    :return: list of (seconds since session start, input mido.Message), sorted by time
+    """
+    rng = random.Random(seed)
+    score_onsets = pno_seq.to_onset_list()
+    onsets = []
+    for e in score_onsets:
+        t = pno_seq.ticks_to_seconds(e - score_onsets[0]) * tempo_scale + (rng.gauss(0, jitter) if jitter else 0)
+        onsets.append(max(t, onsets[-1] + 1e-3) if onsets else max(t, 0.0))
+    taps = []
+    for i, t in enumerate(onsets):
+        ioi = onsets[i + 1] - t if i + 1 < len(onsets) else 0.5
+        taps.append((t, mido.Message('note_on', note=pitch, velocity=velocity)))
+        taps.append((t + ioi * legato, mido.Message('note_off', note=pitch, velocity=0)))
+    taps.sort(key=lambda e: e[0])
+    return taps
+
+
+def events_to_midi(events, ticks_per_beat=480, tempo=500_000):
+    """
+    :param events: list of (seconds, mido.Message)
+    :return: mido.MidiFile
+    """
+    midi_list = []
+    for t, msg in events:
+        midi_list.append(msg.copy(time=seconds_to_ticks(t, tempo=tempo, ticks_per_beat=ticks_per_beat)))
+    convert_abs_to_delta_time(midi_list)
+    return midi_list_to_midi(midi_list, ticks_per_beat=ticks_per_beat, tempo=tempo)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate a Pneno session without MIDI devices')
+    parser.add_argument('--midi_path', type=str, required=True, help="Path to a MIDI file")
+    parser.add_argument('--perf', type=str, required=False, help="Replay the taps of a perf_data.pnlog/.pkl file")
+    parser.add_argument('--tempo_scale', type=float, default=1.0, help="Synthetic taps: > 1 is slower")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Synthetic taps: timing noise in seconds")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--interpolate_velocity', action='store_true')
+    parser.add_argument('--speed_interpolator', type=str, default='ifp', choices=['ifp', 'kalman'])
+    parser.add_argument('--overlap_policy', type=str, default='keep', choices=list(OVERLAP_POLICIES))
+    parser.add_argument('--output', type=str, required=False, help="Save the output stream as a MIDI file")
+    args = parser.parse_args()
+
+    logger.set_level(logging.WARNING)
+    pno_seq = create_pneno_seq_from_midi_file(args.midi_path)
+    taps = taps_from_performance(args.perf) if args.perf else \
+        synthetic_taps(pno_seq, tempo_scale=args.tempo_scale, jitter=args.jitter, seed=args.seed)
+    speed_interpolator = KalmanSpeedInterpolator() if args.speed_interpolator == 'kalman' else IFPSpeedInterpolator()
+    sim = SessionSimulator(pno_seq, speed_interpolator=speed_interpolator,
+                           velocity_interpolator=DMAVelocityInterpolator() if args.interpolate_velocity else None,
+                           overlap_policy=args.overlap_policy)
+    wall_start = time.perf_counter()
+    events = sim.run(taps)
+    wall = time.perf_counter() - wall_start
+    duration = events[-1][0] if events else 0
+    print(f"{len(taps)} taps -> {len(events)} output events, {duration:.2f}s of music simulated in {wall:.3f}s "
+          f"({duration / wall if wall else float('inf'):.0f}x real time)")
+    if args.output:
+        events_to_midi(events, ticks_per_beat=pno_seq.ticks_per_beat, tempo=pno_seq.tempo).save(args.output)
+        print('Output saved to:', args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+import os
+
+import mido
+
+from pico.pneno.pneno_seq import create_pneno_seq_from_midi_file
+from pico.util.alignment_corpus import *
+from pico.util.midi_util import midi_to_pitch_name, seconds_to_ticks
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'example_scores')
+
+
+def write_aligned_performance(score_midi, directory, perf_name, tempo_scale):
+    """
+    Score fmt3x, match file and MIDI of the score played `tempo_scale` times slower, with velocity = pitch
+    """
+    pno_seq = create_pneno_seq_from_midi_file(score_midi)
+    notes, onsets = pno_seq.flatten()
+    chords = {}
+    for e, onset in sorted(zip(notes, onsets), key=lambda x: (x[1], x[0].pitch)):
+        chords.setdefault(onset, []).append(e.pitch)
+    fmt3x_lines, match_rows = ['//TPQN: 480'], []
+    for onset, pitches in chords.items():
+        ids = [f'P1-{onset}-{i}' for i in range(len(pitches))]
+        names = [midi_to_pitch_name(e) for e in pitches]
+        fmt3x_lines.append('\t'.join(map(str, [onset, 0, 0, 1, 0, 0, 'chord', 1, len(pitches)] + names +
+                                         ['N'] * len(pitches) + ids)))
+        t = pno_seq.ticks_to_seconds(onset) * tempo_scale
+        match_rows.extend((t, p, name, note_id) for p, name, note_id in zip(pitches, names, ids))
+    with open(os.path.join(directory, 'score_fmt3x.txt'), 'w') as f:
+        f.write('\n'.join(fmt3x_lines) + '\n')
+    with open(os.path.join(directory, perf_name + '_match.txt'), 'w') as f:
+        f.write('// fmt3x: score_fmt3x.txt\n')
+        for i, (t, pitch, name, note_id) in enumerate(match_rows):
+            f.write('\t'.join(map(str, [i, t, t + 0.1, name, pitch, 64, 0, 0, 0, note_id, 0, 0])) + '\n')
+    events = [(seconds_to_ticks(t + d), 'note_on' if d == 0 else 'note_off', p) for t, p, _, _ in match_rows
+              for d in (0, 0.1)]
+    track, now = mido.MidiTrack(), 0
+    for tick, kind, pitch in sorted(events, key=lambda e: (e[0], e[1] == 'note_on')):
+        track.append(mido.Message(kind, note=pitch, velocity=pitch, time=tick - now))
+        now = tick
+    perf = mido.MidiFile()
+    perf.tracks.append(track)
+    perf.save(os.path.join(directory, perf_name + '.mid'))
+    mido.MidiFile(score_midi).save(os.path.join(directory, 'score.mid'))
+
+
+def test_build_ioi_dataset(tmp_path):
+    piece = tmp_path / 'piece'
+    piece.mkdir()
+    write_aligned_performance(os.path.join(EXAMPLE_DIR, 'sutekidane.mid'), str(piece), 'slow', 1.5)
+    (piece / 'broken_match.txt').write_text('0\t0.5\t1.0\tC4\t64\t80\t0\t0\t0\tP1-0-0\t0\t0\n')
+    results = build_ioi_dataset(str(tmp_path), str(tmp_path / 'ioi.npz'), workers=2)
+    assert [e[0] for e in results] == [os.path.join('piece', 'broken'), os.path.join('piece', 'slow')]
+    assert results[0][1] is not None and results[1][1] is None
+
+    dataset = np.load(str(tmp_path / 'ioi.npz'))
+    n_segments = len(create_pneno_seq_from_midi_file(os.path.join(EXAMPLE_DIR, 'sutekidane.mid')).seq)
+    assert dataset['items'].tolist() == [os.path.join('piece', 'slow')]
+    assert dataset['failed'].tolist() == [os.path.join('piece', 'broken')]
+    assert dataset['failed_errors'].tolist() == [results[0][1]]
+    assert len(dataset['key_ioi_ratio']) == n_segments and (dataset['key_item'] == 0).all()
+    assert np.allclose(dataset['key_ioi_ratio'][1:], 1.5, rtol=0.05)  # Score IOIs are shortened by IOI_PLACEHOLDER
+    assert (dataset['key_velocity'] == dataset['key_pitch']).all()
+    seconds_per_beat = dataset['key_perf_onset'][1] / dataset['key_score_onset'][1]
+    sgmt_key = dataset['sgmt_key']
+    assert np.allclose(dataset['sgmt_perf_onset'] - dataset['key_perf_onset'][sgmt_key],
+                       (dataset['sgmt_score_onset'] - dataset['key_score_onset'][sgmt_key]) * seconds_per_beat)
@@ -0,0 +1,90 @@
+from pico.pneno.pneno_seq import PnenoPitch, PnenoSegment, PnenoSeq
+import numpy as np
+
+from pico.util.alignment_parser import ScoreParser, MatchParser, ScoreNote, MatchNote, create_fmt3x_mapping, \
+    calculate_perf_ioi, parse_match
+
+FMT3X = """//Fmt3xVersion: 170225
+//TPQN: 480
+// some comment
+0\t0\t0\t1\t0\t0\tchord\t480\t2\tC4\tE4\tN\tN\tP1-1-1\tP1-1-2
+480\t0\t0\t1\t0\t1\tchord\t480\t1\tG4\tN\tP1-1-3
+"""
+
+MATCH = """//Version: MatchFileVersion1.0
+// Score: score.mid
+// Perfm: perf.mid
+//Missing\t480\tP1-1-3
+0\t0.5\t1.0\tC4\t64\t80\t0\t0\t0\tP1-1-1\t0\t0
+1\t0.51\t1.0\tE4\t70\t80\t0\t0\t0\tP1-1-2\t0\t0
+2\t0.9\t1.2\tA4\t50\t80\t0\t0\t-1\t*\t3\t-
+"""
+
+
+def test_score_parser(tmp_path):
+    path = tmp_path / 'score_fmt3x.txt'
+    path.write_text(FMT3X)
+    parser = ScoreParser()
+    parser.parse_file(str(path))
+    assert parser.tqpn == 480 and parser.version == '170225'
+    assert len(parser.notes) == 3 and list(parser.sorted_notes) == [['P1-1-1', 'P1-1-2'], ['P1-1-3']]
+    assert parser.get_note_by_id('P1-1-2') == ScoreNote(id='P1-1-2', score_time=0.0, bar=0, staff=0, voice=1,
+                                                       sub_voice=0, order=0, event_type='chord', duration=480.0,
+                                                       pitch='E4', note_type='N', chord=['P1-1-1', 'P1-1-2'])
+    assert parser.notes['P1-1-1'].chord is parser.notes['P1-1-2'].chord  # Chords are stored once
+    assert parser.get_note_by_id('missing') is None
+
+
+def test_match_parser(tmp_path):
+    path = tmp_path / 'match.txt'
+    path.write_text(MATCH + "bad\tline\n")
+    parser = MatchParser()
+    parser.parse_file(str(path))
+    assert parser.version == 'MatchFileVersion1.0' and parser.score == 'score.mid' and parser.perf == 'perf.mid'
+    assert parser.ordered_notes == ['0', '1', '2']
+    assert parser.matched_notes == ['0', '1'] and parser.extra_notes == ['2']
+    assert [(e.score_beat, e.note_id) for e in parser.missing_notes] == [('480', 'P1-1-3')]
+    assert parser.score_map['P1-1-2'] == MatchNote(id='1', onset_time=0.51, offset_time=1.0, pitch='E4',
+                                                   onset_velocity=70, offset_velocity=80, channel=0,
+                                                   match_status='0', score_time=0.0, score_note_id='P1-1-2',
+                                                   error_index=0, skip_index='0')
+    assert parser.count_aligned_midi() == 2
+    assert parser.to_json()['2']['skip_index'] == '-'
+    for chunk_size in [16, 100]:  # Lines and the header cut across chunks
+        table = parse_match(str(path), chunk_size=chunk_size)
+        assert np.array_equal(table.notes, parser.table.notes) and table.ids == parser.ordered_notes
+        assert table.header == parser.table.header and len(table.missing_notes) == 1
+
+
+def test_create_fmt3x_mapping(tmp_path):
+    path = tmp_path / 'score_fmt3x.txt'
+    path.write_text(FMT3X)
+    parser = ScoreParser()
+    parser.parse_file(str(path))
+    assert parser.pitch_index == {(0, 60): ['P1-1-1'], (0, 64): ['P1-1-2'], (1, 67): ['P1-1-3']}
+    notes = [PnenoPitch(pitch=p, velocity=64, onset=t, offset=t + 480) for p, t in ((64, 0), (60, 0), (67, 480),
+                                                                                   (69, 480))]
+    errors = {}
+    create_fmt3x_mapping(parser, notes, [e.onset for e in notes], errors=errors)
+    assert [e.id for e in notes] == ['P1-1-2', 'P1-1-1', 'P1-1-3', None]
+    assert errors == {'duplicates': [], 'unmatched': [notes[3]]}
+
+
+def test_calculate_perf_ioi(tmp_path):
+    (tmp_path / 'score_fmt3x.txt').write_text(FMT3X)
+    (tmp_path / 'match.txt').write_text(MATCH.replace('0\t0.5\t1.0', '0\t0.52\t1.0') +
+                                        "3\t1.5\t2.0\tG4\t50\t80\t0\t0\t480\tP1-1-3\t0\t0\n")
+    score_info, match_info = ScoreParser(), MatchParser()
+    score_info.parse_file(str(tmp_path / 'score_fmt3x.txt'))
+    match_info.parse_file(str(tmp_path / 'match.txt'))
+
+    def note(note_id, pitch, onset):
+        e = PnenoPitch(pitch=pitch, velocity=64, onset=onset, offset=onset + 480)
+        e.id = note_id
+        return e
+
+    pno_seq = PnenoSeq([PnenoSegment(note('P1-1-1', 60, 0), [note('P1-1-2', 64, 0)]),
+                        PnenoSegment(note('P1-1-3', 67, 480), [])], ticks_per_beat=480)
+    key_ioi, sgmt_ioi = calculate_perf_ioi(pno_seq, score_info, match_info)
+    assert key_ioi == [0.0, 1.5 - 0.52]
+    assert sgmt_ioi == [[0.0], []]  # E4 is played before its key: clamped to the key onset
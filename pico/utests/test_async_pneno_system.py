@@ -0,0 +1,66 @@
+import asyncio
+import os
+import time
+
+import mido
+
+from pico.pneno.async_pneno_system import AsyncPnenoSystem
+from pico.pneno.pneno_seq import create_pneno_seq_from_midi_file
+from pico.pneno.simulator import VirtualInputPort, VirtualOutputPort
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'example_scores')
+N_KEYS = 3
+
+
+def acc_note_ons(output_port):
+    return [m for _, m in output_port.sent if m.type == 'note_on' and m.velocity > 0 and m.channel == 0]
+
+
+def test_runs_on_the_running_loop():
+    pno_seq = create_pneno_seq_from_midi_file(os.path.join(EXAMPLE_DIR, 'schubert_gb.mid'))
+    n_acc = sum(len(pno_seq[i].sgmt) for i in range(N_KEYS))
+
+    async def session():
+        output_port = VirtualOutputPort()
+        pno = AsyncPnenoSystem(VirtualInputPort(), output_port, pneno_chnl=1)
+        pno.load_score(pno_seq)
+        pno.start_realtime_capture()
+        for _ in range(N_KEYS):
+            pno.handle_input(mido.Message('note_on', note=60, velocity=80))
+            await asyncio.sleep(0.05)
+            pno.handle_input(mido.Message('note_off', note=60, velocity=0))
+        while len(pno.midi_scheduler):
+            await asyncio.sleep(0.05)
+        pno.stop()
+        await pno.wait_stopped()
+        return output_port, pno.midi_scheduler.lateness_summary()
+
+    output_port, lateness = asyncio.run(session())
+    assert len(acc_note_ons(output_port)) == n_acc
+    assert lateness['count'] == 2 * n_acc
+
+
+def test_runs_its_own_loop():
+    """Outside of a coroutine: the port callback hands input over to the loop thread"""
+    pno_seq = create_pneno_seq_from_midi_file(os.path.join(EXAMPLE_DIR, 'schubert_gb.mid'))
+    input_port, output_port = VirtualInputPort(), VirtualOutputPort()
+    pno = AsyncPnenoSystem(input_port, output_port, pneno_chnl=1)
+    pno.load_score(pno_seq)
+    pno.start_realtime_capture()
+    input_port.callback(mido.Message('note_on', note=60, velocity=80))
+    deadline = time.perf_counter() + 10
+    while not acc_note_ons(output_port) and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    pno.stop()
+    assert acc_note_ons(output_port)
+    assert pno.loop.is_closed()
+
+
+def test_history_holds_recent_input():
+    pno = AsyncPnenoSystem(VirtualInputPort(), VirtualOutputPort(), pneno_chnl=1, clean_intv=2)
+    assert pno.history.window == 2  # Deprecated alias of history_window
+    pno.load_score(create_pneno_seq_from_midi_file(os.path.join(EXAMPLE_DIR, 'schubert_gb.mid')))
+    msg = mido.Message('note_on', note=60, velocity=80)
+    pno.handle_input(msg)
+    [(t, (performed, sgmt, synth, trace))] = pno.history.snapshot(None)
+    assert performed is msg and sgmt is not None and t <= pno.clock()
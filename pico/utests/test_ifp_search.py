@@ -0,0 +1,37 @@
+import os
+
+import pytest
+from pico.pneno.ifp_search import *
+from pico.pneno.interpolator import IOI_PLACEHOLDER
+
+
+def _session(performer, piece, tempo_scale):
+    score_ioi = [IOI_PLACEHOLDER] + [120, 240, 120, 120, 480, 240, 120] * 3
+    perf_ioi = [IOI_PLACEHOLDER] + [e * tempo_scale for e in score_ioi[1:]]
+    return Session(f'{performer}/{piece}/perf_data.pnlog', performer, piece, score_ioi, perf_ioi, None)
+
+
+def test_session_labels():
+    assert session_labels(os.path.join('root', 'alice', 'gb', 'perf_data.pnlog'), 'root') == ('alice', 'gb')
+    assert session_labels(os.path.join('root', 'gb', 'perf_data.pnlog'), 'root') == ('-', 'gb')
+
+
+def test_prediction_errors():
+    errors = prediction_errors(_session('alice', 'gb', 1.0), DEFAULT_PARAMS)
+    assert len(errors) == 21
+    assert errors == pytest.approx(0)  # Played exactly at the score tempo
+
+
+def test_search():
+    sessions = [_session('alice', 'gb', 1.0), _session('bob', 'gb', 1.5), _session('bob', 'waltz', 0.8)]
+    results = search(sessions, [dict(DEFAULT_PARAMS), dict(DEFAULT_PARAMS, wt=0.0)], workers=2)
+    assert [e['error'] for e in results] == sorted(e['error'] for e in results)
+    assert set(summarize(sessions, results[0]['totals'], 'performer')) == {'alice', 'bob'}
+    assert summarize(sessions, results[0]['totals'], 'piece')['gb'] > 0
+
+
+def test_compare_interpolators():
+    sessions = [_session('alice', 'gb', 1.0), _session('bob', 'gb', 1.5)]
+    results = search(sessions, [(k, v[1]) for k, v in INTERPOLATORS.items()], workers=2)
+    assert {e['interpolator'] for e in results} == set(INTERPOLATORS)
+    assert all(np.isfinite(e['error']) for e in results)
@@ -1,4 +1,5 @@
 import pytest
+import numpy as np
 from pico.pneno.interpolator import *
 
 
@@ -13,3 +14,49 @@ def test_interpolate_bpm(ioi_list: list[float], input_ioi: list[float]):
         ratio = ifp.interpolate(e)
         ratio_list.append(ratio)
     assert ifp.is_end()
+
+
+@pytest.mark.parametrize("with_template", [False, True])
+def test_interpolate_batch(with_template):
+    score_ioi = [IOI_PLACEHOLDER, 20, 10, 10, 20, 20, 40, 10, 10]
+    perf_ioi = [25, 15, 15, 18, 18, 30, 12, 9, 11]  # The last one is past the end of the score
+    interpolators = [IFPSpeedInterpolator(), IFPSpeedInterpolator()]
+    for e in interpolators:
+        if with_template:
+            e.load_template(score_ioi, [IOI_PLACEHOLDER, 22, 11, 9, 21, 18, 44, 10, 12])
+        else:
+            e.load_score(score_ioi)
+    sequential = [interpolators[0].interpolate(e) for e in perf_ioi]
+    batch = interpolators[1].interpolate_batch(np.array(perf_ioi))
+    assert batch.tolist() == pytest.approx(sequential)
+    assert interpolators[1].user_bpm_history == pytest.approx(interpolators[0].user_bpm_history)
+    assert interpolators[1].is_end() == interpolators[0].is_end()
+
+
+def test_kalman_tracks_tempo():
+    score_ioi = [IOI_PLACEHOLDER] + [120, 240, 120, 120] * 10
+    kalman = KalmanSpeedInterpolator()
+    kalman.load_score(score_ioi)
+    ratios = [kalman.interpolate(IOI_PLACEHOLDER)] + [kalman.interpolate(e * 1.5) for e in score_ioi[1:]]
+    assert kalman.is_end()
+    assert ratios[0] == 1.0
+    assert ratios[-1] == pytest.approx(1.5, rel=1e-2)
+
+    # A single late tap (followed by an early one) barely moves the tempo
+    kalman = KalmanSpeedInterpolator()
+    kalman.load_score(score_ioi)
+    perf_ioi = [IOI_PLACEHOLDER] + score_ioi[1:]
+    perf_ioi[20] += 100
+    perf_ioi[21] -= 100
+    ratios = [kalman.interpolate(e) for e in perf_ioi]
+    assert max(abs(e - 1) for e in ratios[20:]) < 0.15
+
+
+def test_kalman_template():
+    score_ioi = [IOI_PLACEHOLDER] + [120] * 20
+    template_ioi = [IOI_PLACEHOLDER] + [120] * 10 + [120 * (1 + 0.1 * i) for i in range(1, 11)]  # ritardando
+    kalman = KalmanSpeedInterpolator()
+    kalman.load_template(score_ioi, template_ioi)
+    ratios = [kalman.interpolate(e) for e in template_ioi]
+    # Predicted speed of each following IOI follows the template's ritardando
+    assert ratios[:-1] == pytest.approx([e / 120 for e in template_ioi[1:]], rel=0.05)
@@ -0,0 +1,27 @@
+import pytest
+from pico.pneno.latency_trace import *
+
+
+def test_latency_summary():
+    now = [0.0]
+    tracer = LatencyTracer(clock=lambda: now[0])
+    for i in range(10):
+        now[0] = i
+        trace = tracer.begin()
+        for j, stage in enumerate(TRACE_STAGES[1:]):
+            now[0] = i + (j + 1) * 0.001
+            tracer.mark(trace, stage)
+        now[0] = i + 0.5
+        tracer.mark_acc_sent(trace, deadline=i + 0.4995)
+    summary = tracer.summary()
+    assert summary['lookup']['p50'] == pytest.approx(1)
+    assert summary['scheduled']['p99'] == pytest.approx(4)
+    assert summary['acc_sent']['count'] == 10
+    assert summary['acc_sent']['p95'] == pytest.approx(0.5)
+
+
+def test_disabled_tracer():
+    tracer = LatencyTracer(enabled=False)
+    trace = tracer.begin()
+    tracer.mark(trace, 'lookup')
+    assert trace is None and tracer.summary()['lookup'] == {'count': 0}
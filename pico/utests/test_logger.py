@@ -0,0 +1,27 @@
+import logging
+
+from pico.logger import logger
+
+
+class Rendered:
+    count = 0
+
+    def __str__(self):
+        Rendered.count += 1
+        return 'rendered'
+
+
+def test_disabled_levels_do_not_render(tmp_path):
+    level = logger.logger.level
+    logger.set_level(logging.INFO)
+    try:
+        logger.debug('not rendered', Rendered())
+        assert Rendered.count == 0
+        log_file = tmp_path / 'pico.log'
+        logger.start_background(log_file=str(log_file))
+        logger.info('written', Rendered())
+        logger.stop_background()
+        assert Rendered.count == 1
+        assert 'written rendered' in log_file.read_text()
+    finally:
+        logger.set_level(level)
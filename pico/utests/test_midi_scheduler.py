@@ -0,0 +1,52 @@
+import time
+
+import pytest
+from pico.pneno.midi_scheduler import *
+
+
+def test_dispatch_order_and_cancel():
+    now = [0.0]
+    scheduler = MidiScheduler(clock=lambda: now[0])
+    sent = []
+    scheduler.enter_at(0.2, sent.append, ('b',))
+    cancelled = scheduler.enter_at(0.1, sent.append, ('x',))
+    scheduler.enter_at(0.1, sent.append, ('a',))
+    scheduler.enter_at(0.2, sent.append, ('c',))
+    assert cancelled.cancel()  # Through scheduler.cancel, under its lock
+    assert scheduler.run_pending(now=0.05) == 0
+    now[0] = 0.3
+    assert scheduler.run_pending() == 3
+    assert sent == ['a', 'b', 'c']
+    assert not cancelled.pending()
+    dispatched = scheduler.enter_at(0.3, sent.append, ('d',))
+    scheduler.run_pending()
+    assert not dispatched.cancel() and sent[-1] == 'd'  # Too late
+    assert scheduler.lateness_summary()['count'] == 4
+
+
+@pytest.mark.parametrize("delays", [
+    [0.02, 0.005, 0.03, 0.01],
+])
+def test_threaded_dispatch(delays: list[float]):
+    scheduler = MidiScheduler()
+    scheduler.start()
+    sent = []
+    for e in delays:
+        scheduler.enter(e, sent.append, (e,))
+    time.sleep(max(delays) + 0.05)
+    scheduler.stop()
+    assert sent == sorted(delays)
+    assert scheduler.lateness_summary()['max'] < 5  # ms
+
+
+def test_cancel_and_reschedule():
+    scheduler = MidiScheduler(clock=lambda: 0.0)
+    sent = []
+    first = scheduler.enter_at(0.1, sent.append, ('a',))
+    second = scheduler.enter_at(0.2, sent.append, ('b',))
+    moved = scheduler.reschedule(second, 0.05, ('b2',))
+    assert moved is not None and not second.pending()
+    assert scheduler.run_pending(now=0.1) == 2
+    assert sent == ['b2', 'a']
+    assert not scheduler.cancel(first)  # Already dispatched
+    assert scheduler.reschedule(first, 0.3) is None
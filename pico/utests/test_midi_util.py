@@ -0,0 +1,97 @@
+import importlib.util
+import threading
+
+import numpy as np
+import pytest
+
+from pico.util.midi_util import *
+
+
+def test_pitch_name_tables():
+    assert midi_to_pitch_name(60) == 'C4' and midi_to_pitch_name(61) == 'C#4'
+    assert midi_to_pitch_name(61, all_sharp=False) == 'Db4' and midi_to_pitch_name(0) == 'C-1'
+    for midi in range(128):
+        assert pitch_name_to_midi(midi_to_pitch_name(midi)) == midi
+        assert pitch_name_to_midi(midi_to_pitch_name(midi, all_sharp=False)) == midi
+    assert pitch_name_to_midi('Fx5') == pitch_name_to_midi('F##5') == pitch_name_to_midi('G5') == 79
+    assert pitch_name_to_midi('Ebb1') == pitch_name_to_midi('d1') == 26
+    assert pitch_name_to_midi('Cb4') == 59 and pitch_name_to_midi('C10') == 132
+    for name in ['', 'R', 'H4', 'C', 'C#', 'Cy4']:
+        with pytest.raises(ValueError):
+            pitch_name_to_midi(name)
+
+
+def test_vectorized_pitch_names():
+    names = ['C4', 'F#3', 'C4', 'Bb2', 'R']
+    assert pitch_names_to_midi(names, invalid=-1).tolist() == [60, 54, 60, 46, -1]
+    with pytest.raises(ValueError):
+        pitch_names_to_midi(names)
+    assert pitch_names_to_midi([]).shape == (0,)
+    assert midi_to_pitch_names(np.array([60, 61, 70]), all_sharp=False).tolist() == ['C4', 'Db4', 'Bb4']
+    with pytest.raises(ValueError):
+        midi_to_pitch_names([128])
+
+
+def test_save_note_tracks(tmp_path):
+    pitch, velocity, onset, offset, channel = [60, 64, 60, 67], [80, 70, 90, 0], [0, 0, 480, 200], \
+        [480, 240, 100_000, 480], [0, 0, 0, 1]
+    path = str(tmp_path / 'direct.mid')
+    save_note_tracks(path, [note_track_events(pitch, velocity, onset, offset, channel),
+                            note_track_events([], [], [], [], 0)])
+
+    messages = []
+    for e in zip(pitch, velocity, onset, offset, channel):
+        messages.extend(note_to_midi(*e))
+    messages.sort(key=lambda e: (e.time, e.note))
+    convert_abs_to_delta_time(messages)
+    midi = mido.MidiFile()
+    midi.tracks.append(mido.MidiTrack(messages))
+    midi.tracks.append(mido.MidiTrack())
+    midi.save(str(tmp_path / 'mido.mid'))
+    with open(path, 'rb') as f, open(str(tmp_path / 'mido.mid'), 'rb') as g:
+        assert f.read() == g.read()
+    assert [m for m in mido.MidiFile(path).tracks[0] if not m.is_meta] == messages
+    with pytest.raises(ValueError):
+        note_track_events([128], [64], [0], [1], 0)
+
+
+def test_raw_output_sender():
+    class FakeMidiOut:
+        def __init__(self):
+            self.sent = []
+
+        def send_message(self, data):
+            self.sent.append(data)
+
+    class FakeRtmidiOutput(mido.ports.BaseOutput):
+        def __init__(self):
+            self._rt = FakeMidiOut()
+            self._send_lock = threading.RLock()
+            super().__init__('fake')
+
+    port = FakeRtmidiOutput()
+    send = raw_output_sender(port)
+    send(0x91, 60, 80)
+    assert port._rt.sent == [[0x91, 60, 80]]
+    port.close()
+    with pytest.raises(ValueError):
+        send(0x81, 60, 0)
+    assert raw_output_sender(mido.ports.BaseOutput()) is None
+
+
+def test_rtmidi_backend_attributes():
+    """raw_output_sender uses private attributes of mido's rtmidi Output: fail on a mido release renaming them"""
+    with open(importlib.util.find_spec('mido.backends.rtmidi').origin) as f:  # Importing it needs rtmidi
+        source = f.read()
+    assert 'self._rt = rtmidi.MidiOut(' in source and 'self._send_lock = ' in source
+    assert 'with self._send_lock:\n            self._rt.send_message(' in source
+
+    pytest.importorskip('rtmidi', exc_type=ImportError)  # Also when its MIDI library is missing
+    try:
+        port = mido.Backend('mido.backends.rtmidi').open_output('pico-test', virtual=True)
+    except Exception as e:  # No MIDI API on this machine
+        pytest.skip(f'No rtmidi output: {e}')
+    with port:
+        send = raw_output_sender(port)
+        assert send is not None
+        send(0x90, 60, 0)
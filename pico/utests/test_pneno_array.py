@@ -0,0 +1,36 @@
+import os
+
+import pytest
+from pico.pneno.pneno_array import *
+from pico.pneno.pneno_seq import create_pneno_seq_from_midi_file
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'example_scores')
+
+
+def _msg_tuples(midi_seq):
+    return [(m.type, m.note, m.velocity, m.channel, m.time) for m in midi_seq]
+
+
+@pytest.mark.parametrize("midi_name", ['sutekidane.mid', 'schubert_gb.mid'])
+def test_pneno_array_matches_pneno_seq(midi_name):
+    pno_seq = create_pneno_seq_from_midi_file(os.path.join(EXAMPLE_DIR, midi_name))
+    array = PnenoArray.from_pneno_seq(pno_seq)
+    assert len(array) == len(pno_seq.seq)
+    assert array.to_onset_list() == pno_seq.to_onset_list()
+    assert array.to_ioi_list() == pno_seq.to_ioi_list()
+    assert array.flatten()[1].tolist() == pno_seq.flatten()[1]
+    for use_absolute_time in (True, False):
+        assert _msg_tuples(array.to_midi_seq(use_absolute_time)) == \
+               _msg_tuples(pno_seq.to_midi_seq(use_absolute_time))
+
+
+def test_array_pneno_seq_view():
+    pno_seq = create_pneno_seq_from_midi_file(os.path.join(EXAMPLE_DIR, 'schubert_gb.mid'))
+    view = PnenoArray.from_pneno_seq(pno_seq).to_pneno_seq()
+    assert len(view.seq) == len(pno_seq.seq)
+    for a, b in zip(view, pno_seq):
+        assert a.onset == b.onset
+        assert [(p.pitch, p.onset, p.offset) for p in a.sgmt] == [(p.pitch, p.onset, p.offset) for p in b.sgmt]
+    assert view.get_next_sgmt() is view.seq[0]
+    with pytest.raises(TypeError):
+        view.append(pno_seq.seq[0])
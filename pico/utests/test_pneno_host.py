@@ -0,0 +1,64 @@
+import os
+
+from pico.pneno.pneno_host import PnenoHost
+from pico.pneno.simulator import *
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'example_scores')
+
+
+def drain(host, clock, t=None):
+    while True:
+        deadline = host.scheduler.next_deadline()
+        if deadline is None or (t is not None and deadline > t):
+            break
+        clock.set(max(deadline, clock()))
+        host.scheduler.run_pending()
+    if t is not None:
+        clock.set(max(t, clock()))
+
+
+def test_sessions_share_the_scheduler():
+    """Interleaved sessions produce the same output as when simulated alone"""
+    clock = VirtualClock()
+    host = PnenoHost(clock=clock)
+    names = ['sutekidane.mid', 'schubert_gb.mid']
+    seqs = [create_pneno_seq_from_midi_file(os.path.join(EXAMPLE_DIR, e)) for e in names]
+    outputs = []
+    for name, pno_seq in zip(names, seqs):
+        outputs.append(VirtualOutputPort(clock=clock))
+        host.add_session(name, VirtualInputPort(), outputs[-1], pno_seq, pneno_chnl=1)
+    host.start(threaded=False)
+
+    start = clock()
+    taps = sorted((t, i, m) for i, pno_seq in enumerate(seqs)
+                  for t, m in synthetic_taps(pno_seq, tempo_scale=1.0 + i / 10))
+    for t, i, msg in taps:
+        drain(host, clock, start + t)
+        host.feed(names[i], msg)
+    drain(host, clock)
+    host.remove_session(names[0])
+    assert host.scheduler.is_running() and names[0] not in host
+    host.stop()
+
+    for i, name in enumerate(names):
+        pno_seq = create_pneno_seq_from_midi_file(os.path.join(EXAMPLE_DIR, name))
+        expected = SessionSimulator(pno_seq, pneno_chnl=1).run(synthetic_taps(pno_seq, tempo_scale=1.0 + i / 10))
+        assert [m for _, m in outputs[i].sent] == [m for _, m in expected]
+
+
+def test_removed_session_is_silenced():
+    clock = VirtualClock()
+    host = PnenoHost(clock=clock)
+    outputs = [VirtualOutputPort(clock=clock) for _ in range(2)]
+    for i, output in enumerate(outputs):
+        pno_seq = create_pneno_seq_from_midi_file(os.path.join(EXAMPLE_DIR, 'schubert_gb.mid'))  # One cursor each
+        host.add_session(i, VirtualInputPort(), output, pno_seq, pneno_chnl=1)
+    host.start(threaded=False)
+    for i in range(2):
+        host[i].handle_input(mido.Message('note_on', note=60, velocity=80))
+    sent = len(outputs[0].sent)
+    host.remove_session(0)
+    drain(host, clock)
+    assert len(outputs[0].sent) == sent  # Only the key was played
+    assert len(outputs[1].sent) > sent
+    host.stop()
@@ -1,6 +1,12 @@
+import copy
+import os
+import random
+
 import pytest
 from pico.pneno.pneno_seq import *
 
+EXAMPLE_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'example_scores')
+
 
 @pytest.mark.parametrize("midi_list, num_notes", [
     ([mido.Message(type="note_on", note=60, velocity=60, time=1, channel=1),
@@ -12,3 +18,89 @@ from pico.pneno.pneno_seq import *
 def test_extract_pneno_notes(midi_list: [mido.Message], num_notes):
     notes, tempo_chgs = extract_pneno_notes_from_track(midi_list)
     assert len(notes) == num_notes
+
+
+@pytest.mark.parametrize("midi_name", ['sutekidane.mid', 'schubert_gb.mid'])
+def test_compile_playback(midi_name):
+    pno_seq = create_pneno_seq_from_midi_file(os.path.join(EXAMPLE_DIR, midi_name))
+    pno_seq.compile_playback()
+    for sgmt in pno_seq:
+        midi_seq = sgmt.to_midi_seq(use_absolute_time=True, include_key=False, start_from_zero=True)
+        expressed = ExpressedSegment(table=sgmt.playback_table, speed_scale=1.5, velocity=None)
+        assert len(midi_seq) == len(sgmt.playback_table)
+        for m, (t, status, note, velocity) in zip(midi_seq, expressed.events()):
+            assert t == pytest.approx(pno_seq.ticks_to_seconds(m.time * 1.5))
+            assert (status, note, velocity) == (m.bytes()[0] & 0xF0, m.note, m.velocity)
+
+
+def loop_create_pneno_seq(melody_track, acc_track, ticks_per_beat, bpm):
+    """The segmentation loop create_pneno_seq replaced, kept as a reference"""
+    melody_track.sort(key=lambda e: e.onset)
+    acc_track.sort(key=lambda e: e.onset)
+    melody_onsets = [note.onset for note in melody_track]
+    acc_sequences = []
+    current_acc_sequence = []
+    onset_index = 1
+    for i, note in enumerate(acc_track):
+        if onset_index == len(melody_onsets):
+            current_acc_sequence.append(note)
+            acc_sequences.append(current_acc_sequence)
+            break
+        elif onset_index < len(melody_onsets) and note.onset < melody_onsets[onset_index]:
+            current_acc_sequence.append(note)
+        else:
+            acc_sequences.append(current_acc_sequence)
+            current_acc_sequence = [note]
+            onset_index += 1
+            if onset_index > len(melody_onsets):
+                break
+    assert len(melody_track) == len(acc_sequences)
+    seq = PnenoSeq(ticks_per_beat=ticks_per_beat, tempo=bpm)
+    for i in range(len(melody_track)):
+        seq.append(PnenoSegment(key=melody_track[i], segment=acc_sequences[i]))
+    return seq
+
+
+def segments(pno_seq):
+    return [(e.onset, (e.key.pitch, e.key.onset, e.key.offset), [(p.pitch, p.onset, p.offset) for p in e.sgmt])
+            for e in pno_seq]
+
+
+def same_as_loop(melody, acc):
+    try:
+        expected = segments(loop_create_pneno_seq(copy.deepcopy(melody), copy.deepcopy(acc), 120, 500_000))
+    except AssertionError:
+        with pytest.raises((AssertionError, ValueError)):
+            create_pneno_seq(melody, acc, 120, 500_000)
+        return
+    assert segments(create_pneno_seq(melody, acc, 120, 500_000)) == expected
+
+
+@pytest.mark.parametrize("midi_name", ['sutekidane.mid', 'schubert_gb.mid'])
+def test_create_pneno_seq_same_as_loop(midi_name):
+    midi = mido.MidiFile(os.path.join(EXAMPLE_DIR, midi_name))
+    track_notes, _ = extract_pneno_pitches_from_midi(midi)
+    same_as_loop(*track_notes[-2:])
+
+
+def test_create_pneno_seq_segmentation():
+    rng = random.Random(0)
+    for _ in range(200):
+        melody = [PnenoPitch(pitch=72, velocity=64, onset=t, offset=t + 120)
+                  for t in sorted(rng.sample(range(0, 2000, 60), rng.randint(1, 8)))]
+        acc = [PnenoPitch(pitch=rng.randint(40, 60), velocity=64, onset=t, offset=t + 60)
+               for t in (rng.randrange(melody[0].onset, 2100, 30) for _ in range(rng.randint(0, 20)))]
+        same_as_loop(melody, acc)
+    with pytest.raises(ValueError):
+        create_pneno_seq([PnenoPitch(pitch=72, velocity=64, onset=10, offset=20)],
+                         [PnenoPitch(pitch=48, velocity=64, onset=0, offset=20)], ticks_per_beat=120, bpm=500_000)
+
+
+def test_create_pneno_seq_by_onset():
+    melody = [PnenoPitch(pitch=72, velocity=64, onset=t, offset=t + 120) for t in (0, 120, 240, 360, 480)]
+    acc = [PnenoPitch(pitch=p, velocity=64, onset=t, offset=t + 60)
+           for p, t in [(50, 60), (48, 0), (52, 120), (48, 120), (55, 500), (53, 480), (60, 600)]]
+    pno_seq = create_pneno_seq(melody, acc, ticks_per_beat=120, bpm=500_000, by_onset=True)
+    assert [e.onset for e in pno_seq] == [0, 120, 240, 360, 480]
+    assert [[(p.pitch, p.onset) for p in e.sgmt] for e in pno_seq] == [
+        [(48, 0), (50, 60)], [(48, 0), (52, 0)], [], [], [(53, 0), (55, 20), (60, 120)]]
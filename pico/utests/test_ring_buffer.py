@@ -0,0 +1,35 @@
+import threading
+
+from pico.pneno.simulator import VirtualClock
+from pico.util.ring_buffer import TimedRingBuffer
+
+
+def test_expiry_and_capacity():
+    clock = VirtualClock()
+    buffer = TimedRingBuffer(capacity=4, window=1.0, clock=clock)
+    for i in range(6):
+        clock.set(i * 0.1)
+        buffer.append(i)
+    assert [e for _, e in buffer.snapshot()] == [2, 3, 4, 5]  # The oldest are overwritten
+    clock.set(1.35)
+    buffer.append(6)  # Expires 2 and 3 (older than 0.35)
+    assert [e for _, e in buffer] == [4, 5, 6]
+    assert [e for _, e in buffer.snapshot(0.9)] == [5, 6]
+
+
+def test_concurrent_append_and_snapshot():
+    buffer = TimedRingBuffer(capacity=100, window=60.0)
+    done = threading.Event()
+
+    def write():
+        for i in range(20000):
+            buffer.append(i)
+        done.set()
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    while not done.is_set():
+        items = [e for _, e in buffer.snapshot()]
+        assert items == list(range(items[0], items[0] + len(items))) if items else True
+    writer.join()
+    assert [e for _, e in buffer.snapshot()] == list(range(19900, 20000))
@@ -0,0 +1,36 @@
+import os
+
+from pico.pneno.pneno_seq import create_pneno_seq_from_midi_file
+from pico.pneno.score_cache import *
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'example_scores')
+
+
+def test_load_pneno_seq_cached(tmp_path):
+    midi_path = os.path.join(EXAMPLE_DIR, 'sutekidane.mid')
+    reference = create_pneno_seq_from_midi_file(midi_path)
+    first = load_pneno_seq(midi_path, cache_dir=str(tmp_path))
+    path = cache_path(midi_path, str(tmp_path))
+    assert os.path.exists(path + '.npy') and os.path.exists(path + '.json')
+
+    cached = load_pneno_seq(midi_path, cache_dir=str(tmp_path))
+    assert isinstance(cached.array.notes, np.memmap)
+    for pno_seq in (first, cached):
+        assert (pno_seq.ticks_per_beat, pno_seq.tempo) == (reference.ticks_per_beat, reference.tempo)
+        assert pno_seq.to_ioi_list() == reference.to_ioi_list()
+        assert [len(e.sgmt) for e in pno_seq] == [len(e.sgmt) for e in reference]
+
+
+def test_precompile_directory(tmp_path):
+    results = precompile_directory(EXAMPLE_DIR, cache_dir=str(tmp_path), workers=2)
+    assert len(results) == len([e for e in os.listdir(EXAMPLE_DIR) if e.endswith('.mid')])
+    for midi_path, path, error in results:
+        assert error is None
+        assert len(load_compiled_score(path)) == len(create_pneno_seq_from_midi_file(midi_path).seq)
+
+
+def test_cache_key_follows_segmentation(monkeypatch):
+    midi_path = os.path.join(EXAMPLE_DIR, 'sutekidane.mid')
+    key = midi_file_hash(midi_path)
+    monkeypatch.setattr('pico.pneno.score_cache.SEGMENTATION_VERSION', SEGMENTATION_VERSION + 1)
+    assert midi_file_hash(midi_path) != key
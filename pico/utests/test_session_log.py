@@ -0,0 +1,67 @@
+import os
+import pickle
+
+import pytest
+from pico.pneno.session_log import *
+from pico.pneno.simulator import SessionSimulator, synthetic_taps
+from pico.pneno.pneno_seq import create_pneno_seq_from_midi_file
+from pico.util.midi_util import perf_file_to_midi
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'example_scores')
+
+
+def record_session(tmp_path):
+    pno_seq = create_pneno_seq_from_midi_file(os.path.join(EXAMPLE_DIR, 'schubert_gb.mid'))
+    sim = SessionSimulator(pno_seq, session_save_path=str(tmp_path))
+    sim.run(synthetic_taps(pno_seq, tempo_scale=1.2, seed=0))
+    return pno_seq, os.path.join(tmp_path, 'perf_data.pnlog')
+
+
+def test_session_log_roundtrip(tmp_path):
+    pno_seq, log_path = record_session(tmp_path)
+    data = load_performance_data(log_path)
+    assert data['ticks_per_beat'] == pno_seq.ticks_per_beat and 'latency' in data
+    performance = data['performance']
+    note_ons = [e for e in performance if e[1].type == 'note_on' and e[1].velocity > 0]
+    assert len(note_ons) == len(pno_seq.seq)
+    for e, sgmt in zip(note_ons, pno_seq.seq):
+        assert e[2].onset == sgmt.onset and e[2].key.pitch == sgmt.key.pitch
+        assert len(e[3]) == 2 * len(sgmt.sgmt)
+    assert perf_file_to_midi(log_path) is not None
+
+
+def test_sysex_input_is_skipped(tmp_path):
+    pno_seq = create_pneno_seq_from_midi_file(os.path.join(EXAMPLE_DIR, 'schubert_gb.mid'))
+    taps = synthetic_taps(pno_seq, seed=0)
+    taps.insert(2, (taps[1][0], mido.Message('sysex', data=[0x7E, 0x7F, 0x09, 0x01])))
+    SessionSimulator(pno_seq, session_save_path=str(tmp_path)).run(taps)
+    performance = load_performance_data(os.path.join(tmp_path, 'perf_data.pnlog'))['performance']
+    assert len(performance) == len(taps) - 1 and all(e[1].type != 'sysex' for e in performance)
+    note_ons = [e for e in performance if e[1].type == 'note_on' and e[1].velocity > 0]
+    assert [len(e[3]) for e in note_ons] == [2 * len(e.sgmt) for e in pno_seq.seq]
+
+
+def test_truncated_log(tmp_path):
+    _, log_path = record_session(tmp_path)
+    with open(log_path, 'rb') as f:
+        content = f.read()
+    truncated = os.path.join(tmp_path, 'crashed.pnlog')
+    with open(truncated, 'wb') as f:
+        f.write(content[:-10])
+    assert len(read_session_log(truncated)['inputs']) == len(read_session_log(log_path)['inputs'])
+
+
+def test_convert_perf_pickle(tmp_path):
+    _, log_path = record_session(tmp_path)
+    data = load_performance_data(log_path)
+    pkl_path = os.path.join(tmp_path, 'legacy.pkl')
+    with open(pkl_path, 'wb') as f:
+        pickle.dump(data, f)
+    converted = load_performance_data(convert_perf_pickle(pkl_path))
+    assert len(converted['performance']) == len(data['performance'])
+    for a, b in zip(converted['performance'], data['performance']):
+        assert a[0] == b[0] and a[1] == b[1]
+        assert (a[3] is None) == (b[3] is None)
+        if a[3] is not None:
+            assert [m.bytes() for m in a[3]] == [m.bytes() for m in b[3]]
+            assert [m.time for m in a[3]] == pytest.approx([m.time for m in b[3]])
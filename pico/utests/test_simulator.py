@@ -0,0 +1,75 @@
+import os
+
+import pytest
+from pico.pneno.pneno_system import OVERLAP_POLICIES
+from pico.pneno.simulator import *
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'example_scores')
+
+
+@pytest.mark.parametrize("midi_name, tempo_scale", [
+    ('sutekidane.mid', 1.0),
+    ('schubert_gb.mid', 1.0),
+])
+def test_simulated_session_matches_score(midi_name, tempo_scale):
+    """With a constant speed interpolator, the accompaniment must land exactly on the score timing"""
+    pno_seq = create_pneno_seq_from_midi_file(os.path.join(EXAMPLE_DIR, midi_name))
+    taps = synthetic_taps(pno_seq, tempo_scale=tempo_scale)
+    events = SessionSimulator(pno_seq, pneno_chnl=1).run(taps)
+
+    key_onsets = [t for t, m in events if m.type == 'note_on' and m.velocity > 0 and m.channel == 1]
+    acc_onsets = [t for t, m in events if m.type == 'note_on' and m.velocity > 0 and m.channel == 0]
+    assert len(key_onsets) == len(pno_seq.seq)
+
+    expected = []
+    first_onset = pno_seq[0].onset
+    for sgmt in pno_seq:
+        expected.extend(pno_seq.ticks_to_seconds(sgmt.onset + p.onset - first_onset) * tempo_scale for p in sgmt.sgmt)
+    assert sorted(acc_onsets) == pytest.approx(sorted(expected))
+
+
+@pytest.mark.parametrize("overlap_policy", OVERLAP_POLICIES)
+def test_overlap_policy_keeps_notes_paired(overlap_policy):
+    """Taps twice as fast as the (constant) prediction: every segment overlaps the next one"""
+    pno_seq = create_pneno_seq_from_midi_file(os.path.join(EXAMPLE_DIR, 'schubert_gb.mid'))
+    taps = synthetic_taps(pno_seq, tempo_scale=0.5)
+    events = SessionSimulator(pno_seq, pneno_chnl=1, overlap_policy=overlap_policy).run(taps)
+
+    sounding = {}
+    note_ons = 0
+    for t, m in events:
+        if m.channel != 0:
+            continue
+        if m.type == 'note_on' and m.velocity > 0:
+            sounding[m.note] = sounding.get(m.note, 0) + 1
+            note_ons += 1
+        else:
+            assert sounding.get(m.note, 0) > 0, "note-off without a note-on"
+            sounding[m.note] -= 1
+    assert not any(sounding.values()), "hanging note"
+    n_acc = sum(len(e.sgmt) for e in pno_seq)
+    assert note_ons < n_acc if overlap_policy == 'drop' else note_ons == n_acc
+
+
+def test_only_keypresses_are_traced():
+    pno_seq = create_pneno_seq_from_midi_file(os.path.join(EXAMPLE_DIR, 'schubert_gb.mid'))
+    taps = synthetic_taps(pno_seq)
+    simulator = SessionSimulator(pno_seq, pneno_chnl=1)
+    simulator.run(taps)
+    n_keys = sum(m.type == 'note_on' and m.velocity > 0 for _, m in taps)
+    assert n_keys < len(taps) and simulator.system.tracer.summary()['lookup']['count'] == n_keys
+
+
+def test_blocking_input_is_traced_from_receipt():
+    clock = VirtualClock(1.0)
+    pno = PnenoSystem(VirtualInputPort(), VirtualOutputPort(clock=clock), pneno_chnl=1, input_mode='blocking',
+                      clock=clock)
+    pno.load_score(create_pneno_seq_from_midi_file(os.path.join(EXAMPLE_DIR, 'schubert_gb.mid')))
+    pno.start_realtime_capture()
+    pno.input_port.callback(mido.Message('note_on', note=60, velocity=80))
+    clock.set(2.0)  # Later than the receipt, whenever the listening thread gets the message
+    deadline = time.perf_counter() + 10
+    while not pno.tracer.traces and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    pno.stop()
+    assert pno.tracer.traces[0].input == 1.0
@@ -0,0 +1,174 @@
+"""
+IOI-ratio dataset of a corpus of aligned recordings
+
+An item of the corpus is a performance aligned to its score (AlignmentTool output), in one directory:
+    <score>_fmt3x.txt, <score>.mid     the score, with melody and accompaniment tracks (see create_pneno_seq_from_midi)
+    <perf>_match.txt, <perf>.mid       the performance
+Every `*_match.txt` under the corpus directory is an item. Its score is the fmt3x file named in the match header
+(`// fmt3x: ...`) if that file is in the directory, otherwise the only `*_fmt3x.txt` of the directory.
+
+Items are processed in parallel by MIDIAlignmentParser and saved as one columnar .npz file, one array per column:
+ - key_*: one row per segment key
+ - sgmt_*: one row per accompaniment note. sgmt_key is the row of its key
+ - key_item and sgmt_item index `items` (item names). Items that failed are skipped: `failed` lists their names
+   and `failed_errors` the error of each.
+Score onsets are in beats, performed onsets in seconds.
+
+    python -m pico.util.alignment_corpus path/to/corpus --output ioi_dataset.npz --workers 4
+"""
+import argparse
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+
+from pico.util.alignment_parser import MIDIAlignmentParser
+
+KEY_COLUMNS = {'key_item': np.int32, 'key_index': np.int32, 'key_pitch': np.int16, 'key_velocity': np.int16,
+               'key_score_onset': np.float64, 'key_perf_onset': np.float64, 'key_ioi_ratio': np.float64}
+SGMT_COLUMNS = {'sgmt_item': np.int32, 'sgmt_key': np.int64, 'sgmt_pitch': np.int16, 'sgmt_velocity': np.int16,
+                'sgmt_score_onset': np.float64, 'sgmt_perf_onset': np.float64, 'sgmt_ioi_ratio': np.float64}
+COLUMNS = {**KEY_COLUMNS, **SGMT_COLUMNS}
+MATCH_SUFFIX = '_match.txt'
+FMT3X_SUFFIX = '_fmt3x.txt'
+
+
+@dataclass
+class AlignmentItem:
+    name: str  # Path of the performance relative to the corpus directory, without suffix
+    fmt3x: str
+    match: str
+    score_midi: str
+    perf_midi: str
+
+
+def _header_fmt3x(match_path):
+    """
+    :return: file name of the `// fmt3x:` header line of a match file, None if there is none
+    """
+    with open(match_path) as f:
+        for line in f:
+            if not line.startswith('//'):
+                break
+            if line.startswith('// fmt3x:'):
+                return os.path.basename(line.split(': ')[-1].strip())
+    return None
+
+
+def find_alignment_items(corpus_dir) -> list[AlignmentItem]:
+    """
+    :return: one item per match file, sorted by name. Paths that could not be resolved are empty strings
+    """
+    items = []
+    for match_path in sorted(glob.glob(os.path.join(corpus_dir, '**', '*' + MATCH_SUFFIX), recursive=True)):
+        directory = os.path.dirname(match_path)
+        stem = match_path[:-len(MATCH_SUFFIX)]
+        fmt3x = _header_fmt3x(match_path)
+        fmt3x = os.path.join(directory, fmt3x) if fmt3x else ''
+        if not os.path.exists(fmt3x):
+            candidates = glob.glob(os.path.join(directory, '*' + FMT3X_SUFFIX))
+            fmt3x = candidates[0] if len(candidates) == 1 else ''
+        items.append(AlignmentItem(name=os.path.relpath(stem, corpus_dir), fmt3x=fmt3x, match=match_path,
+                                   score_midi=fmt3x[:-len(FMT3X_SUFFIX)] + '.mid' if fmt3x else '',
+                                   perf_midi=stem + '.mid'))
+    return items
+
+
+def item_ioi_ratios(item: AlignmentItem):
+    """
+    :return: the key and segment columns of one item, with key_item and sgmt_item left out
+    """
+    for path in (item.fmt3x, item.match, item.score_midi, item.perf_midi):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Missing file of {item.name}: {path or 'no fmt3x file found'}")
+    parser = MIDIAlignmentParser(item.fmt3x, item.match, item.score_midi, item.perf_midi)
+    key_ratio, sgmt_ratio, _ = parser.performed_pno_ioi_ratio_arrays()
+    segments = parser.pneno_seq.seq
+    beats = 1 / parser.pneno_seq.ticks_per_beat
+    sgmt_notes = [note for e in segments for note in e.sgmt]
+    sgmt_keys = np.repeat(np.arange(len(segments)), [len(e.sgmt) for e in segments])
+    key_onsets = np.array([e.onset for e in segments], dtype=np.float64)
+    # Performed velocities and onsets of keys and segment notes, in one lookup
+    _, velocity, _, perf_onset, _ = parser.match_info.note_columns(
+        [e.key.id for e in segments] + [e.id for e in sgmt_notes], by_score_id=True)
+    n_keys = len(segments)
+    columns = {
+        'key_index': np.arange(n_keys),
+        'key_pitch': [e.key.pitch for e in segments],
+        'key_velocity': velocity[:n_keys],
+        'key_score_onset': key_onsets * beats,
+        'key_perf_onset': perf_onset[:n_keys],
+        'key_ioi_ratio': key_ratio,
+        'sgmt_key': sgmt_keys,
+        'sgmt_pitch': [e.pitch for e in sgmt_notes],
+        'sgmt_velocity': velocity[n_keys:],
+        'sgmt_score_onset': (key_onsets[sgmt_keys] + np.array([e.onset for e in sgmt_notes], dtype=np.float64)) * beats,
+        'sgmt_perf_onset': perf_onset[n_keys:],
+        'sgmt_ioi_ratio': sgmt_ratio,
+    }
+    return {k: np.asarray(v, dtype=COLUMNS[k]) for k, v in columns.items()}
+
+
+def _item_worker(item: AlignmentItem):
+    try:
+        return item_ioi_ratios(item), None
+    except Exception as e:
+        return None, repr(e)
+
+
+def concatenate_items(names, item_columns):
+    """
+    :param names:   item names
+    :param item_columns:    columns of every item (see item_ioi_ratios)
+    :return: the dataset columns, with items, key_item and sgmt_item
+    """
+    key_rows = np.array([len(e['key_index']) for e in item_columns], dtype=np.int64)
+    sgmt_rows = np.array([len(e['sgmt_key']) for e in item_columns], dtype=np.int64)
+    key_offsets = np.cumsum(key_rows) - key_rows
+    dataset = {'items': np.array(names, dtype=str),
+               'key_item': np.repeat(np.arange(len(names), dtype=np.int32), key_rows),
+               'sgmt_item': np.repeat(np.arange(len(names), dtype=np.int32), sgmt_rows)}
+    for k, dtype in COLUMNS.items():
+        if k not in dataset:
+            dataset[k] = np.concatenate([e[k] for e in item_columns]) if item_columns else np.zeros(0, dtype=dtype)
+    # Segment rows point to the key rows of the whole dataset
+    dataset['sgmt_key'] += np.repeat(key_offsets, sgmt_rows)
+    return dataset
+
+
+def build_ioi_dataset(corpus_dir, output, workers=None):
+    """
+    Process every item of the corpus in parallel and save the dataset to `output` (.npz)
+    :return: list of (item name, error or None)
+    """
+    items = find_alignment_items(corpus_dir)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(_item_worker, items))
+    names = [item.name for item, (columns, _) in zip(items, results) if columns is not None]
+    dataset = concatenate_items(names, [columns for columns, _ in results if columns is not None])
+    failed = [(item.name, error) for item, (_, error) in zip(items, results) if error is not None]
+    dataset['failed'] = np.array([name for name, _ in failed], dtype=str)
+    dataset['failed_errors'] = np.array([error for _, error in failed], dtype=str)
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    np.savez(output, **dataset)
+    return [(item.name, error) for item, (_, error) in zip(items, results)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='IOI-ratio dataset of a corpus of aligned recordings')
+    parser.add_argument('corpus_dir', type=str, help="Directory searched recursively for *_match.txt files")
+    parser.add_argument('--output', type=str, default='ioi_dataset.npz')
+    parser.add_argument('--workers', type=int, default=None, help="Number of processes (CPU count by default)")
+    args = parser.parse_args()
+
+    results = build_ioi_dataset(args.corpus_dir, args.output, workers=args.workers)
+    for name, error in results:
+        if error is not None:
+            print(name, f'FAILED: {error}')
+    print(f"{sum(e[1] is None for e in results)}/{len(results)} items saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
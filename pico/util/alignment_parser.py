@@ -3,21 +3,26 @@
 @brief: Parser for hmm and match txt files, generated from Nakamura et. al.'s symbolic music alignment tool
 
 Purpose: obtain alignment data to model tempo/ioi
+
+Files are read into columnar tables (parse_fmt3x -> ScoreTable, parse_match -> MatchTable, by chunks): numeric fields
+are NumPy columns, repeated strings (pitch, types, status) are stored once as labels and chords are row ranges.
+ScoreParser/MatchParser keep their dict-of-dataclass API as lazy views on these tables.
 """
+import functools
+import itertools
+import operator
+from collections.abc import Mapping
 from dataclasses import dataclass, asdict
 
-import matplotlib.pyplot as plt
-import matplotlib.cm as cm
 import mido
-from jams.eval import tempo
-from sympy.physics.units import velocity
+import numpy as np
 
 from pico.pneno.interpolator import IOI_PLACEHOLDER
 from pico.pneno.pneno_seq import extract_pneno_pitches_from_midi, create_pneno_seq_from_midi_file, PnenoSeq, \
-    create_pneno_seq_from_midi, PnenoPitch, convert_abs_to_delta_time, convert_onsets_to_ioi
+    create_pneno_seq_from_midi, PnenoPitch
 from pico.logger import logger
-from pico.util.midi_util import pitch_name_to_midi, ticks_to_seconds, seconds_to_ticks, midi_to_pitch_name, \
-    midi_list_to_midi, note_to_midi
+from pico.util.midi_util import pitch_name_to_midi, pitch_names_to_midi, ticks_to_seconds, midi_to_pitch_name, \
+    midi_list_to_midi, seconds_to_ticks_array, note_track_events, save_note_tracks
 
 
 @dataclass
@@ -36,64 +41,192 @@ class ScoreNote:
     chord: list[str]
 
 
+SCORE_NOTE_DTYPE = np.dtype([('score_time', '<f8'), ('bar', '<i4'), ('staff', '<i4'), ('voice', '<i4'),
+                             ('sub_voice', '<i4'), ('order', '<i4'), ('event_type', '<i4'), ('duration', '<f8'),
+                             ('pitch', '<i4'), ('note_type', '<i4'), ('chord', '<i4')])
+MATCH_NOTE_DTYPE = np.dtype([('onset_time', '<f8'), ('offset_time', '<f8'), ('pitch', '<i4'), ('onset_velocity', '<i2'),
+                             ('offset_velocity', '<i2'), ('channel', '<i2'), ('match_status', '<i4'),
+                             ('score_time', '<f8'), ('error_index', '<i4'), ('skip_index', '<i4')])
+
+
+def _header_value(line):
+    """'//TPQN: 480' -> '480'"""
+    return line.split(':', 1)[-1].strip() if ':' in line else line.split()[-1]
+
+
+def _encode_labels(columns):
+    """
+    :param columns: sequences of strings
+    :return: (labels, list of int32 code arrays, one per column). Codes of all columns index the same labels.
+    """
+    labels = list(dict.fromkeys(itertools.chain.from_iterable(columns)))
+    index = dict(zip(labels, range(len(labels))))
+    return labels, [np.fromiter(map(index.__getitem__, e), dtype=np.int32, count=len(e)) for e in columns]
+
+
+class _LazyNotes(Mapping):
+    """Read-only {note ID: dataclass} view on a table, notes are created on first access"""
+
+    def __init__(self, get_index, factory):
+        """
+        :param get_index:   returns the {note ID: row} dict, called on first use
+        :param factory: row -> dataclass
+        """
+        self.get_index = get_index
+        self.factory = factory
+        self._cache = {}
+
+    @functools.cached_property
+    def index(self):
+        return self.get_index()
+
+    def __getitem__(self, key):
+        note = self._cache.get(key)
+        if note is None:
+            note = self._cache[key] = self.factory(self.index[key])
+        return note
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+
+class _ChordList:
+    """Read-only list of chords (lists of note IDs)"""
+
+    def __init__(self, table: 'ScoreTable'):
+        self.table = table
+
+    def __len__(self):
+        return len(self.table.chord_offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self.table.chord_ids(index + len(self) if index < 0 else index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class ScoreTable:
+    def __init__(self, notes: np.ndarray, ids: list[str], chord_offsets: np.ndarray, labels: list[str], tpqn=0,
+                 version=''):
+        """
+        :param notes:   SCORE_NOTE_DTYPE array, in file order
+        :param ids: note ID of every row
+        :param chord_offsets:   rows of chord c (one line of the file) are chord_offsets[c]:chord_offsets[c + 1]
+        :param labels:  strings of the event_type, pitch and note_type codes
+        :param tpqn:
+        :param version:
+        """
+        self.notes = notes
+        self.ids = ids
+        self.chord_offsets = chord_offsets
+        self.labels = labels
+        self.tpqn = tpqn
+        self.version = version
+        self._chords = {}
+
+    def __len__(self):
+        return len(self.notes)
+
+    @functools.cached_property
+    def index(self):
+        """{note ID: row}, the last row wins for duplicated IDs"""
+        return dict(zip(self.ids, range(len(self.ids))))
+
+    def midi_pitches(self):
+        """
+        :return: MIDI pitch of every row, -1 for labels that are not pitch names
+        """
+        return pitch_names_to_midi(self.labels, invalid=-1)[self.notes['pitch']]
+
+    def chord_ids(self, chord):
+        """Note IDs of a chord, one list shared by all of its notes"""
+        ids = self._chords.get(chord)
+        if ids is None:
+            ids = self._chords[chord] = self.ids[self.chord_offsets[chord]:self.chord_offsets[chord + 1]]
+        return ids
+
+    def to_score_note(self, row):
+        score_time, bar, staff, voice, sub_voice, order, event_type, duration, pitch, note_type, chord = \
+            self.notes[row].item()
+        return ScoreNote(id=self.ids[row], score_time=score_time, bar=bar, staff=staff, voice=voice,
+                         sub_voice=sub_voice, order=order, event_type=self.labels[event_type], duration=duration,
+                         pitch=self.labels[pitch], note_type=self.labels[note_type], chord=self.chord_ids(chord))
+
+
+def parse_fmt3x(filepath) -> ScoreTable:
+    tpqn, version, rows = 0, '', []
+    with open(filepath, "r") as file:
+        for line in file.read().splitlines():
+            if 'TPQN' in line:
+                tpqn = int(_header_value(line))
+            elif 'Fmt3xVersion' in line:
+                version = _header_value(line)
+            elif '//' in line:
+                logger.info(line)
+            elif line.strip():
+                rows.append(line.strip().split("\t"))
+
+    # Line (chord) attributes, then the pitches, note types and note IDs of its num_notes notes
+    counts = np.array([int(e[8]) for e in rows], dtype=np.int64)
+    n_notes = counts.tolist()
+    columns = list(zip(*[e[:8] for e in rows])) if rows else [()] * 8
+    pitches = list(itertools.chain.from_iterable(e[9:9 + n] for e, n in zip(rows, n_notes)))
+    note_types = list(itertools.chain.from_iterable(e[9 + n:9 + 2 * n] for e, n in zip(rows, n_notes)))
+    ids = [x for e, n in zip(rows, n_notes) for x in e[9 + 2 * n:9 + 3 * n]]
+    labels, (event_types, pitch_codes, note_type_codes) = _encode_labels([columns[6], pitches, note_types])
+
+    notes = np.zeros(int(counts.sum()), dtype=SCORE_NOTE_DTYPE)
+    for k, name in enumerate(('score_time', 'bar', 'staff', 'voice', 'sub_voice', 'order')):
+        notes[name] = np.repeat(np.array(columns[k], dtype=notes.dtype[name]), counts)
+    notes['duration'] = np.repeat(np.array(columns[7], dtype=np.float64), counts)
+    notes['event_type'] = np.repeat(event_types, counts)
+    notes['pitch'] = pitch_codes
+    notes['note_type'] = note_type_codes
+    notes['chord'] = np.repeat(np.arange(len(rows), dtype=np.int32), counts)
+    chord_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(counts, out=chord_offsets[1:])
+    return ScoreTable(notes, ids, chord_offsets, labels, tpqn=tpqn, version=version)
+
+
 class ScoreParser:
     def __init__(self):
-        self.notes = dict[str, ScoreNote]()  # (note_id, ScoreNote)
+        self.notes = dict[str, ScoreNote]()  # (note_id, ScoreNote), a lazy view on self.table once parsed
         self.tqpn = 0
         self.version = ''
-        self.sorted_notes = []
-
-    def _parse_line(self, line):
-        parts = line.strip().split("\t")
-        line = line.replace('\n', '')
-        if 'TPQN' in line:
-            self.tqpn = int(line.strip(': ')[-1])
-            return
-        elif 'Fmt3xVersion' in line:
-            self.version = line.strip(': ')[-1]
-            return
-        elif '//' in line:
-            print("\x1B[34m[Info]\033[0m ", line)
-            return
-
-        # Parse the basic attributes
-        score_time = float(parts[0])  # Score beat
-        bar = int(parts[1])  # Bar number
-        staff = int(parts[2])  # Staff number
-        voice = int(parts[3])  # Voice number
-        sub_voice = int(parts[4])  # Sub-voice number
-        order = int(parts[5])  # Order
-        event_type = parts[6]  # Event type
-        duration = float(parts[7])  # Duration
-        num_notes = int(parts[8])  # Number of notes in the chord
-
-        # Parse the pitches, note types, and note IDs
-        pitches = parts[9:9 + num_notes]
-        note_types = parts[9 + num_notes:9 + 2 * num_notes]
-        note_ids = parts[9 + 2 * num_notes:9 + 3 * num_notes]
-
-        # Store each note by its note ID for easy access
-        for i in range(num_notes):
-            self.notes[note_ids[i]] = ScoreNote(
-                id=note_ids[i],
-                score_time=score_time,
-                bar=bar,
-                staff=staff,
-                voice=voice,
-                sub_voice=sub_voice,
-                order=order,
-                event_type=event_type,
-                duration=duration,
-                pitch=pitches[i],
-                note_type=note_types[i],
-                chord=note_ids  # Store all note IDs in the chord
-            )
-        self.sorted_notes.append(note_ids)
+        self.sorted_notes = []  # Note IDs of every chord, in file order
+        self.table = None
 
     def parse_file(self, filepath):
-        with open(filepath, "r") as file:
-            for line in file:
-                self._parse_line(line)
+        self.table = parse_fmt3x(filepath)
+        self.tqpn = self.table.tpqn
+        self.version = self.table.version
+        self.notes = _LazyNotes(lambda: self.table.index, self.table.to_score_note)
+        self.sorted_notes = _ChordList(self.table)
+        self.__dict__.pop('pitch_index', None)
+
+    @functools.cached_property
+    def pitch_index(self):
+        """
+        {(onset group, MIDI pitch): note IDs in file order}. Onset groups are the chords of sorted_notes.
+        """
+        index = {}
+        if self.table is None:
+            return index
+        table = self.table
+        pitches = table.midi_pitches().tolist()  # -1 if not a pitch name (e.g. a rest): never matched
+        for key in zip(table.notes['chord'].tolist(), pitches, table.ids):
+            index.setdefault(key[:2], []).append(key[2])
+        return index
 
     def get_note_by_id(self, note_id):
         """Retrieve a note by its ID."""
@@ -139,9 +272,181 @@ class MatchNote:
     skip_index: str
 
 
+class MatchTable:
+    def __init__(self, notes: np.ndarray, ids: list[str], score_note_ids: list[str], labels: list[str],
+                 missing_notes: list[MissingNote] = None, header: dict = None):
+        """
+        :param notes:   MATCH_NOTE_DTYPE array, in file order
+        :param ids: performed note ID of every row
+        :param score_note_ids:  matched score note ID of every row, '*' for extra notes
+        :param labels:  strings of the pitch, match_status and skip_index codes
+        :param missing_notes:
+        :param header:  {'version', 'score', 'perf', 'fmt3x'}
+        """
+        self.notes = notes
+        self.ids = ids
+        self.score_note_ids = score_note_ids
+        self.labels = labels
+        self.missing_notes = missing_notes if missing_notes is not None else []
+        self.header = header if header is not None else {}
+
+    def __len__(self):
+        return len(self.notes)
+
+    @functools.cached_property
+    def index(self):
+        """{note ID: row}"""
+        return dict(zip(self.ids, range(len(self.ids))))
+
+    @functools.cached_property
+    def score_index(self):
+        """{score note ID: row}, the last row wins (as in MatchParser.score_map)"""
+        return dict(zip(self.score_note_ids, range(len(self.score_note_ids))))
+
+    def is_extra(self):
+        """
+        :return: boolean mask of the notes not matched to the score
+        """
+        return np.array([e == '*' for e in self.score_note_ids], dtype=bool)
+
+    def midi_pitches(self):
+        """
+        :return: MIDI pitch of every row
+        """
+        return pitch_names_to_midi(self.labels, invalid=-1)[self.notes['pitch']]
+
+    def to_match_note(self, row):
+        onset_time, offset_time, pitch, onset_velocity, offset_velocity, channel, match_status, score_time, \
+            error_index, skip_index = self.notes[row].item()
+        return MatchNote(id=self.ids[row], onset_time=onset_time, offset_time=offset_time, pitch=self.labels[pitch],
+                         onset_velocity=onset_velocity, offset_velocity=offset_velocity, channel=channel,
+                         match_status=self.labels[match_status], score_time=score_time,
+                         score_note_id=self.score_note_ids[row], error_index=error_index,
+                         skip_index=self.labels[skip_index])
+
+
+MATCH_FIELDS = 12
+_MATCH_NUMERIC = {1: 'onset_time', 2: 'offset_time', 4: 'onset_velocity', 5: 'offset_velocity', 6: 'channel',
+                  8: 'score_time', 10: 'error_index'}
+_MATCH_STRINGS = (0, 3, 7, 9, 11)  # Note ID, pitch, match status, score note ID, skip index
+MATCH_CHUNK_SIZE = 1 << 16
+
+
+def _is_match_row(parts):
+    try:
+        for k, name in _MATCH_NUMERIC.items():
+            MATCH_NOTE_DTYPE[name].type(parts[k])
+    except (ValueError, IndexError):
+        return False
+    return True
+
+
+def _match_lines_columns(data, dropped):
+    """
+    :param data:    note lines of a match file
+    :param dropped: malformed lines are appended to it
+    :return: (numeric columns {name: array}, string columns as lists)
+    """
+    # Fast path: one split over the lines, columns are strided slices. Lines with a missing or extra field change
+    # the field count or shift the columns (failing the numeric conversion): such lines are parsed one by one.
+    fields = '\t'.join(data).split('\t') if data else []
+    columns = [fields[k::MATCH_FIELDS] for k in range(MATCH_FIELDS)] if len(fields) == MATCH_FIELDS * len(data) \
+        else None
+    del fields
+    if columns is not None:
+        try:
+            return _match_numeric(columns), columns
+        except ValueError:
+            pass
+    valid = []
+    for line in data:
+        parts = line.strip().split("\t")
+        if _is_match_row(parts):
+            valid.append(parts)
+        elif line.strip():
+            dropped.append(line)
+    columns = [[e[k] for e in valid] for k in range(MATCH_FIELDS)]
+    return _match_numeric(columns), columns
+
+
+def _match_numeric(columns):
+    """
+    :raise ValueError: if a numeric field is malformed
+    """
+    return {name: np.array(columns[k], dtype=MATCH_NOTE_DTYPE[name]) for k, name in _MATCH_NUMERIC.items()}
+
+
+def parse_match(filepath, chunk_size=MATCH_CHUNK_SIZE) -> MatchTable:
+    """
+    :param filepath:
+    :param chunk_size:  characters read at once. Lines are split into fields one chunk at a time, which bounds the
+        memory used on top of the table.
+    """
+    header, missing_notes, dropped = {}, [], []
+    header_keys = (('//Version', 'version'), ('// Score', 'score'), ('// Perfm', 'perf'), ('// fmt3x:', 'fmt3x'))
+    numeric, strings = [], [[] for _ in _MATCH_STRINGS]
+    rest = ''
+    with open(filepath, "r") as file:
+        while True:
+            block = file.read(chunk_size)
+            text, rest = rest + block, ''
+            if block:  # Keep the last, possibly incomplete, line for the next chunk
+                cut = text.rfind('\n') + 1
+                text, rest = text[:cut], text[cut:]
+            lines = text.splitlines()
+            del text
+            for line in [e for e in lines if '//' in e]:
+                if line.startswith("//Missing"):
+                    # Example: //Missing 330 P1-4-42
+                    parts = line.split()
+                    missing_notes.append(MissingNote(parts[1], parts[2]))
+                    continue
+                key = next((v for k, v in header_keys if line.startswith(k)), None)
+                if key is not None:
+                    header[key] = line.split(': ')[-1]
+                else:
+                    logger.info(line)
+            data = [e for e in lines if e and '//' not in e]
+            del lines
+            arrays, columns = _match_lines_columns(data, dropped)
+            del data
+            numeric.append(arrays)
+            for column, k in zip(strings, _MATCH_STRINGS):
+                column.extend(columns[k])
+            del columns
+            if not block:
+                break
+    if dropped:
+        logger.warn(f"A Match File is expected. Format error: {len(dropped)} lines dropped from {filepath}, "
+                    f"first ones:", dropped[:3])
+    return _match_table({name: np.concatenate([e[name] for e in numeric]) for name in _MATCH_NUMERIC.values()},
+                        strings, missing_notes, header)
+
+
+def match_table(columns, missing_notes=None, header=None) -> MatchTable:
+    """
+    :param columns: the 12 columns of a match file, as lists of strings
+    :raise ValueError: if a numeric field is malformed
+    """
+    return _match_table(_match_numeric(columns), [columns[k] for k in _MATCH_STRINGS], missing_notes, header)
+
+
+def _match_table(numeric, strings, missing_notes=None, header=None) -> MatchTable:
+    """
+    :param numeric: {name: array} of the numeric columns
+    :param strings: the _MATCH_STRINGS columns, as lists of strings
+    """
+    ids, pitches, statuses, score_note_ids, skips = strings
+    notes = np.zeros(len(ids), dtype=MATCH_NOTE_DTYPE)
+    for name, values in numeric.items():
+        notes[name] = values
+    labels, (notes['pitch'], notes['match_status'], notes['skip_index']) = _encode_labels([pitches, statuses, skips])
+    return MatchTable(notes, ids, score_note_ids, labels, missing_notes=missing_notes, header=header)
+
+
 class MatchParser:
     def __init__(self):
-        self.notes = dict[str, MatchNote]()  # (note_id, MatchNote)
+        self.notes = dict[str, MatchNote]()  # (note_id, MatchNote), a lazy view on self.table once parsed
         self.score_map = dict[str, MatchNote]()
         self.ordered_notes = []  # note id
         self.extra_notes = []  # note id
@@ -151,64 +456,21 @@ class MatchParser:
         self.perf = ''
         self.fmt3x = ''
         self.version = ''
-
-    def _parse_line(self, line):
-        # Check if the line starts with //Missing
-        line = line.replace('\n', '')
-        if line.startswith("//Missing"):
-            # Example: //Missing 330 P1-4-42
-            parts = line.split('')
-            miss_note = MissingNote(parts[1], parts[2])
-            self.missing_notes.append(miss_note)
-            return
-        elif line.startswith(('//Version')):
-            self.version = line.split(': ')[-1]
-            return
-        elif line.startswith('// Score'):
-            self.score = line.split(': ')[-1]
-            return
-        elif line.startswith('// Perfm'):
-            self.perf = line.split(': ')[-1]
-            return
-        elif line.startswith('// fmt3x:'):
-            self.fmt3x = line.split(': ')[-1]
-            return
-        elif '//' in line:
-            print("\x1B[34m[Info]\033[0m ", line)
-            return
-        else:
-            # Split regular lines by tab and parse the attributes
-            parts = line.strip().split("\t")
-            try:
-                note = MatchNote(id=parts[0],
-                                 onset_time=float(parts[1]),
-                                 offset_time=float(parts[2]),
-                                 pitch=parts[3],
-                                 onset_velocity=int(parts[4]),
-                                 offset_velocity=int(parts[5]),
-                                 channel=int(parts[6]),
-                                 match_status=parts[7],
-                                 score_time=float(parts[8]),
-                                 score_note_id=parts[9],
-                                 error_index=int(parts[10]),
-                                 skip_index=parts[11],
-                                 )
-                if parts[9] == '*':
-                    self.extra_notes.append(note.id)
-                else:
-                    # Store the note in the dictionary indexed by onset_time (ID)
-                    self.matched_notes.append(note.id)
-                self.notes[note.id] = note
-                self.ordered_notes.append(note.id)
-            except ValueError:
-                print("A Match File is expected. Format error.")
+        self.table = None
 
     def parse_file(self, filepath):
-        with open(filepath, "r") as file:
-            for line in file:
-                self._parse_line(line)
-        for _, value in self.notes.items():
-            self.score_map[value.score_note_id] = value
+        self.table = table = parse_match(filepath)
+        self.version = table.header.get('version', '')
+        self.score = table.header.get('score', '')
+        self.perf = table.header.get('perf', '')
+        self.fmt3x = table.header.get('fmt3x', '')
+        self.missing_notes = table.missing_notes
+        self.notes = _LazyNotes(lambda: table.index, table.to_match_note)
+        self.score_map = _LazyNotes(lambda: table.score_index, table.to_match_note)
+        self.ordered_notes = table.ids
+        is_extra = table.is_extra().tolist()
+        self.extra_notes = list(itertools.compress(table.ids, is_extra))
+        self.matched_notes = list(itertools.compress(table.ids, [not e for e in is_extra]))
 
     def count_aligned_midi(self):
         if not self.matched_notes:
@@ -224,36 +486,32 @@ class MatchParser:
     def to_json(self):
         return {key: asdict(value) for key, value in self.notes.items()}
 
+    def note_columns(self, note_ids, by_score_id=False):
+        """
+        :param note_ids:    performed note IDs, or score note IDs if by_score_id
+        :param by_score_id:
+        :return: (MIDI pitch, onset velocity, channel, onset time, offset time) arrays of the notes
+        """
+        if self.table is None:
+            notes = [(self.score_map if by_score_id else self.notes)[e] for e in note_ids]
+            return (pitch_names_to_midi([e.pitch for e in notes]), *(
+                np.array([getattr(e, k) for e in notes]) for k in ('onset_velocity', 'channel', 'onset_time',
+                                                                  'offset_time')))
+        index = self.table.score_index if by_score_id else self.table.index
+        rows = np.fromiter(map(index.__getitem__, note_ids), dtype=np.int64, count=len(note_ids))
+        notes = self.table.notes[rows]
+        return (self.table.midi_pitches()[rows], notes['onset_velocity'], notes['channel'], notes['onset_time'],
+                notes['offset_time'])
+
     def to_midi(self, fpath, matched_only=True):
-        midi = mido.MidiFile()
-        track = mido.MidiTrack()
-        midi.tracks.append(track)
         tempo = 500000  # Default 120 bpm - microseconds per beat
-        ticks_per_beat = midi.ticks_per_beat
-        if matched_only:
-            noteid_list = self.matched_notes
-        else:
-            noteid_list = self.ordered_notes
-
-        # Create absolute-time based MIDI events, then sort and convert to delta time
-        midi_list = []
-        for nid in noteid_list:
-            note = self.notes[nid]
-            midi_list.append(
-                mido.Message(type='note_on', note=pitch_name_to_midi(note.pitch),
-                             velocity=note.onset_velocity, channel=note.channel,
-                             time=seconds_to_ticks(seconds=note.onset_time, tempo=tempo, ticks_per_beat=ticks_per_beat)
-                             ))
-            midi_list.append(
-                mido.Message(type='note_off', note=pitch_name_to_midi(note.pitch),
-                             velocity=note.onset_velocity, channel=note.channel,
-                             time=seconds_to_ticks(seconds=note.offset_time, tempo=tempo, ticks_per_beat=ticks_per_beat)
-                             ))
-        midi_list.sort(key=lambda e: (e.time, e.note))
-        convert_abs_to_delta_time(midi_list)
-        for e in midi_list:
-            track.append(e)
-        midi.save(fpath)
+        ticks_per_beat = 480
+        pitch, velocity, channel, onset_time, offset_time = self.note_columns(
+            self.matched_notes if matched_only else self.ordered_notes)
+        onset = seconds_to_ticks_array(onset_time, tempo=tempo, ticks_per_beat=ticks_per_beat)
+        offset = seconds_to_ticks_array(offset_time, tempo=tempo, ticks_per_beat=ticks_per_beat)
+        save_note_tracks(fpath, [note_track_events(pitch, velocity, onset, offset, channel)],
+                         ticks_per_beat=ticks_per_beat)
 
 
 def create_match_midi_map(match_info: MatchParser, performance: mido.MidiFile):
@@ -272,36 +530,58 @@ def create_match_midi_map(match_info: MatchParser, performance: mido.MidiFile):
     if len(match_info.notes) != len(perf_notes):
         raise Exception(f"Unequal note events between "
                         f"MIDI ({len(perf_notes)}) and match info ({len(match_info.notes)})!")
+    if match_info.table is not None:
+        pitches = match_info.table.midi_pitches().tolist()
+    else:
+        pitches = [pitch_name_to_midi(match_info.notes[e].pitch) for e in match_info.ordered_notes]
     for i, e in enumerate(match_info.ordered_notes):
-        pitch = pitch_name_to_midi(match_info.notes[e].pitch)
-        assert pitch == perf_notes[i].pitch
+        assert pitches[i] == perf_notes[i].pitch
         perf_notes[i].id = e
     return perf_notes, perf_bpms
 
 
-def create_fmt3x_mapping(score_info: ScoreParser, pno_pitches, onsets):
+LOGGED_NOTES = 5  # Notes listed in a log message, the others are only counted
+
+
+def create_fmt3x_mapping(score_info: ScoreParser, pno_pitches, onsets, errors: dict = None):
     """
-    Update pno_pitches's ID in place
+    Update pno_pitches's ID in place: notes of the i-th onset group are matched by MIDI pitch with the notes of the
+    i-th chord of the score. Score notes sharing a pitch in a chord are assigned in order.
     :param score_info:
-    :param pno_pitches:
+    :param pno_pitches: sorted by onset
     :param onsets:
+    :param errors:  if given, receives the full 'duplicates' and 'unmatched' note lists (only counts and the first
+        LOGGED_NOTES notes are logged)
     :return:
     """
-    score_cursor = 0
-    curr_perf_onset = pno_pitches[0].onset
-    # Logic: match each onset groups
-    for i, e in enumerate(pno_pitches):
-        if curr_perf_onset != onsets[i]:
-            curr_perf_onset = onsets[i]
-            score_cursor += 1
-        score_notes = score_info.sorted_notes[score_cursor]
-        for note in score_notes:
-            if pitch_name_to_midi(score_info.notes[note].pitch) == e.pitch:
-                e.id = score_info.notes[note].id
-                continue
-        if e.id is None:
-            # Each loop must create an exact mapping.
-            logger.error("Found unmatched note: ", e)
+    pitch_index = score_info.pitch_index
+    used = {}  # (onset group, pitch) -> number of performed notes mapped so far
+    unmatched, duplicates = [], []
+    group = 0
+    curr_perf_onset = onsets[0] if len(onsets) else None
+    for e, onset in zip(pno_pitches, onsets):
+        if onset != curr_perf_onset:
+            curr_perf_onset = onset
+            group += 1
+        key = (group, e.pitch)
+        ids = pitch_index.get(key)
+        if ids is None:
+            if e.id is None:
+                unmatched.append(e)
+            continue
+        k = used.get(key, 0)
+        used[key] = k + 1
+        if k >= len(ids):
+            duplicates.append(e)
+        e.id = ids[min(k, len(ids) - 1)]
+    if duplicates:
+        logger.warn(f"{len(duplicates)} notes mapped to a score note already used, first ones:",
+                    duplicates[:LOGGED_NOTES])
+    if unmatched:
+        # Each loop must create an exact mapping.
+        logger.error(f"Found {len(unmatched)} unmatched notes, first ones:", unmatched[:LOGGED_NOTES])
+    if errors is not None:
+        errors.update(duplicates=duplicates, unmatched=unmatched)
     return pno_pitches
 
 
@@ -349,28 +629,69 @@ result: [key IOI], [sgmt IOI]
 """
 
 
-def calculate_perf_ioi(pno_seq: PnenoSeq, score_info: ScoreParser, match_info: MatchParser):
-    # Obtain performed key pitches & aligned segments
-    perf_key_onsets = []
-    key_sgmt_ioi = []
+def _segment_notes(pno_seq: PnenoSeq):
+    """
+    :return: (key notes, accompaniment notes segment by segment, offsets): the accompaniment of segment i is
+        sgmt_notes[offsets[i]:offsets[i + 1]]
+    """
+    keys = [e.key for e in pno_seq.seq]
+    sgmt_notes = list(itertools.chain.from_iterable(e.sgmt for e in pno_seq.seq))
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    np.cumsum([len(e.sgmt) for e in pno_seq.seq], out=offsets[1:])
+    return keys, sgmt_notes, offsets
+
+
+def _performed_onsets(match_info: MatchParser, notes):
+    """
+    :return: performed onset (seconds) of every score note, gathered from the match table by note ID
+    """
+    note_ids = list(map(operator.attrgetter('id'), notes))
+    assert None not in note_ids
+    table = match_info.table
+    if table is None:
+        return np.array([match_info.score_map[e].onset_time for e in note_ids], dtype=np.float64)
+    rows = np.fromiter(map(table.score_index.__getitem__, note_ids), dtype=np.int64, count=len(note_ids))
+    return table.notes['onset_time'][rows]
+
+
+def _segment_ioi(onsets: np.ndarray, offsets: np.ndarray):
+    """
+    Vectorized convert_onsets_to_ioi of every segment: the first IOI of a segment is 0
+    """
+    ioi = np.diff(onsets, prepend=onsets[:1])
+    ioi[offsets[:-1][np.diff(offsets) > 0]] = 0
+    return ioi
+
+
+def _split_segments(values: np.ndarray, offsets: np.ndarray):
+    return [e.tolist() for e in np.split(values, offsets[1:-1])]
+
+
+def perf_ioi_arrays(pno_seq: PnenoSeq, score_info: ScoreParser, match_info: MatchParser):
+    """
+    Array form of calculate_perf_ioi
+    :return: (key IOI, segment IOI, segment offsets): the IOIs of segment i are sgmt_ioi[offsets[i]:offsets[i + 1]]
+    """
     if len(match_info.matched_notes) != len(score_info.notes):
         logger.warn("Imperfect alignment. IOI calculation may be influenced. Alignment rate:",
                     len(match_info.matched_notes) / len(score_info.notes))
-    for e in pno_seq.seq:
-        sgmt_onsets = []
-        assert e.key.id is not None
-        key_onset = match_info.score_map[e.key.id].onset_time
-        perf_key_onsets.append(key_onset)
-        for j, note in enumerate(e.sgmt):
-            sgmt_pitch_onset = match_info.score_map[note.id].onset_time - key_onset
-            if sgmt_pitch_onset < 0:
-                logger.debug(f"Segment {j}'s onset is earlier than key onset.")
-                sgmt_pitch_onset = 0
-            sgmt_onsets.append(sgmt_pitch_onset)
+    keys, sgmt_notes, offsets = _segment_notes(pno_seq)
+    key_onsets = _performed_onsets(match_info, keys)
+    sgmt_onsets = _performed_onsets(match_info, sgmt_notes) - np.repeat(key_onsets, np.diff(offsets))
+    early = sgmt_onsets < 0
+    if early.any():
+        logger.debug(f"{np.count_nonzero(early)} segment notes are earlier than their key onset.")
+        sgmt_onsets[early] = 0
+    key_ioi = _segment_ioi(key_onsets, np.array([0, len(key_onsets)]))
+    return key_ioi, _segment_ioi(sgmt_onsets, offsets), offsets
 
-        key_sgmt_ioi.append(convert_onsets_to_ioi(sgmt_onsets))
 
-    return convert_onsets_to_ioi(perf_key_onsets), key_sgmt_ioi
+def calculate_perf_ioi(pno_seq: PnenoSeq, score_info: ScoreParser, match_info: MatchParser):
+    """
+    :return: ([key IOI], [[segment IOI]]) in seconds. Segment IOIs are relative to the key onset
+    """
+    key_ioi, sgmt_ioi, offsets = perf_ioi_arrays(pno_seq, score_info, match_info)
+    return key_ioi.tolist(), _split_segments(sgmt_ioi, offsets)
 
 
 class MIDIAlignmentParser:
@@ -398,32 +719,35 @@ class MIDIAlignmentParser:
         self.pneno_seq = create_pneno_seq_from_midi(self.score)
         create_fmt3x_map_from_pnoseq(self.score_info, self.pneno_seq)
 
+    def performed_pno_ioi_ratio_arrays(self):
+        """
+        Array form of calculate_performed_pno_ioi_ratio
+        :return: (key IOI ratio, segment IOI ratio, segment offsets): the ratios of segment i are
+            sgmt_ratio[offsets[i]:offsets[i + 1]]
+        """
+        seq = self.pneno_seq
+        key_ioi, sgmt_ioi, offsets = perf_ioi_arrays(seq, self.score_info, self.match_info)
+        key_onsets = np.array(seq.to_onset_list(), dtype=np.int64)
+        score_key_ioi = seq.ticks_to_seconds(np.diff(key_onsets, prepend=key_onsets[:1] - IOI_PLACEHOLDER) -
+                                             IOI_PLACEHOLDER)
+        _, sgmt_notes, _ = _segment_notes(seq)
+        sgmt_onsets = np.fromiter(map(operator.attrgetter('onset'), sgmt_notes), dtype=np.int64, count=len(sgmt_notes))
+        score_sgmt_ioi = seq.ticks_to_seconds(_segment_ioi(sgmt_onsets, offsets))
+        assert len(key_ioi) == len(score_key_ioi) == len(offsets) - 1
+
+        performed = key_ioi != 0
+        if (score_key_ioi[performed] == 0).any():
+            raise ZeroDivisionError("Performed key IOI over a score IOI of 0")
+        key_ioi_ratio = np.divide(key_ioi, score_key_ioi, out=np.ones(len(key_ioi)), where=performed)
+        sgmt_ioi_ratio = np.divide(sgmt_ioi, score_sgmt_ioi, out=np.ones(len(sgmt_ioi)), where=score_sgmt_ioi != 0)
+        return key_ioi_ratio, sgmt_ioi_ratio, offsets
+
     def calculate_performed_pno_ioi_ratio(self):
-        score_key_ioi_list = [self.pneno_seq.ticks_to_seconds(e - IOI_PLACEHOLDER) for e in
-                              self.pneno_seq.to_ioi_list()]
-        score_sgmt_ioi_list = []
-        for e in self.pneno_seq.seq:
-            onsets = [p.onset for p in e.sgmt]
-            ioi = convert_onsets_to_ioi(onsets)
-            score_sgmt_ioi_list.append([self.pneno_seq.ticks_to_seconds(i) for i in ioi])
-
-        key_ioi_list, sgmt_ioi_list = calculate_perf_ioi(self.pneno_seq, self.score_info, self.match_info)
-
-        # Calculate key IOI ratio:
-        key_ioi_ratio = []
-        for i, e in enumerate(key_ioi_list):
-            key_ioi_ratio.append(e / score_key_ioi_list[i] if e != 0 else 1)
-
-        # Calculate segment IOI ratio:
-        sgmt_ioi_ratio = []
-        for i, sgmt in enumerate(sgmt_ioi_list):
-            sgmt_ratio = []
-            for j, p in enumerate(sgmt):
-                sgmt_ratio.append(p / score_sgmt_ioi_list[i][j] if score_sgmt_ioi_list[i][j] != 0 else 1)
-            sgmt_ioi_ratio.append(sgmt_ratio)
-
-        assert len(key_ioi_ratio) == len(score_key_ioi_list) == len(sgmt_ioi_ratio)
-        return key_ioi_ratio, sgmt_ioi_ratio
+        """
+        :return: ([key IOI ratio], [[segment IOI ratio]]), performed over score IOI. 1 where an IOI is 0
+        """
+        key_ioi_ratio, sgmt_ioi_ratio, offsets = self.performed_pno_ioi_ratio_arrays()
+        return key_ioi_ratio.tolist(), _split_segments(sgmt_ioi_ratio, offsets)
 
     def get_performed_key_notes(self):
         keys = [e.key.id for e in self.pneno_seq]
@@ -435,49 +759,23 @@ class MIDIAlignmentParser:
         :param fpath:
         :return:
         """
-        out_midi = []
-        midi = mido.MidiFile()
-        main = mido.MidiTrack()
-        acc = mido.MidiTrack()
-        midi.tracks.append(main)
-        midi.tracks.append(acc)
         tempo = 500000  # Default 120 bpm - microseconds per beat
-        ticks_per_beat = midi.ticks_per_beat
-
-        # Create absolute-time based MIDI events, then sort and convert to delta time
-        key_midi_list = []
-        acc_midi_list = []
-
-        for sgmt in self.pneno_seq:
-            key_note = self.match_info.score_map[sgmt.key.id]
-            key_midi_list.extend(
-                note_to_midi(pitch=pitch_name_to_midi(key_note.pitch), velocity=key_note.onset_velocity,
-                             channel=key_note.channel,
-                             onset=seconds_to_ticks(seconds=key_note.onset_time, tempo=tempo,
-                                                    ticks_per_beat=ticks_per_beat),
-                             offset=seconds_to_ticks(seconds=key_note.offset_time, tempo=tempo,
-                                                     ticks_per_beat=ticks_per_beat)))
-            sgmt_notes = [self.match_info.score_map[e.id] for e in sgmt.sgmt]
-            for e in sgmt_notes:
-                acc_midi_list.extend(
-                    note_to_midi(pitch=pitch_name_to_midi(e.pitch), velocity=e.onset_velocity, channel=e.channel,
-                                 onset=seconds_to_ticks(seconds=e.onset_time, tempo=tempo,
-                                                        ticks_per_beat=ticks_per_beat),
-                                 offset=seconds_to_ticks(seconds=e.offset_time, tempo=tempo,
-                                                         ticks_per_beat=ticks_per_beat)))
-        key_midi_list.sort(key=lambda e: (e.time, e.note))
-        acc_midi_list.sort(key=lambda e: (e.time, e.note))
-        convert_abs_to_delta_time(key_midi_list)
-        convert_abs_to_delta_time(acc_midi_list)
-        for e in key_midi_list:
-            main.append(e)
-        for e in acc_midi_list:
-            acc.append(e)
-        midi.save(fpath)
+        ticks_per_beat = 480
+        keys, sgmt_notes, _ = _segment_notes(self.pneno_seq)
+        tracks = []
+        for notes in (keys, sgmt_notes):
+            pitch, velocity, channel, onset_time, offset_time = self.match_info.note_columns(
+                [e.id for e in notes], by_score_id=True)
+            onset = seconds_to_ticks_array(onset_time, tempo=tempo, ticks_per_beat=ticks_per_beat)
+            offset = seconds_to_ticks_array(offset_time, tempo=tempo, ticks_per_beat=ticks_per_beat)
+            tracks.append(note_track_events(pitch, velocity, onset, offset, channel))
+        save_note_tracks(fpath, tracks, ticks_per_beat=ticks_per_beat)
 
 
 def plot_bpm_ratio(bpm_ratio_list, time_list,
                    key_velocity_list=None, sgmt_bpm_ratio_list=None, sgmt_time_list=None, labels=None):
+    import matplotlib.pyplot as plt  # Plotting only: keep matplotlib out of the realtime path
+    import matplotlib.cm as cm
     plt.plot(time_list, bpm_ratio_list, color='gray', linestyle='-', linewidth=1, label='BPM Ratio')
     if key_velocity_list is not None:
         norm = plt.Normalize(min(key_velocity_list), max(key_velocity_list))
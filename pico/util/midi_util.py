@@ -1,6 +1,7 @@
 import mido
+import numpy as np
 import os
-import pickle
+import struct
 
 
 def is_note_on(m: mido.Message):
@@ -15,6 +16,26 @@ def is_note(m: mido.Message):
     return is_note_on(m) or is_note_off(m)
 
 
+def raw_output_sender(port: mido.ports.BaseOutput):
+    """
+    Send channel messages as bytes, skipping the mido.Message that port.send would build, copy and serialize again.
+    Relies on the private attributes of mido's rtmidi Output (the python-rtmidi MidiOut `_rt` and `_send_lock`), hence
+    the mido version pinned in requirements.txt (see test_midi_util.test_rtmidi_backend_attributes)
+    :return: function of (status, data1, data2) for ports of the rtmidi backend, None for other ports
+    """
+    rt, lock = getattr(port, '_rt', None), getattr(port, '_send_lock', None)
+    if rt is None or lock is None or not hasattr(rt, 'send_message'):
+        return None
+
+    def send(status, data1, data2):
+        if port.closed:
+            raise ValueError('send() called on closed port')
+        with lock:  # As the rtmidi Output.send
+            rt.send_message([status, data1, data2])
+
+    return send
+
+
 def convert_abs_to_delta_time(midi_list: list[mido.Message]):
     """
     Convert absolute time to delta time [In Place]
@@ -70,50 +91,77 @@ def seconds_to_ticks(seconds, tempo=500_000, ticks_per_beat=480):
     return int(round(seconds * (ticks_per_beat * 1_000_000) / tempo))
 
 
+_NOTE_SEMITONES = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+_ACCIDENTALS = {'': 0, '#': 1, 'b': -1, '##': 2, 'x': 2, 'bb': -2}
+_SHARP_CLASSES = ('C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B')
+_FLAT_CLASSES = ('C', 'Db', 'D', 'Eb', 'E', 'F', 'Gb', 'G', 'Ab', 'A', 'Bb', 'B')
+
+# Names of the 128 MIDI pitches, C4 = 60
+SHARP_PITCH_NAMES = tuple(f"{_SHARP_CLASSES[m % 12]}{m // 12 - 1}" for m in range(128))
+FLAT_PITCH_NAMES = tuple(f"{_FLAT_CLASSES[m % 12]}{m // 12 - 1}" for m in range(128))
+
+# Every spelling of octaves -1 to 9 (upper or lower case step, double accidentals as ##, x or bb) -> MIDI pitch.
+# Names outside of the MIDI range are kept (e.g. Cb-1 = -1), as pitch_name_to_midi does not check the range.
+PITCH_NAME_TO_MIDI = {f"{step}{acc}{octave}": 12 * (octave + 1) + semitone + shift
+                      for name, semitone in _NOTE_SEMITONES.items() for step in (name, name.lower())
+                      for acc, shift in _ACCIDENTALS.items() for octave in range(-1, 10)}
+
+
 def midi_to_pitch_name(midi: int, all_sharp=True):
-    midi_map = {
-        0: 'C',
-        2: 'D',
-        4: 'E',
-        5: 'F',
-        7: 'G',
-        9: 'A',
-        11: 'B',
-    }
+    if 0 <= midi < 128:
+        return SHARP_PITCH_NAMES[midi] if all_sharp else FLAT_PITCH_NAMES[midi]
     assert midi >= 0
-    octave = midi // 12 - 1  # C4 = 60
-    base = midi % 12
-    if base in midi_map.keys():
-        return f"{midi_map[base]}{octave}"
-    # Now determine flat or sharp
-    if all_sharp:
-        return f"{midi_map[base - 1]}#{octave}"
-    else:
-        return f"{midi_map[base + 1]}b{octave}"
+    return f"{(_SHARP_CLASSES if all_sharp else _FLAT_CLASSES)[midi % 12]}{midi // 12 - 1}"
 
 
 def pitch_name_to_midi(pname: str):
-    note_map = {
-        'C': 0,
-        'D': 2,
-        'E': 4,
-        'F': 5,
-        'G': 7,
-        'A': 9,
-        'B': 11
-    }
-    base = pname[0].upper()
-    acc = None
-    if len(pname) > 2:
-        assert pname[1] in '#b'
-        acc = pname[1]
-        octave = int(pname[2:])
-    else:
-        octave = int(pname[1:])
-    semitone = note_map[base]
-    if acc:
-        semitone += 1 if acc == '#' else - 1
-    return (12 * (octave + 1)) + semitone
+    """
+    :param pname:   spelled pitch, e.g. C4, F#3, Bb2, Fx5, F##5, Ebb1
+    :raise ValueError: if pname is not a pitch name
+    """
+    midi = PITCH_NAME_TO_MIDI.get(pname)
+    if midi is not None:
+        return midi
+    # Octaves outside of the table
+    step = pname[:1].upper()
+    acc = pname[1:].rstrip('-0123456789')
+    octave = pname[1 + len(acc):]
+    if step not in _NOTE_SEMITONES or acc not in _ACCIDENTALS or not octave.lstrip('-').isdigit():
+        raise ValueError(f"Not a pitch name: {pname}")
+    return 12 * (int(octave) + 1) + _NOTE_SEMITONES[step] + _ACCIDENTALS[acc]
+
+
+def pitch_names_to_midi(pnames, invalid=None) -> np.ndarray:
+    """
+    Vectorized pitch_name_to_midi. Every distinct name is converted once.
+    :param pnames:  sequence or array of pitch names
+    :param invalid: MIDI value of the strings that are not pitch names. If None, they raise ValueError
+    :return: int64 array
+    """
+    pnames = pnames.tolist() if isinstance(pnames, np.ndarray) else pnames
+    table = {}
+    for name in dict.fromkeys(pnames):
+        try:
+            table[name] = pitch_name_to_midi(name)
+        except ValueError:
+            if invalid is None:
+                raise
+            table[name] = invalid
+    return np.fromiter(map(table.__getitem__, pnames), dtype=np.int64, count=len(pnames))
+
+
+def midi_to_pitch_names(midis, all_sharp=True) -> np.ndarray:
+    """
+    Vectorized midi_to_pitch_name for MIDI pitches 0 to 127
+    :param midis:   sequence or array of MIDI pitches
+    :param all_sharp:
+    :return: array of str
+    """
+    names = np.array(SHARP_PITCH_NAMES if all_sharp else FLAT_PITCH_NAMES)
+    midis = np.asarray(midis, dtype=np.int64)
+    if midis.size and (midis.min() < 0 or midis.max() > 127):
+        raise ValueError("MIDI pitches must be within 0 and 127")
+    return names[midis]
 
 
 def midi_list_to_midi(midi_list: list[mido.Message], ticks_per_beat=480, tempo=500_000):
@@ -133,17 +181,101 @@ def note_to_midi(pitch, velocity, onset, offset, channel):
     return mlist
 
 
+def seconds_to_ticks_array(seconds, tempo=500_000, ticks_per_beat=480) -> np.ndarray:
+    """
+    Vectorized seconds_to_ticks, with the same rounding
+    """
+    return np.round(np.asarray(seconds, dtype=np.float64) * (ticks_per_beat * 1_000_000) / tempo).astype(np.int64)
+
+
+def note_track_events(pitch, velocity, onset, offset, channel, off_velocity=None):
+    """
+    Note on/off events of notes, in the order of sorting the [note_on, note_off] messages of every note by
+    (time, note) with list.sort (ties keep the order of the notes)
+    :param pitch:
+    :param velocity:
+    :param onset:   absolute ticks
+    :param offset:  absolute ticks
+    :param channel:
+    :param off_velocity:    velocity of the note_off events, defaults to velocity
+    :return: (absolute ticks, status bytes, notes, velocities) arrays
+    """
+    pitch = np.asarray(pitch, dtype=np.int64)
+    velocity = np.asarray(velocity, dtype=np.int64)
+    off_velocity = velocity if off_velocity is None else np.asarray(off_velocity, dtype=np.int64)
+    channel = np.broadcast_to(np.asarray(channel, dtype=np.int64), pitch.shape)
+    for values, high in ((pitch, 127), (velocity, 127), (off_velocity, 127), (channel, 15)):
+        if values.size and (values.min() < 0 or values.max() > high):
+            raise ValueError(f"MIDI data out of range (0 to {high})")
+    times = np.column_stack([onset, offset]).astype(np.int64).reshape(-1)
+    status = np.column_stack([0x90 | channel, 0x80 | channel]).reshape(-1)
+    notes = np.repeat(pitch, 2)
+    velocities = np.column_stack([velocity, off_velocity]).reshape(-1)
+    order = np.lexsort((notes, times))  # Stable: ties keep the message order
+    return times[order], status[order], notes[order], velocities[order]
+
+
+def encode_note_track(times, status, data1, data2) -> bytes:
+    """
+    MTrk chunk of channel messages (two data bytes each), with variable-length delta times, running status and the
+    end_of_track meta message: the bytes mido writes for the same messages
+    :param times:   absolute ticks, non-decreasing
+    :param status:  status bytes
+    :param data1:
+    :param data2:
+    """
+    times = np.asarray(times, dtype=np.int64)
+    delta = np.diff(times, prepend=0)
+    if len(delta) and delta.min() < 0:
+        raise ValueError("Event times must be non-negative and sorted")
+    if len(delta) and delta.max() >= 1 << 28:
+        raise ValueError("Delta time too large for a MIDI file")
+    status = np.asarray(status, dtype=np.int64)
+    n_vlq = 1 + (delta >= 1 << 7) + (delta >= 1 << 14) + (delta >= 1 << 21)
+    running = np.zeros(len(status), dtype=bool)
+    running[1:] = status[1:] == status[:-1]
+    sizes = n_vlq + np.where(running, 2, 3)
+    starts = np.cumsum(sizes) - sizes
+    data = np.empty(int(sizes.sum()) + 4, dtype=np.uint8)
+    for k in range(4):
+        has = n_vlq > k
+        shift = 7 * (n_vlq[has] - 1 - k)
+        data[starts[has] + k] = ((delta[has] >> shift) & 0x7F) | np.where(shift > 0, 0x80, 0)
+    pos = starts + n_vlq
+    data[pos[~running]] = status[~running]
+    pos += ~running
+    data[pos] = data1
+    data[pos + 1] = data2
+    data[-4:] = (0x00, 0xFF, 0x2F, 0x00)  # end_of_track
+    return b'MTrk' + struct.pack('>L', len(data)) + data.tobytes()
+
+
+def save_note_tracks(path, tracks, ticks_per_beat=480, midi_type=1):
+    """
+    Write a MIDI file of note tracks without building mido messages
+    :param path:
+    :param tracks:  (times, status, data1, data2) of every track, see note_track_events
+    :param ticks_per_beat:
+    :param midi_type:
+    """
+    with open(path, 'wb') as f:
+        f.write(b'MThd' + struct.pack('>Lhhh', 6, midi_type, len(tracks), ticks_per_beat))
+        for e in tracks:
+            f.write(encode_note_track(*e))
+
+
 def perf_file_to_midi(perf_file, save_path=None):
     """
-    :param perf_file:  perf_data.pkl
+    :param perf_file:  perf_data.pnlog (or legacy perf_data.pkl)
     :param save_path:
     :return:
     """
+    from pico.pneno.session_log import load_performance_data  # Imported here to avoid a circular import
+
     if perf_file is None:
         return None, None
     assert os.path.exists(perf_file)
-    with open(perf_file, 'rb') as f:
-        data = pickle.load(f)
+    data = load_performance_data(perf_file)
 
     # deque of (time, msg, sgmt)
     ticks_per_beat = data['ticks_per_beat']
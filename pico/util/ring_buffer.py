@@ -0,0 +1,83 @@
+"""
+Fixed-capacity, time-windowed ring buffer for recent live input
+"""
+import threading
+import time
+
+
+class TimedRingBuffer:
+    """
+    Keeps the items appended during the last `window` seconds, up to `capacity` items (the oldest are overwritten).
+    Slots are preallocated and expired items are dropped when appending, so no cleaner is needed.
+    Appends and reads may come from different threads: reads return snapshots.
+    """
+
+    def __init__(self, capacity=1500, window=5.0, clock=time.perf_counter):
+        """
+        :param capacity:    maximum number of items
+        :param window:  seconds after which an item expires
+        :param clock:   clock in seconds, for items appended without a timestamp and for snapshots
+        """
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self.window = window
+        self.clock = clock
+        self._items = [None] * capacity
+        self._times = [0.0] * capacity
+        self._start = 0  # Index of the oldest item
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def __bool__(self):
+        return self._size > 0
+
+    def __iter__(self):
+        return iter(self.snapshot(None))
+
+    def _expire(self, now):
+        """Drop the items older than the window. Must be called with self._lock held."""
+        oldest = now - self.window
+        while self._size and self._times[self._start] < oldest:
+            self._items[self._start] = None
+            self._start = (self._start + 1) % self.capacity
+            self._size -= 1
+
+    def append(self, item, t=None):
+        """
+        :param item:
+        :param t:   timestamp of the item (defaults to now). Timestamps must be appended in increasing order.
+        """
+        t = self.clock() if t is None else t
+        with self._lock:
+            self._expire(t)
+            end = (self._start + self._size) % self.capacity
+            self._items[end] = item
+            self._times[end] = t
+            if self._size == self.capacity:
+                self._start = (self._start + 1) % self.capacity  # Overwrite the oldest item
+            else:
+                self._size += 1
+
+    def snapshot(self, seconds=0.0):
+        """
+        :param seconds: only items of the last `seconds` (relative to the clock); 0 for the whole window, None for
+            every stored item, including expired items not yet dropped
+        :return: list of (timestamp, item), oldest first
+        """
+        with self._lock:
+            indices = [(self._start + i) % self.capacity for i in range(self._size)]
+            entries = [(self._times[i], self._items[i]) for i in indices]
+        if seconds is None:
+            return entries
+        oldest = self.clock() - (seconds or self.window)
+        return [e for e in entries if e[0] >= oldest]
+
+    def clear(self):
+        with self._lock:
+            self._items = [None] * self.capacity
+            self._start = 0
+            self._size = 0